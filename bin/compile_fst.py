@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+
+"""
+Convert an FST into memory mappable arrays.
+"""
+
+import argparse
+
+from lvsr.ops import compile_fst
+
+
+def main(args):
+    compile_fst(args.fst_file, args.save_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Save the arcs of an FST as NumPy arrays in a directory "
+                    "that can be used as the LM path instead of the FST")
+    parser.add_argument("fst_file")
+    parser.add_argument("save_path")
+    args = parser.parse_args()
+    main(args)
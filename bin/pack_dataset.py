@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+"""
+Convert a Fuel HDF5 speech dataset into a memory mapped packed dataset.
+"""
+
+import argparse
+import logging
+
+from lvsr.datasets.packed import pack_hdf5
+
+
+def main(args):
+    pack_hdf5(args.h5file, args.save_path, sources=args.sources)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Save the sources of an HDF5 dataset as flat NumPy "
+                    "arrays in a directory that can be used with "
+                    "lvsr.datasets.packed.PackedAudioDataset")
+    parser.add_argument("h5file")
+    parser.add_argument("save_path")
+    parser.add_argument("--sources", nargs='*', default=None,
+                        help="Sources to convert, all by default")
+    args = parser.parse_args()
+    main(args)
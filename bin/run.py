@@ -50,7 +50,8 @@ if __name__ == "__main__":
         "test", parents=[params_parser],
         help="Evaluate speech model on a test set")
     init_norm_parser = subparsers.add_parser(
-        "init_norm")
+        "init_norm",
+        help="Compute the normalization of the recordings")
     show_data_parser = subparsers.add_parser(
         "show_data",
         help="Run IPython to show data")
@@ -60,6 +61,13 @@ if __name__ == "__main__":
     sample_parser = subparsers.add_parser(
         "sample", parents=[params_parser],
         help="Sample from the model")
+    score_parser = subparsers.add_parser(
+        "score",
+        help="Compute WER and CER of decoded utterances")
+    benchmark_data_parser = subparsers.add_parser(
+        "benchmark_data",
+        help="Measure the speed of reading shuffled examples with "
+             "different block sizes")
 
     train_parser.add_argument(
         "save_path", default="chain",
@@ -108,18 +116,76 @@ if __name__ == "__main__":
     search_parser.add_argument(
         "--nll-only", default=False, action="store_true",
         help="Only compute log-likelihood")
+    search_parser.add_argument(
+        "--workers", default=1, type=int,
+        help="Number of forked processes that decode shards of the data "
+             "(CPU only)")
     search_parser.add_argument(
         "--seed", default=1, type=int,
         help="Random generator seed (to get a random sample if train data "
              "is used)")
 
+    score_parser.add_argument(
+        "hypotheses",
+        help="Decoded characters, as saved by search --decoded-save")
+    score_parser.add_argument(
+        "references",
+        help="Reference words in the Kaldi text format")
+    score_parser.add_argument(
+        "--lexicon", default=None,
+        help="Lexicon to convert the decoded characters to words")
+    score_parser.add_argument(
+        "--report", default=None,
+        help="Directory to save the alignments and the summary")
+    score_parser.add_argument(
+        "--spc", default="<spc>",
+        help="The space token")
+    score_parser.add_argument(
+        "--ignore", default=["<NOISE>", "<noise>"], nargs='*',
+        help="Words excluded from scoring")
+    score_parser.add_argument(
+        "--workers", default=1, type=int,
+        help="Number of processes that score chunks of the utterances")
+    score_parser.add_argument(
+        "--chunk-size", default=100, type=int,
+        help="Number of utterances scored at once")
+
     init_norm_parser.add_argument(
         "save_path",
         help="The path to save the normalization")
+    init_norm_parser.add_argument(
+        "--workers", default=1, type=int,
+        help="Number of processes that compute statistics of shards "
+             "of the data")
+    init_norm_parser.add_argument(
+        "--subsample", default=1.0, type=float,
+        help="Share of randomly chosen utterances to use")
+    init_norm_parser.add_argument(
+        "--seed", default=1, type=int,
+        help="Random generator seed for subsampling")
+
+    benchmark_data_parser.add_argument(
+        "--part", default="train",
+        help="Data to read")
+    benchmark_data_parser.add_argument(
+        "--num-examples", default=1000, type=int,
+        help="Number of examples read for every block size. Examples read "
+             "before may be in the page cache, use a different seed or "
+             "drop the caches between runs")
+    benchmark_data_parser.add_argument(
+        "--block-sizes", default=[16, 64, 256], type=int, nargs='*',
+        help="Block sizes compared with reading examples one by one")
+    benchmark_data_parser.add_argument(
+        "--shuffle-window", default=None, type=int,
+        help="Number of examples shuffled together")
+    benchmark_data_parser.add_argument(
+        "--seed", default=1, type=int,
+        help="Random generator seed for shuffling")
 
     # Adds final positional arguments to all the subparsers
     for parser in [train_parser, test_parser, init_norm_parser,
-                   show_data_parser, search_parser, sample_parser]:
+                   show_data_parser, search_parser, sample_parser,
+                   benchmark_data_parser]:
         parser.add_argument(
             "--validate-config", help="Run pykwalify config validation",
             type=bool, default=True)
@@ -141,14 +207,22 @@ if __name__ == "__main__":
     test_parser.set_defaults(func='test')
     init_norm_parser.set_defaults(func='init_norm')
     show_data_parser.set_defaults(func='show_data')
+    benchmark_data_parser.set_defaults(func='benchmark_data')
     search_parser.set_defaults(func='search')
     sample_parser.set_defaults(func='sample')
+    score_parser.set_defaults(func='score')
     args = root_parser.parse_args().__dict__
 
     logging.basicConfig(
         level=args.pop('logging'),
         format="%(asctime)s: %(name)s: %(levelname)s: %(message)s")
 
-    import lvsr.main
-    config = prepare_config(args)
-    getattr(lvsr.main, args.pop('func'))(config, **args)
+    # Scoring needs neither a configuration nor Theano
+    if args['func'] == 'score':
+        import lvsr.scoring
+        args.pop('func')
+        lvsr.scoring.score(**args)
+    else:
+        import lvsr.main
+        config = prepare_config(args)
+        getattr(lvsr.main, args.pop('func'))(config, **args)
@@ -197,6 +197,9 @@ class GradientDescent(DifferentiableCostMinimizer):
         A passthrough to `theano.function` for additional arguments.
         Useful for passing `profile` or `mode` arguments to the theano
         function that will be compiled for the algorithm.
+    compile_function : callable, optional
+        Used instead of `theano.function` to compile the function, e.g.
+        to load it from a cache. Takes the same arguments.
 
     Attributes
     ----------
@@ -208,7 +211,7 @@ class GradientDescent(DifferentiableCostMinimizer):
     """
     def __init__(self, step_rule=None, gradients=None, known_grads=None,
                  consider_constant=None, on_unused_sources='raise',
-                 theano_func_kwargs=None, **kwargs):
+                 theano_func_kwargs=None, compile_function=None, **kwargs):
         if gradients:
             kwargs.setdefault("parameters", gradients.keys())
         super(GradientDescent, self).__init__(**kwargs)
@@ -240,6 +243,8 @@ class GradientDescent(DifferentiableCostMinimizer):
         self.on_unused_sources = on_unused_sources
         self.theano_func_kwargs = (theano_func_kwargs if theano_func_kwargs
                                    is not None else dict())
+        self.compile_function = (compile_function if compile_function
+                                 else theano.function)
 
     def initialize(self):
         logger.info("Initializing the training algorithm")
@@ -250,7 +255,7 @@ class GradientDescent(DifferentiableCostMinimizer):
         for parameter in self.parameters:
             all_updates.append((parameter, parameter - self.steps[parameter]))
         all_updates += self.step_rule_updates
-        self._function = theano.function(
+        self._function = self.compile_function(
             self.inputs, [], updates=all_updates, **self.theano_func_kwargs)
         logger.info("The training algorithm is initialized")
 
@@ -4,7 +4,7 @@ from six.moves import range
 
 import numpy
 from picklable_itertools.extras import equizip
-from theano import config, function, tensor
+from theano import clone, config, function, tensor
 
 from blocks.bricks.sequence_generators import BaseSequenceGenerator
 from blocks.filter import VariableFilter, get_application_call, get_brick
@@ -40,6 +40,24 @@ class BeamSearch(object):
         An output of a sampling computation graph built by
         :meth:`~blocks.brick.SequenceGenerator.generate`, the one
         corresponding to sampled sequences.
+    context_cache_size : int, optional
+        The number of copies of the contexts for different beam widths
+        kept during a batched search.
+    fused_step : bool, optional
+        If ``True``, a single function is compiled that computes the next
+        states from the chosen outputs together with the log
+        probabilities of the following outputs. The glimpses are then
+        computed once per step instead of once in each of the two
+        separate functions. ``False`` by default.
+    compile_function : callable, optional
+        Used instead of :func:`theano.function` to compile the functions,
+        e.g. to load them from a cache. Takes the same arguments.
+
+    Attributes
+    ----------
+    statistics : dict
+        Statistics of the last search: the number of steps made and
+        the number of bytes of the contexts copied for all the inputs.
 
     See Also
     --------
@@ -55,8 +73,14 @@ class BeamSearch(object):
     to work).
 
     """
-    def __init__(self, beam_size, samples):
+    def __init__(self, beam_size, samples, context_cache_size=4,
+                 fused_step=False, compile_function=None):
         self.beam_size = beam_size
+        self.context_cache_size = context_cache_size
+        self.fused_step = fused_step
+        self.compile_function = (compile_function if compile_function
+                                 else function)
+        self.statistics = {}
 
         # Extracting information from the sampling computation graph
         cg = ComputationGraph(samples)
@@ -91,11 +115,17 @@ class BeamSearch(object):
             if var:
                 self.input_state_names.append(name)
                 self.input_states.append(var[0])
+        self.glimpse_names = self.generator.transition.take_glimpses.outputs
+        self.glimpses = [
+            VariableFilter(
+                applications=[self.generator.transition.take_glimpses],
+                name=name, roles=[OUTPUT])(self.inner_cg)[0]
+            for name in self.glimpse_names]
 
         self.compiled = False
 
     def _compile_context_computer(self):
-        self.context_computer = function(
+        self.context_computer = self.compile_function(
             self.inputs, self.contexts, on_unused_input='ignore')
 
     def _compile_initial_state_computer(self):
@@ -103,10 +133,10 @@ class BeamSearch(object):
         initial_states = self.generator.initial_states(
                 1, as_dict=True,
                 **dict(equizip(self.context_names, self.contexts)))
-        self.initial_state_computer = function(
+        self.initial_state_computer = self.compile_function(
             self.contexts, initial_states, on_unused_input='ignore')
 
-    def _compile_next_state_computer(self):
+    def _get_next_states(self):
         next_states = [VariableFilter(bricks=[self.generator],
                                       name=name,
                                       roles=[OUTPUT])(self.inner_cg)[-1]
@@ -114,31 +144,75 @@ class BeamSearch(object):
         next_outputs = VariableFilter(
             applications=[self.generator.readout.emit], roles=[OUTPUT])(
                 self.inner_cg.variables)
-        self.next_state_computer = function(
-            self.contexts + self.input_states + next_outputs, next_states,
-            # This is temporarily required because `lm_logprobs` is a weird
-            # state which is not used to compute next state, but used to
-            # compute the next output.
-            on_unused_input='ignore')
+        return next_states, next_outputs
 
-    def _compile_logprobs_computer(self):
+    def _get_logprobs(self):
         # This filtering should return identical variables
         # (in terms of computations) variables, and we do not care
         # which to use.
         readouts = VariableFilter(
             applications=[self.generator.readout.readout],
             roles=[OUTPUT])(self.inner_cg)[0]
-        costs = self.generator.readout.costs(readouts)
-        self.logprobs_computer = function(
-            self.contexts + self.input_states, costs,
+        return self.generator.readout.costs(readouts)
+
+    def _compile_next_state_computer(self):
+        next_states, next_outputs = self._get_next_states()
+        self.next_state_computer = self.compile_function(
+            self.contexts + self.input_states + next_outputs, next_states,
+            # This is temporarily required because `lm_logprobs` is a weird
+            # state which is not used to compute next state, but used to
+            # compute the next output.
+            on_unused_input='ignore')
+
+    def _compile_logprobs_computer(self):
+        self.logprobs_computer = self.compile_function(
+            self.contexts + self.input_states, self._get_logprobs(),
+            on_unused_input='ignore')
+
+    def _compile_step_computers(self):
+        next_states, next_outputs = self._get_next_states()
+        logprobs = self._get_logprobs()
+        # The glimpses and the outputs become inputs of the step function:
+        # the former were computed at the previous step together with the
+        # log probabilities, the latter are chosen by the search.
+        # The contexts and the states are not leaves of the inner graph,
+        # which is why they are replaced by new variables too: `clone`
+        # would copy them together with the computations they depend on.
+        context_inputs, state_inputs, glimpse_inputs, output_inputs = [
+            [variable.type(variable.name) for variable in variables]
+            for variables in [self.contexts, self.input_states,
+                              self.glimpses, next_outputs]]
+        next_states = clone(
+            next_states,
+            replace=dict(equizip(
+                self.contexts + self.input_states + self.glimpses +
+                next_outputs,
+                context_inputs + state_inputs + glimpse_inputs +
+                output_inputs)))
+        next_state_dict = dict(equizip(self.state_names, next_states))
+        next_logprobs_and_glimpses = clone(
+            [logprobs] + self.glimpses,
+            replace=dict(equizip(
+                self.contexts + self.input_states,
+                context_inputs +
+                [next_state_dict[name] for name in self.input_state_names])))
+        self.first_step_computer = self.compile_function(
+            self.contexts + self.input_states, [logprobs] + self.glimpses,
+            on_unused_input='ignore')
+        self.step_computer = self.compile_function(
+            context_inputs + state_inputs + glimpse_inputs + output_inputs,
+            next_states + next_logprobs_and_glimpses,
             on_unused_input='ignore')
 
     def compile(self):
         """Compile all Theano functions used."""
         self._compile_context_computer()
         self._compile_initial_state_computer()
-        self._compile_next_state_computer()
-        self._compile_logprobs_computer()
+        if self.fused_step:
+            self._compile_step_computers()
+        else:
+            self._compile_next_state_computer()
+            self._compile_logprobs_computer()
         self.compiled = True
 
     def compute_contexts(self, inputs):
@@ -217,6 +291,66 @@ class BeamSearch(object):
                                                  input_states + [outputs]))
         return OrderedDict(equizip(self.state_names, next_values))
 
+    def compute_first_step(self, contexts, states):
+        """Computes the log probabilities and the glimpses of a step.
+
+        Only available when the search was created with `fused_step`.
+
+        Parameters
+        ----------
+        contexts : dict
+            A {name: :class:`numpy.ndarray`} dictionary of contexts.
+        states : dict
+            A {name: :class:`numpy.ndarray`} dictionary of states.
+
+        Returns
+        -------
+        A {name: :class:`numpy.ndarray`} dictionary with the log
+        probabilities of all possible outputs as `logprobs` and the
+        glimpses ordered like `self.glimpse_names`.
+
+        """
+        input_states = [states[name] for name in self.input_state_names]
+        values = self.first_step_computer(*(list(contexts.values()) +
+                                            input_states))
+        return OrderedDict(equizip(['logprobs'] + self.glimpse_names,
+                                   values))
+
+    def compute_step(self, contexts, states, glimpses, outputs):
+        """Computes next states and the next step log probabilities.
+
+        Only available when the search was created with `fused_step`.
+
+        Parameters
+        ----------
+        contexts : dict
+            A {name: :class:`numpy.ndarray`} dictionary of contexts.
+        states : dict
+            A {name: :class:`numpy.ndarray`} dictionary of states.
+        glimpses : dict
+            A {name: :class:`numpy.ndarray`} dictionary of glimpses
+            computed from `states`, as returned by this method or
+            :meth:`compute_first_step`.
+        outputs : :class:`numpy.ndarray`
+            A :class:`numpy.ndarray` of this step outputs.
+
+        Returns
+        -------
+        A tuple of a {name: numpy.array} dictionary of next states and a
+        dictionary like the one returned by :meth:`compute_first_step`
+        for these next states.
+
+        """
+        input_states = [states[name] for name in self.input_state_names]
+        input_glimpses = [glimpses[name] for name in self.glimpse_names]
+        values = self.step_computer(*(list(contexts.values()) +
+                                      input_states + input_glimpses +
+                                      [outputs]))
+        num_states = len(self.state_names)
+        return (OrderedDict(equizip(self.state_names, values[:num_states])),
+                OrderedDict(equizip(['logprobs'] + self.glimpse_names,
+                                    values[num_states:])))
+
     @staticmethod
     def _smallest(matrix, k):
         """Find k smallest elements of a matrix.
@@ -255,10 +389,7 @@ class BeamSearch(object):
         input_values : dict
             A {:class:`~theano.Variable`: :class:`~numpy.ndarray`}
             dictionary of input values. The shapes should be
-            the same as if you ran sampling with batch size equal to
-            `beam_size`. Put it differently, the user is responsible
-            for duplicaling inputs necessary number of times, because
-            this class has insufficient information to do it properly.
+            the same as if you ran sampling with batch size equal to one.
         eol_symbol : int
             End of sequence symbol, the search stops when the symbol is
             generated.
@@ -283,103 +414,329 @@ class BeamSearch(object):
             A list of the costs for the `outputs`, where cost is the
             negative log-likelihood.
 
+        """
+        result, = self.search_batch(
+            input_values, eol_symbol, max_length,
+            ignore_first_eol=ignore_first_eol, as_arrays=as_arrays,
+            char_discount=char_discount, round_to_inf=round_to_inf,
+            stop_on=stop_on,
+            validate_solution_function=validate_solution_function)
+        if result is None:
+            raise CandidateNotFoundError()
+        return result
+
+    def search_batch(self, input_values, eol_symbol, max_lengths,
+                     ignore_first_eol=False, as_arrays=False,
+                     char_discount=0, round_to_inf=1e9,
+                     stop_on='patience',
+                     validate_solution_function=None):
+        """Performs beam search for a batch of inputs at once.
+
+        The hypotheses for all the inputs are stacked into the same state
+        matrices, such that every search step makes a single call of each
+        compiled function. Every input keeps its own contexts, list of
+        finished hypotheses and stopping criterion.
+
+        Parameters
+        ----------
+        input_values : dict
+            A {:class:`~theano.Variable`: :class:`~numpy.ndarray`}
+            dictionary of input values. The shapes should be the same
+            as if you ran sampling for the whole batch, i.e. inputs of
+            different lengths have to be padded and masked.
+        max_lengths : int or sequence of ints
+            Maximum sequence length for every input.
+
+        The other parameters are the same as in :meth:`search`.
+
+        Returns
+        -------
+        A list of the results of :meth:`search` for every input. For
+        inputs for which no candidate was found ``None`` is returned.
+
         """
         if not self.compiled:
             self.compile()
 
         contexts = self.compute_contexts(input_values)
+        batch_size = list(contexts.values())[0].shape[1]
+        max_lengths = numpy.zeros(batch_size, dtype='int64') + max_lengths
+        # Initial states do not depend on the input, which is why they are
+        # computed for one input and copied for the others.
+        states = OrderedDict(
+            (name, numpy.repeat(value, batch_size, axis=0))
+            for name, value in self.compute_initial_states(contexts).items())
+        # The number of the input every hypothesis belongs to.
+        owners = numpy.arange(batch_size)
+        self.statistics = {'num_steps': 0, 'context_bytes_copied': 0}
+        self._context_cache = OrderedDict()
         large_contexts = OrderedDict(contexts)
-        states = self.compute_initial_states(contexts)
-
-        # This array will store all generated outputs, including those from
-        # previous step and those from already finished sequences.
-        all_outputs = states['outputs'][None, :]
-        all_costs = numpy.zeros_like(all_outputs, dtype=config.floatX)
-
-        done = []
-        min_cost = 1000
-
-        for i in range(max_length):
-            if len(states.values()[0].flatten()) == 0:
+        large_owners = owners
+
+        # Outputs, costs and backpointers of the hypotheses of every step
+        # are stored in preallocated arrays. Row `i` holds the hypotheses
+        # chosen at the step `i`, `parents[i, j]` is the column of
+        # the hypothesis at the row `i - 1` that was continued to obtain
+        # the j-th one. Sequences are only reconstructed for finished
+        # hypotheses.
+        max_steps = max_lengths.max()
+        width = batch_size * max(self.beam_size, 1)
+        all_outputs = numpy.zeros((max_steps + 1, width),
+                                  dtype=states['outputs'].dtype)
+        all_costs = numpy.zeros((max_steps + 1, width), dtype=config.floatX)
+        parents = numpy.zeros((max_steps + 1, width), dtype='int64')
+        all_outputs[0, :batch_size] = states['outputs']
+        # The columns of the unfinished hypotheses in the last filled row
+        positions = numpy.arange(batch_size)
+
+        searches = [_SingleSearch(self.beam_size, max_length, char_discount,
+                                  stop_on)
+                    for max_length in max_lengths]
+        # With the fused step function the log probabilities and
+        # the glimpses are computed one step ahead and have to be
+        # rearranged together with the states.
+        ahead = OrderedDict()
+        if self.fused_step:
+            ahead = self.compute_first_step(large_contexts, states)
+
+        for i in range(max_steps):
+            costs = all_costs[i, positions]
+            for number, single_search in enumerate(searches):
+                if single_search.finished:
+                    continue
+                if single_search.should_stop(i, costs[owners == number]):
+                    single_search.finished = True
+                    continue
+            keep = numpy.where([not searches[owner].finished
+                                for owner in owners])[0]
+            if len(keep) < len(owners):
+                _take_rows(states, keep)
+                _take_rows(ahead, keep)
+                positions = positions[keep]
+                costs = costs[keep]
+                owners = owners[keep]
+            if not len(owners):
                 break
-
-            if stop_on == 'patience':
-                done = sorted(done, key=lambda x: x[1][-1] - char_discount * len(x[1]))
-                done = done[:self.beam_size]
-                if done:
-                    current_best_cost = done[0][1][-1] - char_discount * len(done[0][1])
-                    if current_best_cost < min_cost:
-                        min_cost = current_best_cost
-                        patience = 30
-                    else:
-                        patience -= 1
-                        if patience == 0:
-                            break
-            elif stop_on == 'optimistic_future_cost':
-                # stop only when we have at least self.beam_size sequences,
-                # that are all cheaper than we can possibly obtain by extending
-                # other ones
-                if (len(done) >= self.beam_size):
-                    optimistic_future_cost = (all_costs[-1, :].min() -
-                                              char_discount * max_length)
-                    last_in_done = done[self.beam_size - 1][1]
-                    # note: done is sorted by the cost with char discount subtracted
-                    last_in_done_cost = (last_in_done[-1] -
-                                         char_discount * len(last_in_done))
-                    if last_in_done_cost < optimistic_future_cost:
-                        break
-            else:
-                raise ValueError('Unknown stopping criterion {}'.format(stop_on))
+            self.statistics['num_steps'] += 1
 
             # We carefully hack values of the `logprobs` array to ensure
             # that all finished sequences are continued with `eos_symbol`.
-            if large_contexts.values()[0].shape[1] != states.values()[0].shape[0]:
-                for name, ctx in contexts.items():
-                    large_contexts[name] = numpy.take(ctx, [0]*states.values()[0].shape[0], axis=1)
-            logprobs = self.compute_logprobs(large_contexts, states)
+            if self.fused_step:
+                logprobs = ahead.pop('logprobs')
+            else:
+                if not numpy.array_equal(large_owners, owners):
+                    large_contexts = self._broadcast_contexts(contexts,
+                                                              owners)
+                    large_owners = owners
+                logprobs = self.compute_logprobs(large_contexts, states)
             assert numpy.isfinite(logprobs).all()
-            next_costs = (all_costs[-1, :, None] + logprobs)
-
-            (indexes, outputs), chosen_costs = self._smallest(
-                next_costs, self.beam_size)
+            next_costs = (costs[:, None] + logprobs)
+
+            # Choose the best continuations separately for every input
+            indexes = []
+            outputs = []
+            chosen_costs = []
+            for number in numpy.unique(owners):
+                rows = numpy.where(owners == number)[0]
+                (row_indexes, row_outputs), row_costs = self._smallest(
+                    next_costs[rows], self.beam_size)
+                indexes.append(rows[row_indexes])
+                outputs.append(row_outputs)
+                chosen_costs.append(row_costs)
+            indexes = numpy.concatenate(indexes)
+            outputs = numpy.concatenate(outputs)
+            chosen_costs = numpy.concatenate(chosen_costs)
 
             # Rearrange everything
-            for name in states:
-                states[name] = numpy.take(states[name], indexes, axis=0)
-            all_outputs = numpy.take(all_outputs, indexes, axis=1)
-            all_costs = numpy.take(all_costs, indexes, axis=1)
+            _take_rows(states, indexes)
+            _take_rows(ahead, indexes)
+            owners = owners[indexes]
 
             # Record chosen output and compute new states
-            if large_contexts.values()[0].shape[1] != states.values()[0].shape[0]:
-                for name, ctx in contexts.items():
-                    large_contexts[name] = numpy.take(ctx, [0]*states.values()[0].shape[0], axis=1)
-            states = self.compute_next_states(large_contexts, states, outputs)
+            if not numpy.array_equal(large_owners, owners):
+                large_contexts = self._broadcast_contexts(contexts, owners)
+                large_owners = owners
+            if self.fused_step:
+                states, ahead = self.compute_step(large_contexts, states,
+                                                  ahead, outputs)
+            else:
+                states = self.compute_next_states(large_contexts, states,
+                                                  outputs)
 
-            all_outputs = numpy.vstack([all_outputs, outputs[None, :]])
-            all_costs = numpy.vstack([all_costs, chosen_costs[None, :]])
+            num_chosen = len(outputs)
+            all_outputs[i + 1, :num_chosen] = outputs
+            all_costs[i + 1, :num_chosen] = chosen_costs
+            parents[i + 1, :num_chosen] = positions[indexes]
 
             mask = outputs != eol_symbol
             if ignore_first_eol and i == 0:
                 mask[:] = 1
 
             for idx in numpy.where(
-                    (all_outputs[-1] == eol_symbol) &
-                    (all_costs[-1] - all_costs[-2] < round_to_inf))[0]:
+                    (outputs == eol_symbol) &
+                    (all_costs[i + 1, :num_chosen] - costs[indexes] <
+                     round_to_inf))[0]:
+                number = owners[idx]
+                sequence, sequence_costs = self._backtrack(
+                    all_outputs, all_costs, parents, i + 1, idx)
                 if (validate_solution_function is None or
-                        validate_solution_function(input_values,
-                                                   all_outputs[:, idx])):
-                    done.append((all_outputs[:, idx], all_costs[:, idx]))
+                        validate_solution_function(
+                            self._select_input(input_values, number,
+                                               batch_size),
+                            sequence)):
+                    searches[number].done.append((sequence, sequence_costs))
 
             unfinished = numpy.where(mask == 1)[0]
-            for name in states:
-                states[name] = numpy.take(states[name], unfinished, axis=0)
-            all_outputs = numpy.take(all_outputs, unfinished, axis=1)
-            all_costs = numpy.take(all_costs, unfinished, axis=1)
+            _take_rows(states, unfinished)
+            _take_rows(ahead, unfinished)
+            positions = unfinished
+            owners = owners[unfinished]
 
-        if not done:
-            raise CandidateNotFoundError()
+        del self._context_cache
+        return [single_search.result(as_arrays) for single_search in searches]
+
+    @staticmethod
+    def _backtrack(all_outputs, all_costs, parents, step, position):
+        """Reconstruct a hypothesis by following the backpointers.
+
+        Returns
+        -------
+        Outputs and costs of the hypothesis at all steps up to `step`,
+        including the initial one.
+
+        """
+        columns = numpy.zeros(step + 1, dtype='int64')
+        columns[step] = position
+        for i in range(step, 0, -1):
+            columns[i - 1] = parents[i, columns[i]]
+        rows = numpy.arange(step + 1)
+        return all_outputs[rows, columns], all_costs[rows, columns]
+
+    def _broadcast_contexts(self, contexts, owners):
+        """Repeat the contexts of every input for each of its hypotheses.
+
+        When all the hypotheses belong to the same input, broadcasting
+        views of its contexts are returned and nothing is copied.
+        Otherwise the copies are cached by the number of hypotheses
+        of each input.
+
+        """
+        if owners[0] == owners[-1]:
+            return OrderedDict(
+                (name, _broadcast_column(ctx, owners[0], len(owners)))
+                for name, ctx in contexts.items())
+        key = tuple(numpy.bincount(owners))
+        if key not in self._context_cache:
+            if len(self._context_cache) >= self.context_cache_size:
+                self._context_cache.popitem(last=False)
+            large_contexts = OrderedDict(
+                (name, numpy.take(ctx, owners, axis=1))
+                for name, ctx in contexts.items())
+            self.statistics['context_bytes_copied'] += sum(
+                ctx.nbytes for ctx in large_contexts.values())
+            self._context_cache[key] = large_contexts
+        return self._context_cache[key]
+
+    @staticmethod
+    def _select_input(input_values, number, batch_size):
+        """Extract the input values of a single input of a batch."""
+        if batch_size == 1:
+            return input_values
+        return {var: value[:, number:number + 1]
+                for var, value in input_values.items()}
+
+    @staticmethod
+    def result_to_lists(result):
+        outputs, masks, costs = [array.T for array in result]
+        outputs = [list(output[:mask.sum()])
+                   for output, mask in equizip(outputs, masks)]
+        costs = list(costs.T.sum(axis=0))
+        return outputs, costs
+
+
+def _take_rows(values, indices):
+    """Select the given rows of all arrays in a dictionary in place."""
+    for name in values:
+        values[name] = numpy.take(values[name], indices, axis=0)
+
+
+def _broadcast_column(array, column, width):
+    """A view repeating a column of an array `width` times along axis 1."""
+    column = array[:, column:column + 1]
+    return numpy.lib.stride_tricks.as_strided(
+        column, shape=column.shape[:1] + (width,) + column.shape[2:],
+        strides=column.strides[:1] + (0,) + column.strides[2:])
 
-        done = sorted(done, key=lambda x: x[1][-1] - char_discount * len(x[1]))
+
+class _SingleSearch(object):
+    """The search state for a single input of a batch.
+
+    Keeps the finished hypotheses and decides when to stop the search.
+
+    """
+    def __init__(self, beam_size, max_length, char_discount, stop_on):
+        self.beam_size = beam_size
+        self.max_length = max_length
+        self.char_discount = char_discount
+        self.stop_on = stop_on
+        self.done = []
+        self.min_cost = 1000
+        self.patience = None
+        self.finished = False
+
+    def final_cost(self, hypothesis):
+        costs = hypothesis[1]
+        return costs[-1] - self.char_discount * len(costs)
+
+    def should_stop(self, step, costs):
+        """Check the stopping criterion before a search step.
+
+        Parameters
+        ----------
+        step : int
+            The number of the step.
+        costs : :class:`numpy.ndarray`
+            The costs of the unfinished hypotheses.
+
+        """
+        if step >= self.max_length or len(costs) == 0:
+            return True
+
+        if self.stop_on == 'patience':
+            self.done = sorted(self.done, key=self.final_cost)
+            self.done = self.done[:self.beam_size]
+            if self.done:
+                current_best_cost = self.final_cost(self.done[0])
+                if current_best_cost < self.min_cost:
+                    self.min_cost = current_best_cost
+                    self.patience = 30
+                else:
+                    self.patience -= 1
+                    if self.patience == 0:
+                        return True
+        elif self.stop_on == 'optimistic_future_cost':
+            # stop only when we have at least self.beam_size sequences,
+            # that are all cheaper than we can possibly obtain by extending
+            # other ones
+            if (len(self.done) >= self.beam_size):
+                optimistic_future_cost = (
+                    costs.min() - self.char_discount * self.max_length)
+                # note: done is sorted by the cost with char discount
+                # subtracted
+                last_in_done_cost = self.final_cost(
+                    self.done[self.beam_size - 1])
+                if last_in_done_cost < optimistic_future_cost:
+                    return True
+        else:
+            raise ValueError(
+                'Unknown stopping criterion {}'.format(self.stop_on))
+        return False
+
+    def result(self, as_arrays):
+        if not self.done:
+            return None
+
+        done = sorted(self.done, key=self.final_cost)
 
         max_len = max((seq[0].shape[0] for seq in done))
         all_outputs = numpy.zeros((max_len, len(done)))
@@ -396,12 +753,4 @@ class BeamSearch(object):
         result = all_outputs, all_masks, all_costs
         if as_arrays:
             return result
-        return self.result_to_lists(result)
-
-    @staticmethod
-    def result_to_lists(result):
-        outputs, masks, costs = [array.T for array in result]
-        outputs = [list(output[:mask.sum()])
-                   for output, mask in equizip(outputs, masks)]
-        costs = list(costs.T.sum(axis=0))
-        return outputs, costs
+        return BeamSearch.result_to_lists(result)
@@ -1,7 +1,10 @@
+from collections import OrderedDict
+
 import numpy
 import theano
 from theano import tensor
 from numpy.testing import assert_allclose
+from picklable_itertools.extras import equizip
 
 from blocks.bricks import Tanh, Initializable
 from blocks.bricks.attention import SequenceContentAttention
@@ -61,6 +64,12 @@ class SimpleGenerator(Initializable):
             attended=self.lookup.apply(chars),
             attended_mask=tensor.ones(chars.shape))
 
+    @application
+    def generate_masked(self, chars, chars_mask):
+        return self.generator.generate(
+            n_steps=3 * chars.shape[0], batch_size=chars.shape[1],
+            attended=self.lookup.apply(chars), attended_mask=chars_mask)
+
 
 def test_beam_search_smallest():
     a = numpy.array([[3, 6, 4], [1, 2, 7]])
@@ -115,3 +124,68 @@ def test_beam_search():
                                      0, 3 * length)
     for i in range(len(results2)):
         assert results2[i] == list(results.T[i, :mask.T[i].sum()])
+
+
+def test_beam_search_batch():
+    """Searching a padded batch gives the results of single searches."""
+    rng = numpy.random.RandomState(1234)
+    alphabet_size = 5
+    lengths = [2, 5, 3, 4]
+
+    simple_generator = SimpleGenerator(8, alphabet_size, seed=1234)
+    simple_generator.weights_init = IsotropicGaussian(0.5)
+    simple_generator.biases_init = IsotropicGaussian(0.5)
+    simple_generator.initialize()
+
+    inputs = tensor.lmatrix('inputs')
+    inputs_mask = tensor.matrix('inputs_mask')
+    samples, = VariableFilter(
+        applications=[simple_generator.generator.generate],
+        name="outputs")(ComputationGraph(
+            simple_generator.generate_masked(inputs, inputs_mask)))
+
+    input_vals = numpy.zeros((max(lengths), len(lengths)), dtype='int64')
+    mask_vals = numpy.zeros(input_vals.shape, dtype=theano.config.floatX)
+    for number, length in enumerate(lengths):
+        input_vals[:length, number] = rng.randint(alphabet_size, size=length)
+        mask_vals[:length, number] = 1
+    max_lengths = [3 * length for length in lengths]
+
+    all_results = []
+    for fused_step in [False, True]:
+        search = BeamSearch(4, samples, context_cache_size=2,
+                            fused_step=fused_step)
+        results = search.search_batch(
+            {inputs: input_vals, inputs_mask: mask_vals}, 0, max_lengths,
+            as_arrays=True)
+        all_results.append(results)
+        batch_statistics = search.statistics
+        num_steps = []
+        for number, length in enumerate(lengths):
+            outputs, mask, costs = search.search(
+                {inputs: input_vals[:length, number:number + 1],
+                 inputs_mask: mask_vals[:length, number:number + 1]},
+                0, max_lengths[number], as_arrays=True)
+            num_steps.append(search.statistics['num_steps'])
+            batch_outputs, batch_mask, batch_costs = results[number]
+            assert_allclose(batch_outputs, outputs)
+            assert_allclose(batch_mask, mask)
+            assert_allclose(batch_costs, costs, rtol=1e-5)
+        # The searches of the inputs end at different steps
+        assert len(set(num_steps)) > 1
+        assert batch_statistics['num_steps'] == max(num_steps)
+        # The contexts are copied when the beam widths change
+        assert batch_statistics['context_bytes_copied'] > 0
+    # The fused step function does not change the results
+    for result, fused_result in equizip(*all_results):
+        for array, fused_array in equizip(result, fused_result):
+            assert_allclose(array, fused_array, rtol=1e-5)
+
+    # Contexts are cached by the number of hypotheses of every input
+    contexts = OrderedDict([('attended', rng.uniform(size=(2, 3, 4)))])
+    search._context_cache = OrderedDict()
+    for owners in [[0, 0, 1, 2], [0, 1, 1, 2], [0, 0, 1, 2], [1, 1, 1]]:
+        large_contexts = search._broadcast_contexts(
+            contexts, numpy.array(owners))
+        assert_allclose(large_contexts['attended'],
+                        contexts['attended'][:, owners])
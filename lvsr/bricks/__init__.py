@@ -125,9 +125,13 @@ class RewardRegressionEmitter(AbstractEmitter):
     GROUNDTRUTH = 'groundtruth'
 
     def __init__(self, criterion, eos_label,
-                 alphabet_size, min_reward, **kwargs):
+                 alphabet_size, min_reward, num_workers=0,
+                 use_processes=False, cache_size=0, cache_spill_path=None,
+                 **kwargs):
         self.criterion = criterion
-        self.reward_op = RewardOp(eos_label, alphabet_size)
+        self.reward_op = RewardOp(eos_label, alphabet_size,
+                                  num_workers, use_processes,
+                                  cache_size, cache_spill_path)
         self.min_reward = min_reward
         super(RewardRegressionEmitter, self).__init__(**kwargs)
 
@@ -12,7 +12,8 @@ from lvsr.ops import FST, FSTCostsOp, FSTTransitionOp, MAX_STATES, NOT_STATE
 
 
 class FSTTransition(BaseRecurrent, Initializable):
-    def __init__(self, fst, remap_table, no_transition_cost, **kwargs):
+    def __init__(self, fst, remap_table, no_transition_cost,
+                 max_states=MAX_STATES, prune_threshold=None, **kwargs):
         """Wrap FST in a recurrent brick.
 
         Parameters
@@ -23,11 +24,17 @@ class FSTTransition(BaseRecurrent, Initializable):
         no_transition_cost : float
             Cost of going to the start state when no arc for an input
             symbol is available.
+        max_states : int, optional
+            The width of the state sets, see :class:`FSTTransitionOp`.
+        prune_threshold : float, optional
+            The log-weight pruning threshold for the state sets, see
+            :class:`FSTTransitionOp`.
 
         """
         super(FSTTransition, self).__init__(**kwargs)
         self.fst = fst
-        self.transition = FSTTransitionOp(fst, remap_table)
+        self.transition = FSTTransitionOp(fst, remap_table, max_states,
+                                          prune_threshold)
         self.probability_computer = FSTCostsOp(
             fst, remap_table, no_transition_cost)
 
@@ -51,7 +58,8 @@ class FSTTransition(BaseRecurrent, Initializable):
 
     @application(outputs=['states', 'weights', 'add'])
     def initial_states(self, batch_size, *args, **kwargs):
-        states_dict = self.fst.expand({self.fst.fst.start: 0.0})
+        states_dict = self.transition.prune(
+            self.fst.expand({self.fst.start: 0.0}))
         states = tensor.as_tensor_variable(
             self.transition.pad(states_dict.keys(), NOT_STATE))
         states = tensor.tile(states[None, :], (batch_size, 1))
@@ -63,7 +71,7 @@ class FSTTransition(BaseRecurrent, Initializable):
 
     def get_dim(self, name):
         if name == 'states' or name == 'weights':
-            return MAX_STATES
+            return self.transition.max_states
         if name == 'add':
             return self.out_dim
         if name == 'inputs':
@@ -105,18 +113,21 @@ class ShallowFusionReadout(Readout):
 
 
 class LanguageModel(SequenceGenerator):
-    def __init__(self, path, nn_char_map, no_transition_cost=1e12, **kwargs):
+    def __init__(self, path, nn_char_map, no_transition_cost=1e12,
+                 cache_size=10000, max_states=MAX_STATES,
+                 prune_threshold=None, **kwargs):
         # Since we currently support only type, it is ignored.
         # if type_ != 'fst':
         #    raise ValueError("Supports only FST's so far.")
-        fst = FST(path)
-        fst_char_map = dict(fst.fst.isyms.items())
+        fst = FST(path, cache_size=cache_size)
+        fst_char_map = dict(fst.isyms)
         del fst_char_map['<eps>']
         if not len(fst_char_map) == len(nn_char_map):
             raise ValueError()
         remap_table = {nn_char_map[character]: fst_code
                        for character, fst_code in fst_char_map.items()}
-        transition = FSTTransition(fst, remap_table, no_transition_cost)
+        transition = FSTTransition(fst, remap_table, no_transition_cost,
+                                   max_states, prune_threshold)
 
         # This SequenceGenerator will be used only in a very limited way.
         # That's why it is sufficient to equip it with a completely
@@ -17,9 +17,10 @@ from blocks.graph import ComputationGraph
 from blocks.model import Model
 from blocks.filter import VariableFilter
 from blocks.roles import OUTPUT
-from blocks.search import BeamSearch
+from blocks.search import BeamSearch, CandidateNotFoundError
 from blocks.serialization import load_parameters
 
+from lvsr import function_cache
 from lvsr.bricks import (
     Encoder, OneOfNFeedback, InitializableSequence, RewardRegressionEmitter)
 from lvsr.bricks.attention import SequenceContentAndConvAttention
@@ -292,6 +293,10 @@ class SpeechRecognizer(Initializable):
             emitter = RewardRegressionEmitter(
                 criterion['name'], eos_label, num_phonemes,
                 criterion.get('min_reward', -1.0),
+                criterion.get('num_workers', 0),
+                criterion.get('use_processes', False),
+                criterion.get('cache_size', 0),
+                criterion.get('cache_spill_path'),
                 name="emitter")
         else:
             raise ValueError("Unknown criterion {}".format(criterion['name']))
@@ -449,6 +454,53 @@ class SpeechRecognizer(Initializable):
             cost_cg = cost_cg.replace({placeholder: groundtruth})
         return cost_cg
 
+    def init_analyze(self, with_prediction):
+        """Compile the function used by :meth:`analyze`.
+
+        Parameters
+        ----------
+        with_prediction : bool
+            If ``True``, the function will accept a prediction in addition
+            to the groundtruth.
+
+        """
+        if hasattr(self, "_analyze"):
+            return
+        input_variables = list(self.single_inputs.values())
+        input_variables.append(self.single_labels.copy(name='groundtruth'))
+
+        prediction_variable = tensor.lvector('prediction')
+        if with_prediction:
+            input_variables.append(prediction_variable)
+            cg = self.get_cost_graph(
+                batch=False, prediction=prediction_variable[:, None])
+        else:
+            cg = self.get_cost_graph(batch=False)
+        cost = cg.outputs[0]
+
+        weights, = VariableFilter(
+            bricks=[self.generator], name="weights")(cg)
+
+        energies = VariableFilter(
+            bricks=[self.generator], name="energies")(cg)
+        energies_output = [energies[0][:, 0, :] if energies
+                           else tensor.zeros_like(weights)]
+
+        states, = VariableFilter(
+            applications=[self.encoder.apply], roles=[OUTPUT],
+            name="encoded")(cg)
+
+        ctc_matrix_output = []
+        # Temporarily disabled for compatibility with LM code
+        # if len(self.generator.readout.source_names) == 1:
+        #    ctc_matrix_output = [
+        #        self.generator.readout.readout(weighted_averages=states)[:, 0, :]]
+
+        self._analyze = function_cache.function(
+            input_variables,
+            [cost[:, 0], weights[:, 0, :]] + energies_output + ctc_matrix_output,
+            on_unused_input='warn', name='analyze')
+
     def analyze(self, inputs, groundtruth, prediction=None):
         """Compute cost and aligment."""
 
@@ -456,41 +508,7 @@ class SpeechRecognizer(Initializable):
         input_values_dict['groundtruth'] = groundtruth
         if prediction is not None:
             input_values_dict['prediction'] = prediction
-        if not hasattr(self, "_analyze"):
-            input_variables = list(self.single_inputs.values())
-            input_variables.append(self.single_labels.copy(name='groundtruth'))
-
-            prediction_variable = tensor.lvector('prediction')
-            if prediction is not None:
-                input_variables.append(prediction_variable)
-                cg = self.get_cost_graph(
-                    batch=False, prediction=prediction_variable[:, None])
-            else:
-                cg = self.get_cost_graph(batch=False)
-            cost = cg.outputs[0]
-
-            weights, = VariableFilter(
-                bricks=[self.generator], name="weights")(cg)
-
-            energies = VariableFilter(
-                bricks=[self.generator], name="energies")(cg)
-            energies_output = [energies[0][:, 0, :] if energies
-                               else tensor.zeros_like(weights)]
-
-            states, = VariableFilter(
-                applications=[self.encoder.apply], roles=[OUTPUT],
-                name="encoded")(cg)
-
-            ctc_matrix_output = []
-            # Temporarily disabled for compatibility with LM code
-            # if len(self.generator.readout.source_names) == 1:
-            #    ctc_matrix_output = [
-            #        self.generator.readout.readout(weighted_averages=states)[:, 0, :]]
-
-            self._analyze = theano.function(
-                input_variables,
-                [cost[:, 0], weights[:, 0, :]] + energies_output + ctc_matrix_output,
-                on_unused_input='warn')
+        self.init_analyze(with_prediction=prediction is not None)
         return self._analyze(**input_values_dict)
 
     def init_beam_search(self, beam_size):
@@ -503,12 +521,34 @@ class SpeechRecognizer(Initializable):
             # Only recompile if the user wants a different beam size
             return
         self.beam_size = beam_size
-        generated = self.get_generate_graph(use_mask=False, n_steps=3)
+        self._beam_search = self._compile_beam_search(use_mask=False)
+        # The batched search is compiled only when it is requested
+        self.__dict__.pop('_batch_beam_search', None)
+
+    def init_batch_beam_search(self):
+        """Compile the batched beam search used by :meth:`beam_search_batch`.
+
+        Uses the beam size set by :meth:`init_beam_search`.
+
+        """
+        self.init_beam_search(self.beam_size)
+        if not hasattr(self, '_batch_beam_search'):
+            self._batch_beam_search = self._compile_beam_search(
+                use_mask=True)
+
+    def _compile_beam_search(self, use_mask):
+        generated = self.get_generate_graph(use_mask=use_mask, n_steps=3)
         cg = ComputationGraph(generated.values())
         samples, = VariableFilter(
             applications=[self.generator.generate], name="outputs")(cg)
-        self._beam_search = BeamSearch(beam_size, samples)
-        self._beam_search.compile()
+        # The fused step computes the attention glimpses once per step
+        # instead of once for the log probabilities and once more for
+        # the next states.
+        beam_search = BeamSearch(
+            self.beam_size, samples, fused_step=True,
+            compile_function=function_cache.function)
+        beam_search.compile()
+        return beam_search
 
     def beam_search(self, inputs, **kwargs):
         # When a recognizer is unpickled, self.beam_size is available
@@ -525,12 +565,75 @@ class SpeechRecognizer(Initializable):
             raise Exception(
                 'Unknown inputs passed to beam search: {}'.format(
                     inputs.keys()))
-        outputs, search_costs = self._beam_search.search(
+        try:
+            outputs, search_costs = self._beam_search.search(
+                search_inputs, self.eos_label,
+                max_length,
+                ignore_first_eol=self.data_prepend_eos,
+                **kwargs)
+        finally:
+            self.search_statistics = self._beam_search.statistics
+        return outputs, search_costs
+
+    def beam_search_batch(self, inputs, **kwargs):
+        """Perform beam search for several utterances at once.
+
+        The utterances are padded and masked, and the hypotheses for
+        all of them are decoded together.
+
+        Parameters
+        ----------
+        inputs : list of dicts
+            The inputs of the utterances, each in the same format
+            as for :meth:`beam_search`.
+
+        Returns
+        -------
+        A list of (outputs, search_costs) pairs, one for each utterance,
+        formatted like the result of :meth:`beam_search`. ``None``
+        is given for the utterances for which no candidate was found.
+
+        """
+        if len(inputs) == 1:
+            # No need for padding and masking
+            try:
+                return [self.beam_search(inputs[0], **kwargs)]
+            except CandidateNotFoundError:
+                return [None]
+        self.init_batch_beam_search()
+        inputs = [dict(utterance_inputs) for utterance_inputs in inputs]
+        lengths = [self.bottom.num_time_steps(**utterance_inputs)
+                   for utterance_inputs in inputs]
+        max_lengths = [int(length / self.max_decoded_length_scale)
+                       for length in lengths]
+
+        search_inputs = {}
+        for var in self.inputs.values():
+            values = [utterance_inputs.pop(var.name)
+                      for utterance_inputs in inputs]
+            batch = numpy.zeros(
+                (max(lengths), len(values)) + values[0].shape[1:],
+                dtype=values[0].dtype)
+            for number, value in enumerate(values):
+                batch[:len(value), number] = value
+            search_inputs[var] = batch
+        mask = numpy.zeros((max(lengths), len(inputs)),
+                           dtype=theano.config.floatX)
+        for number, length in enumerate(lengths):
+            mask[:length, number] = 1
+        search_inputs[self.inputs_mask] = mask
+        for utterance_inputs in inputs:
+            if utterance_inputs:
+                raise Exception(
+                    'Unknown inputs passed to beam search: {}'.format(
+                        utterance_inputs.keys()))
+        results = self._batch_beam_search.search_batch(
             search_inputs, self.eos_label,
-            max_length,
+            max_lengths,
             ignore_first_eol=self.data_prepend_eos,
             **kwargs)
-        return outputs, search_costs
+        self.search_statistics = self._batch_beam_search.statistics
+        return results
 
     def init_generate(self):
         generated = self.get_generate_graph(use_mask=False)
@@ -548,7 +651,7 @@ class SpeechRecognizer(Initializable):
 
     def __getstate__(self):
         state = dict(self.__dict__)
-        for attr in ['_analyze', '_beam_search']:
+        for attr in ['_analyze', '_beam_search', '_batch_beam_search']:
             state.pop(attr, None)
         return state
 
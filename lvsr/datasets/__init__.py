@@ -11,7 +11,11 @@ from fuel.transformers import (
     SortMapping, Padding, ForceFloatX, Batch, Mapping, Unpack, Filter,
     FilterSources, Transformer, AgnosticTransformer, Rename)
 
+from lvsr.datasets.cache import CachedStream
 from lvsr.datasets.h5py import H5PYAudioDataset
+from lvsr.datasets.prefetch import Prefetch
+from lvsr.datasets.schemes import (
+    BlockShuffledScheme, LengthBucketScheme, LengthIndexScheme)
 from blocks.utils import dict_subset
 
 
@@ -119,6 +123,248 @@ class ForceCContiguous(Transformer):
         return tuple(result)
 
 
+class WindowShuffle(Transformer):
+    """Shuffles the examples of a stream of blocks within a window.
+
+    Blocks, e.g. from :class:`BlockShuffledScheme`, are read ahead until at
+    least `window` examples are buffered. The buffered examples are then
+    shuffled and produced one by one before the next window is read.
+
+    Parameters
+    ----------
+    data_stream : :class:`AbstractDataStream` instance
+        The data stream producing blocks of examples.
+    window : int
+        The minimum number of examples shuffled together.
+    sort_window : int, optional
+        If given, consecutive groups of this many examples of a shuffled
+        window are sorted by length.
+    length_index : int
+        The index of the source whose length is used for sorting.
+    rng : :class:`numpy.random.RandomState`, optional
+        The random number generator.
+
+    """
+    def __init__(self, data_stream, window, sort_window=None,
+                 length_index=0, rng=None, **kwargs):
+        if data_stream.produces_examples:
+            raise ValueError('the wrapped data stream must produce batches of '
+                             'examples, not examples')
+        if data_stream.axis_labels:
+            kwargs.setdefault(
+                'axis_labels',
+                dict((source, labels[1:] if labels else None) for
+                     source, labels in data_stream.axis_labels.items()))
+        super(WindowShuffle, self).__init__(
+            data_stream, produces_examples=True, **kwargs)
+        self.window = window
+        self.sort_window = sort_window
+        self.length_index = length_index
+        self.rng = rng
+        if self.rng is None:
+            self.rng = numpy.random.RandomState(fuel.config.default_seed)
+        self.buffer = []
+
+    def get_epoch_iterator(self, **kwargs):
+        self.buffer = []
+        return super(WindowShuffle, self).get_epoch_iterator(**kwargs)
+
+    def _fill(self):
+        examples = []
+        while len(examples) < self.window:
+            try:
+                block = next(self.child_epoch_iterator)
+            except StopIteration:
+                break
+            examples.extend(zip(*block))
+        order = self.rng.permutation(len(examples))
+        if self.sort_window:
+            lengths = numpy.array(
+                [len(examples[i][self.length_index]) for i in order])
+            order = numpy.concatenate(
+                [order[i:i + self.sort_window][numpy.argsort(
+                    lengths[i:i + self.sort_window], kind='mergesort')]
+                 for i in range(0, len(order), self.sort_window)] +
+                [order[:0]])
+        # Reversed, to pop the examples from the end
+        self.buffer = [examples[i] for i in order[::-1]]
+
+    def get_data(self, request=None):
+        if request is not None:
+            raise ValueError
+        if not self.buffer:
+            self._fill()
+        if not self.buffer:
+            raise StopIteration
+        return self.buffer.pop()
+
+
+class FrameBudgetBatch(Transformer):
+    """Creates batches that fit a budget of padded frames.
+
+    Consecutive examples are added to a batch as long as the number of
+    examples times the length of the longest one stays within the budget.
+    An example that alone exceeds the budget makes a batch on its own.
+
+    Parameters
+    ----------
+    data_stream : :class:`AbstractDataStream` instance
+        The data stream producing examples.
+    frame_budget : int
+        The maximum number of padded frames in a batch.
+    max_batch_size : int, optional
+        The maximum number of examples in a batch.
+    frames_index : int
+        The index of the source whose length is budgeted.
+    labels_index : int, optional
+        If given, the budget is on the number of padded frames times the
+        number of padded labels in this source, which is what the memory
+        for the attention weights is proportional to.
+
+    """
+    def __init__(self, data_stream, frame_budget, max_batch_size=None,
+                 frames_index=0, labels_index=None, **kwargs):
+        if not data_stream.produces_examples:
+            raise ValueError('the wrapped data stream must produce examples, '
+                             'not batches of examples.')
+        if data_stream.axis_labels:
+            kwargs.setdefault(
+                'axis_labels',
+                dict((source, ('batch',) + labels if labels else None) for
+                     source, labels in data_stream.axis_labels.items()))
+        super(FrameBudgetBatch, self).__init__(
+            data_stream, produces_examples=False, **kwargs)
+        self.frame_budget = frame_budget
+        self.max_batch_size = max_batch_size
+        self.frames_index = frames_index
+        self.labels_index = labels_index
+        self.pending = None
+
+    def _padded_size(self, batch, example):
+        batch = batch + [example]
+        size = len(batch) * max(len(e[self.frames_index]) for e in batch)
+        if self.labels_index is not None:
+            size *= max(len(e[self.labels_index]) for e in batch)
+        return size
+
+    def get_epoch_iterator(self, **kwargs):
+        self.pending = None
+        return super(FrameBudgetBatch, self).get_epoch_iterator(**kwargs)
+
+    def get_data(self, request=None):
+        if request is not None:
+            raise ValueError
+        batch = []
+        while not self.max_batch_size or len(batch) < self.max_batch_size:
+            if self.pending is None:
+                try:
+                    self.pending = next(self.child_epoch_iterator)
+                except StopIteration:
+                    break
+            if (batch and self._padded_size(batch, self.pending) >
+                    self.frame_budget):
+                break
+            batch.append(self.pending)
+            self.pending = None
+        if not batch:
+            raise StopIteration
+        return tuple(numpy.asarray(source_data)
+                     for source_data in zip(*batch))
+
+
+class TimeMajorPadding(Transformer):
+    """Pads batches of sequences into reusable time-major buffers.
+
+    Does the job of `Padding`, `switch_first_two_axes` and
+    `ForceCContiguous` in one pass: every example is copied once, straight
+    into a C-contiguous array of shape (time, batch, ...), and a mask is
+    added for every source. The arrays are views of flat buffers that are
+    kept in a pool, `pool_size` buffers per source, and reused in turn, so
+    buffers are only allocated when a batch is larger than all before.
+
+    A batch returned stays valid until `pool_size` more batches are
+    produced.
+
+    Attributes
+    ----------
+    statistics : dict
+        The cumulative numbers of batches, buffer allocations, bytes
+        allocated and bytes copied.
+    batch_statistics : dict
+        The numbers of buffer allocations, bytes allocated and bytes copied
+        for the last batch.
+
+    """
+    def __init__(self, data_stream, mask_dtype=None, pool_size=2, **kwargs):
+        if data_stream.produces_examples:
+            raise ValueError('the wrapped data stream must produce batches of '
+                             'examples, not examples')
+        super(TimeMajorPadding, self).__init__(
+            data_stream, produces_examples=False, **kwargs)
+        self.mask_dtype = mask_dtype if mask_dtype else fuel.config.floatX
+        self.pool_size = pool_size
+        self.statistics = dict(batches=0, allocations=0, bytes_allocated=0,
+                               bytes_copied=0)
+        self.batch_statistics = {}
+        self.buffers = {}
+
+    @property
+    def sources(self):
+        sources = []
+        for source in self.data_stream.sources:
+            sources.append(source)
+            sources.append(source + '_mask')
+        return tuple(sources)
+
+    def _get_buffer(self, key, shape, dtype):
+        """Returns a C-contiguous array of the given shape from the pool."""
+        dtype = numpy.dtype(dtype)
+        slot = self.statistics['batches'] % self.pool_size
+        size = int(numpy.prod(shape))
+        buffer_ = self.buffers.get((key, slot, dtype.str))
+        if buffer_ is None or buffer_.size < size:
+            buffer_ = numpy.empty(size, dtype=dtype)
+            self.buffers[(key, slot, dtype.str)] = buffer_
+            self.batch_statistics['allocations'] += 1
+            self.batch_statistics['bytes_allocated'] += buffer_.nbytes
+        return buffer_[:size].reshape(shape)
+
+    def get_data(self, request=None):
+        if request is not None:
+            raise ValueError
+        batch = next(self.child_epoch_iterator)
+        self.batch_statistics = dict(allocations=0, bytes_allocated=0,
+                                     bytes_copied=0)
+        result = []
+        for source, source_batch in zip(self.data_stream.sources, batch):
+            lengths = numpy.array([len(example) for example in source_batch])
+            rest_shape = numpy.asarray(source_batch[0]).shape[1:]
+            dtype = numpy.asarray(source_batch[0]).dtype
+            shape = (lengths.max(), len(source_batch)) + rest_shape
+            padded = self._get_buffer(source, shape, dtype)
+            for i, example in enumerate(source_batch):
+                example = numpy.asarray(example)
+                if example.shape[1:] != rest_shape:
+                    raise ValueError(
+                        "All dimensions except length must be equal")
+                padded[:len(example), i] = example
+                padded[len(example):, i] = 0
+                self.batch_statistics['bytes_copied'] += example.nbytes
+            mask = self._get_buffer(source + '_mask', shape[:2],
+                                    self.mask_dtype)
+            mask[...] = numpy.arange(shape[0])[:, None] < lengths
+            result.extend([padded, mask])
+        self.statistics['batches'] += 1
+        for key, value in self.batch_statistics.items():
+            self.statistics[key] += value
+        return tuple(result)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['buffers'] = {}
+        return state
+
+
 class Data(object):
     """Dataset manager.
 
@@ -140,6 +386,35 @@ class Data(object):
     validation_batch_size : int
         Batch size used for validation.
     sort_k_batches : int
+    num_buckets : int
+        If given, the shuffled training batches are drawn from this many
+        buckets of examples of similar length, which replaces sorting
+        with `sort_k_batches`.
+    frame_budget : int
+        If given, batches are made as large as possible without exceeding
+        this many padded input frames, but no larger than the batch size.
+    budget_labels : bool
+        Budget the number of padded frames times the number of padded
+        labels instead of the frames only.
+    prefetch : int
+        If given, batches are prepared in a background process at most
+        this many batches ahead.
+    prefetch_buffer_size : int
+        The size in megabytes of a shared memory buffer for a prefetched
+        batch.
+    block_size : int
+        If given, shuffled examples are read in shuffled blocks of this
+        many consecutive examples, one read per block, which replaces
+        bucketing. Larger blocks mean fewer reads and weaker shuffling.
+    shuffle_window : int
+        The number of examples of consecutive blocks shuffled together,
+        one block by default.
+    cache_validation : bool
+        Read the validation batches once, sorted by length, and keep them
+        for later validations, see :meth:`get_cached_stream`.
+    validation_cache_path : str
+        If given, the cached validation batches are memory mapped from
+        this file instead of kept in memory.
     max_length : int
         Maximum length of input, longer sequences will be filtered.
     normalization : str
@@ -157,7 +432,11 @@ class Data(object):
     """
     def __init__(self, dataset_filename, name_mapping, sources_map,
                  batch_size, validation_batch_size=None,
-                 sort_k_batches=None,
+                 sort_k_batches=None, num_buckets=None,
+                 frame_budget=None, budget_labels=False,
+                 prefetch=None, prefetch_buffer_size=32,
+                 block_size=None, shuffle_window=None,
+                 cache_validation=False, validation_cache_path=None,
                  max_length=None, normalization=None,
                  add_eos=True, eos_label=None,
                  add_bos=0, prepend_eos=False,
@@ -187,12 +466,22 @@ class Data(object):
             validation_batch_size = batch_size
         self.validation_batch_size = validation_batch_size
         self.sort_k_batches = sort_k_batches
+        self.num_buckets = num_buckets
+        self.frame_budget = frame_budget
+        self.budget_labels = budget_labels
+        self.prefetch = prefetch
+        self.prefetch_buffer_size = prefetch_buffer_size
+        self.block_size = block_size
+        self.shuffle_window = shuffle_window
+        self.cache_validation = cache_validation
+        self.validation_cache_path = validation_cache_path
         self.max_length = max_length
         self.add_eos = add_eos
         self.prepend_eos = prepend_eos
         self._eos_label = eos_label
         self.add_bos = add_bos
         self.dataset_cache = {}
+        self.length_index = {}
         #
         # Hardcode the number of source for length at 0
         # this typixcally works, as main.get_net_config
@@ -250,19 +539,81 @@ class Data(object):
                 target_source=self.sources_map['labels'])
         return self.dataset_cache[key]
 
+    def get_lengths(self, part, source):
+        """Returns the lengths of all examples of a part of the dataset.
+
+        The lengths are read from the shapes of the examples, so that they
+        can be used before any features are loaded, and are cached.
+
+        """
+        key = (part, source)
+        if key not in self.length_index:
+            dataset = self.get_dataset(part)
+            self.length_index[key] = dataset.example_lengths(
+                self.sources_map[source])
+        return self.length_index[key]
+
+    def get_example_indices(self, part, shuffle=False, add_sources=(),
+                            num_examples=None, rng=None):
+        """Returns the indices of the examples of an unbatched stream.
+
+        The examples rejected by the length filter are left out. Nothing
+        is read from the dataset, so that processes can split the
+        examples between themselves and read only their own ones by
+        passing them as `num_examples` to :meth:`get_stream`.
+
+        """
+        if num_examples is None:
+            num_examples = self.get_dataset(
+                part, add_sources=add_sources).num_examples
+        lengths = self.get_lengths(
+            part, (self.default_sources + list(add_sources))[0])
+        scheme = LengthIndexScheme(
+            lengths, num_examples, length_filter=self.length_filter,
+            shuffle=shuffle, rng=rng)
+        return list(scheme.get_request_iterator())
+
     def get_stream(self, part, batches=True, shuffle=True, add_sources=(),
-                   num_examples=None, rng=None, seed=None):
+                   num_examples=None, rng=None, seed=None, sort_all=False):
         dataset = self.get_dataset(part, add_sources=add_sources)
         if num_examples is None:
             num_examples = dataset.num_examples
-
-        if shuffle:
-            iteration_scheme = ShuffledExampleScheme(num_examples, rng=rng)
+        batch_size = (self.batch_size if part == 'train'
+                      else self.validation_batch_size)
+        #
+        # Hardcode 0 for the source on which to filter, sort and bucket.
+        # This will be good, as most source lengths are correlated and,
+        # furthermore, the labels will typically be the last source, thus
+        # in a single-input case this uses the input lengths. The
+        # examples rejected by the length filter are never read.
+        #
+        lengths = self.get_lengths(
+            part, (self.default_sources + list(add_sources))[0])
+        sort_window = None
+        if self.sort_k_batches and batches and not self.num_buckets:
+            sort_window = self.batch_size * self.sort_k_batches
+        if sort_all:
+            sort_window = len(lengths)
+        if self.block_size and shuffle:
+            # Contiguous blocks are read at once and shuffled in a window
+            iteration_scheme = BlockShuffledScheme(
+                lengths, self.block_size, num_examples,
+                length_filter=self.length_filter, rng=rng)
+        elif self.num_buckets and batches and shuffle:
+            iteration_scheme = LengthBucketScheme(
+                lengths, batch_size, self.num_buckets, num_examples,
+                length_filter=self.length_filter, rng=rng)
         else:
-            iteration_scheme = SequentialExampleScheme(num_examples)
+            iteration_scheme = LengthIndexScheme(
+                lengths, num_examples, length_filter=self.length_filter,
+                shuffle=shuffle, sort_window=sort_window, rng=rng)
 
         stream = DataStream(
             dataset, iteration_scheme=iteration_scheme)
+        if self.block_size and shuffle:
+            stream = WindowShuffle(
+                stream, max(self.shuffle_window or 0, self.block_size),
+                sort_window=sort_window, rng=rng)
 
         if self.add_eos:
             stream = Mapping(stream, _AddLabel(
@@ -275,23 +626,6 @@ class Data(object):
                 self.bos_label, append=False, times=self.add_bos,
                 index=stream.sources.index(self.sources_map['labels'])))
 
-        if self.max_length:
-            stream = Filter(stream, self.length_filter)
-
-        if self.sort_k_batches and batches:
-            stream = Batch(stream,
-                           iteration_scheme=ConstantScheme(
-                               self.batch_size * self.sort_k_batches))
-            #
-            # Hardcode 0 for source on which to sort. This will be good, as
-            # most source lengths are correlated and, furthermore, the
-            # labels will typically be the last source, thus in a single-input
-            # case this sorts on input lengths
-            #
-            stream = Mapping(stream, SortMapping(_Length(
-                index=0)))
-            stream = Unpack(stream)
-
         if self.normalization:
             stream = self.normalization.wrap_stream(stream)
         stream = ForceFloatX(stream)
@@ -300,11 +634,30 @@ class Data(object):
         if not batches:
             return stream
 
-        stream = Batch(
-            stream,
-            iteration_scheme=ConstantScheme(self.batch_size if part == 'train'
-                                            else self.validation_batch_size))
-        stream = Padding(stream)
-        stream = Mapping(stream, switch_first_two_axes)
-        stream = ForceCContiguous(stream)
+        if self.frame_budget:
+            stream = FrameBudgetBatch(
+                stream, self.frame_budget, max_batch_size=batch_size,
+                labels_index=(stream.sources.index('labels')
+                              if self.budget_labels else None))
+        else:
+            # With bucketing the batches of the scheme are reproduced here
+            stream = Batch(stream,
+                           iteration_scheme=ConstantScheme(batch_size))
+        stream = TimeMajorPadding(stream)
+        if self.prefetch:
+            stream = Prefetch(
+                stream, num_batches=self.prefetch,
+                buffer_size=self.prefetch_buffer_size * 2 ** 20)
         return stream
+
+    def get_cached_stream(self, part, add_sources=()):
+        """Returns a stream of batches that is read only once.
+
+        All examples are sorted by length before batching, which minimizes
+        padding, and the batches are cached by :class:`CachedStream`.
+
+        """
+        return CachedStream(
+            self.get_stream(part, shuffle=False, add_sources=add_sources,
+                            sort_all=True),
+            path=self.validation_cache_path, length_filter=self.length_filter)
@@ -0,0 +1,110 @@
+"""Caching of whole epochs of batches."""
+import logging
+import os
+import time
+
+import numpy
+from fuel.streams import AbstractDataStream
+from fuel.transformers import Transformer
+
+from lvsr.datasets.prefetch import ALIGNMENT, _unshare
+
+logger = logging.getLogger(__name__)
+
+
+class CachedStream(Transformer):
+    """Reads an epoch of a stream once and then replays it.
+
+    Meant for streams that are the same every epoch, e.g. validation data
+    without shuffling. The first epoch is read from the wrapped stream and
+    copied into memory or, if `path` is given, into a memory mapped file.
+    Later epochs do not touch the wrapped stream.
+
+    Pieces of batches that are not numeric arrays are kept in memory. The
+    cache is not pickled, it is read again after unpickling. The file is
+    removed by :meth:`close`.
+
+    Parameters
+    ----------
+    data_stream : :class:`AbstractDataStream` instance
+        The data stream to cache.
+    path : str, optional
+        If given, the arrays are saved to this file and memory mapped.
+    length_filter : :class:`_LengthFilter`, optional
+        The length filter of the wrapped stream, the cache is read again
+        when its `max_length` changes.
+
+    """
+    def __init__(self, data_stream, path=None, length_filter=None, **kwargs):
+        kwargs.setdefault('axis_labels', data_stream.axis_labels)
+        super(CachedStream, self).__init__(
+            data_stream, data_stream.produces_examples, **kwargs)
+        self.path = path
+        self.length_filter = length_filter
+        self.batches = None
+        self.max_length = None
+        self.position = 0
+
+    def _current_max_length(self):
+        return self.length_filter.max_length if self.length_filter else None
+
+    def _cache(self):
+        start_time = time.time()
+        if self.path:
+            cache_file = open(self.path, 'wb')
+            offset = 0
+        batches = []
+        for data in self.data_stream.get_epoch_iterator():
+            pieces = []
+            for piece in data:
+                if not (isinstance(piece, numpy.ndarray) and
+                        piece.dtype != object):
+                    pieces.append((piece, None, None, None))
+                elif self.path:
+                    piece = numpy.ascontiguousarray(piece)
+                    cache_file.write(piece.tobytes())
+                    size = -(-piece.nbytes // ALIGNMENT) * ALIGNMENT
+                    cache_file.write(b'\0' * (size - piece.nbytes))
+                    pieces.append((None, piece.dtype.str, piece.shape,
+                                   offset))
+                    offset += size
+                else:
+                    # The wrapped stream may reuse its buffers
+                    pieces.append((piece.copy(), None, None, None))
+            batches.append(pieces)
+        buffer_ = None
+        if self.path:
+            cache_file.close()
+            if offset:
+                buffer_ = numpy.memmap(self.path, dtype='int8', mode='r')
+        self.batches = [_unshare(pieces, buffer_) for pieces in batches]
+        self.max_length = self._current_max_length()
+        logger.info("Cached {} batches in {:.1f} seconds".format(
+            len(self.batches), time.time() - start_time))
+
+    def get_epoch_iterator(self, **kwargs):
+        if (self.batches is None or
+                self.max_length != self._current_max_length()):
+            self._cache()
+        self.position = 0
+        # The wrapped stream is not iterated over
+        return AbstractDataStream.get_epoch_iterator(self, **kwargs)
+
+    def get_data(self, request=None):
+        if request is not None:
+            raise ValueError
+        if self.position == len(self.batches):
+            raise StopIteration
+        self.position += 1
+        return self.batches[self.position - 1]
+
+    def close(self):
+        self.batches = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        super(CachedStream, self).close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['batches'] = None
+        return state
@@ -2,27 +2,22 @@
 from fuel.datasets.hdf5 import H5PYDataset
 
 
-class H5PYAudioDataset(H5PYDataset):
-    def __init__(self, target_source, **kwargs):
+class AudioDatasetMixin(object):
+    """Character maps and printing shared by the speech datasets.
+
+    Requires the `character_map` method.
+
+    """
+    def init_characters(self, target_source):
         # We have to know data from which sources will be used as targets.
         # E.g. this might be necessary for pretty printing.
         self.target_source = target_source
-
-        super(H5PYAudioDataset, self).__init__(**kwargs)
-        self.open()
-
         self.char2num = self.character_map(target_source)
         self.num2char = {num: char for char, num in self.char2num.items()}
         self.num_characters = len(self.num2char)
         self.eos_label = self.char2num['<eol>']
         self.bos_label = self.char2num.get('<bol>')
 
-    def character_map(self, source):
-        return dict(self._file_handle[source].attrs['value_map'])
-
-    def dim(self, source):
-        return self._file_handle[source + '_shapes'][0][1]
-
     def decode(self, labels, keep_eos=False):
         return [self.num2char[label] for label in labels
                 if (label != self.eos_label or keep_eos)
@@ -46,6 +41,25 @@ class H5PYAudioDataset(H5PYDataset):
         return labels
 
 
+class H5PYAudioDataset(AudioDatasetMixin, H5PYDataset):
+    def __init__(self, target_source, **kwargs):
+        super(H5PYAudioDataset, self).__init__(**kwargs)
+        self.open()
+        self.init_characters(target_source)
+
+    def character_map(self, source):
+        return dict(self._file_handle[source].attrs['value_map'])
+
+    def dim(self, source):
+        return self._file_handle[source + '_shapes'][0][1]
+
+    def example_lengths(self, source):
+        """Returns the lengths of all examples without reading them."""
+        shapes = self.subsets[0].index_within_subset(
+            self._file_handle[source + '_shapes'], slice(None))
+        return shapes[:, 0]
+
+
 class H5PYAudioDatasetTimit(H5PYAudioDataset):
     phone_map = [
         ("aa",    "aa",    "aa"),
@@ -0,0 +1,205 @@
+"""A dataset of utterances packed into memory mapped arrays.
+
+A packed dataset is a directory. Every variable length source is stored
+as one flat array, in which the examples follow each other along the
+first axis, and an array of offsets of the examples. String sources are
+stored as fixed width strings, unicode ones as unicode. The arrays are
+`.npy` files opened with `numpy.load(mmap_mode='r')`, so that examples
+are read as slices without copying and the processes using a dataset
+share the page cache. Splits are arrays of indices of examples, shared
+by all sources. See :func:`pack_hdf5` to convert a Fuel HDF5 file.
+
+"""
+# Without it h5py is lvsr.datasets.h5py
+from __future__ import absolute_import
+
+import cPickle
+import logging
+import os
+
+import numpy
+from fuel.datasets import Dataset
+from fuel.utils import do_not_pickle_attributes
+
+from lvsr.datasets.h5py import AudioDatasetMixin
+
+logger = logging.getLogger(__name__)
+
+INFO_FILE = 'info.pkl'
+
+
+def _data_path(path, source):
+    return os.path.join(path, source + '.npy')
+
+
+def _offsets_path(path, source):
+    return os.path.join(path, source + '_offsets.npy')
+
+
+def _split_path(path, split):
+    return os.path.join(path, split + '_indices.npy')
+
+
+@do_not_pickle_attributes('data_sources', 'offsets', 'indices')
+class PackedAudioDataset(AudioDatasetMixin, Dataset):
+    """Speech dataset stored in memory mapped arrays.
+
+    A replacement for :class:`H5PYAudioDataset` that can be used as
+    `data.dataset_class`.
+
+    Parameters
+    ----------
+    file_or_path : str
+        The directory of the packed dataset.
+    which_sets : tuple of str
+        The splits to use.
+    target_source : str
+        The source with the character labels.
+
+    """
+    def __init__(self, file_or_path, which_sets, target_source, **kwargs):
+        self.path = file_or_path
+        self.which_sets = which_sets
+        with open(os.path.join(self.path, INFO_FILE), 'rb') as src:
+            self.info = cPickle.load(src)
+        self.provides_sources = tuple(self.info['sources'])
+        super(PackedAudioDataset, self).__init__(**kwargs)
+        self.init_characters(target_source)
+
+    def load(self):
+        self.data_sources = {}
+        self.offsets = {}
+        for source in self.sources:
+            self.data_sources[source] = numpy.load(
+                _data_path(self.path, source), mmap_mode='r')
+            if self.info['sources'][source]['vlen']:
+                self.offsets[source] = numpy.load(
+                    _offsets_path(self.path, source))
+        # Like the union of the subsets of H5PYDataset
+        self.indices = numpy.unique(numpy.concatenate(
+            [numpy.load(_split_path(self.path, split))
+             for split in self.which_sets]))
+
+    @property
+    def num_examples(self):
+        return len(self.indices)
+
+    def character_map(self, source):
+        return dict(self.info['sources'][source]['value_map'])
+
+    def dim(self, source):
+        return self.data_sources[source].shape[1]
+
+    def example_lengths(self, source):
+        """Returns the lengths of all examples without reading them."""
+        offsets = self.offsets[source]
+        return offsets[self.indices + 1] - offsets[self.indices]
+
+    def _get_example(self, source, index):
+        data = self.data_sources[source]
+        if source in self.offsets:
+            offsets = self.offsets[source]
+            return data[offsets[index]:offsets[index + 1]]
+        return data[index]
+
+    def get_data(self, state=None, request=None):
+        if state is not None or request is None:
+            raise ValueError
+        if isinstance(request, slice):
+            request = range(*request.indices(self.num_examples))
+        if isinstance(request, (list, tuple, numpy.ndarray)):
+            data = []
+            for source in self.sources:
+                examples = numpy.empty(len(request), dtype=object)
+                for i, number in enumerate(request):
+                    examples[i] = self._get_example(
+                        source, self.indices[number])
+                data.append(examples)
+            return tuple(data)
+        return tuple(self._get_example(source, self.indices[request])
+                     for source in self.sources)
+
+
+def pack_hdf5(h5_path, save_path, sources=None, chunk_size=1000):
+    """Converts a Fuel HDF5 speech dataset into a packed one.
+
+    Parameters
+    ----------
+    h5_path : str
+        The HDF5 file, e.g. written by `bin/kaldi2fuel.py`.
+    save_path : str
+        The directory of the packed dataset.
+    sources : list of str, optional
+        The sources to convert, all by default.
+    chunk_size : int
+        The number of examples read at once.
+
+    Notes
+    -----
+    A packed split consists of the same examples for all sources, hence
+    the sources of a split must have the same indices in the HDF5 file.
+    Splits that provide none of the converted sources are skipped.
+
+    """
+    import h5py
+    from fuel.datasets.hdf5 import H5PYDataset
+
+    if not os.path.exists(save_path):
+        os.makedirs(save_path)
+    info = {'sources': {}}
+    with h5py.File(h5_path, 'r') as h5file:
+        if sources is None:
+            sources = H5PYDataset.get_all_sources(h5file)
+        splits = H5PYDataset.get_all_splits(h5file)
+        for source in sources:
+            dataset = h5file[source]
+            num_examples = len(dataset)
+            source_info = {'vlen': source + '_shapes' in h5file,
+                           'value_map': None}
+            if 'value_map' in dataset.attrs:
+                source_info['value_map'] = [
+                    (key, int(value))
+                    for key, value in dataset.attrs['value_map']]
+            if source_info['vlen']:
+                shapes = h5file[source + '_shapes'][...]
+                offsets = numpy.zeros(num_examples + 1, dtype='int64')
+                offsets[1:] = numpy.cumsum(shapes[:, 0])
+                numpy.save(_offsets_path(save_path, source), offsets)
+                packed = numpy.lib.format.open_memmap(
+                    _data_path(save_path, source), mode='w+',
+                    dtype=h5py.check_dtype(vlen=dataset.dtype),
+                    shape=(offsets[-1],) + tuple(shapes[0, 1:]))
+                for start in range(0, num_examples, chunk_size):
+                    stop = min(start + chunk_size, num_examples)
+                    for number, example in zip(range(start, stop),
+                                               dataset[start:stop]):
+                        packed[offsets[number]:offsets[number + 1]] = (
+                            example.reshape(shapes[number]))
+                del packed
+            else:
+                values = dataset[...]
+                if values.dtype == object:
+                    # Strings are stored with a fixed width, as arrays of
+                    # objects can not be memory mapped
+                    values = numpy.array(list(values))
+                numpy.save(_data_path(save_path, source), values)
+            info['sources'][source] = source_info
+            logger.info("Packed {} examples of {}".format(
+                num_examples, source))
+        for split in splits:
+            provided_sources = H5PYDataset.get_provided_sources(
+                h5file, split)
+            split_sources = [source for source in sources
+                             if source in provided_sources]
+            if not split_sources:
+                continue
+            indices = [subset.get_list_representation() for subset in
+                       H5PYDataset.get_subsets(h5file, [split], split_sources)]
+            if any(list(source_indices) != list(indices[0])
+                   for source_indices in indices[1:]):
+                raise ValueError("the sources of split {} have different "
+                                 "examples".format(split))
+            numpy.save(_split_path(save_path, split),
+                       numpy.array(indices[0], dtype='int64'))
+    with open(os.path.join(save_path, INFO_FILE), 'wb') as dst:
+        cPickle.dump(info, dst, cPickle.HIGHEST_PROTOCOL)
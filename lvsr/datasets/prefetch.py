@@ -0,0 +1,238 @@
+"""Prefetching of batches in a background process."""
+import logging
+import multiprocessing
+import traceback
+from multiprocessing.sharedctypes import RawArray
+
+import numpy
+from fuel.transformers import Transformer
+
+logger = logging.getLogger(__name__)
+
+# Arrays in the shared buffers start at multiples of this many bytes
+ALIGNMENT = 16
+# The attributes, besides random number generators, that the wrapped
+# streams change during an epoch and that are passed back at its end
+EPOCH_ATTRIBUTES = ('statistics', 'batch_statistics')
+
+
+def _stream_objects(stream):
+    """Returns a stream, the streams it wraps and their schemes."""
+    objects = []
+    while stream is not None:
+        objects.append(stream)
+        if getattr(stream, 'iteration_scheme', None) is not None:
+            objects.append(stream.iteration_scheme)
+        stream = getattr(stream, 'data_stream', None)
+    return objects
+
+
+def _epoch_state(objects):
+    """Returns the state of the objects that an epoch changes.
+
+    That is the state of their random number generators and the
+    attributes listed in `EPOCH_ATTRIBUTES`.
+
+    """
+    state = []
+    for object_ in objects:
+        attributes = {}
+        for name, value in vars(object_).items():
+            if isinstance(value, numpy.random.RandomState):
+                attributes[name] = (True, value.get_state())
+            elif name in EPOCH_ATTRIBUTES:
+                attributes[name] = (False, value)
+        state.append(attributes)
+    return state
+
+
+def _set_epoch_state(objects, state):
+    """Sets the state returned by :func:`_epoch_state`."""
+    for object_, attributes in zip(objects, state):
+        for name, (is_rng, value) in attributes.items():
+            if is_rng:
+                # The generator can be shared with other objects
+                getattr(object_, name).set_state(value)
+            else:
+                setattr(object_, name, value)
+
+
+def _share(data, buffer_):
+    """Copies the arrays of a batch to a shared buffer.
+
+    Returns a description of every piece of the batch: either a
+    `(None, dtype, shape, offset)` tuple for an array written to the
+    buffer, or `(piece, None, None, None)` for a piece that has to be
+    pickled, e.g. an array of objects or an array that did not fit.
+
+    """
+    pieces = []
+    offset = 0
+    for piece in data:
+        if (isinstance(piece, numpy.ndarray) and piece.dtype != object and
+                offset + piece.nbytes <= len(buffer_)):
+            buffer_[offset:offset + piece.nbytes] = (
+                numpy.ascontiguousarray(piece).reshape(-1).view('int8'))
+            pieces.append((None, piece.dtype.str, piece.shape, offset))
+            offset += -(-piece.nbytes // ALIGNMENT) * ALIGNMENT
+        else:
+            pieces.append((piece, None, None, None))
+    return pieces
+
+
+def _unshare(pieces, buffer_):
+    """Reads back a batch written by :func:`_share` without copying."""
+    data = []
+    for piece, dtype, shape, offset in pieces:
+        if dtype is None:
+            data.append(piece)
+        else:
+            dtype = numpy.dtype(dtype)
+            size = int(numpy.prod(shape)) * dtype.itemsize
+            data.append(buffer_[offset:offset + size].view(dtype).reshape(shape))
+    return tuple(data)
+
+
+def _prefetch(iterator, objects, skip, buffers, free, full):
+    """Puts the batches of an epoch into the shared buffers.
+
+    At the end of the epoch the state of the given objects is passed
+    back, see :func:`_epoch_state`.
+
+    """
+    try:
+        buffers = [numpy.frombuffer(buffer_, dtype='int8')
+                   for buffer_ in buffers]
+        for i, data in enumerate(iterator):
+            if i < skip:
+                continue
+            slot = free.get()
+            full.put(('batch', slot, _share(data, buffers[slot])))
+        full.put(('stop', None, _epoch_state(objects)))
+    except Exception:
+        full.put(('error', None, traceback.format_exc()))
+
+
+class Prefetch(Transformer):
+    """Prefetches the batches of a stream in a background process.
+
+    At the start of every epoch the epoch iterator of the wrapped stream
+    is created in this process and is then consumed by a forked process.
+    When the epoch ends, the states of the random number generators of
+    the wrapped streams and their schemes, and their statistics, are
+    passed back, so that they progress as without prefetching. The
+    batches are passed back through a pool of `num_batches` shared memory
+    buffers, which bounds how far the background process can get ahead.
+    Pieces that do not fit into a buffer or are not numeric arrays are
+    pickled instead.
+
+    The arrays returned are views of a shared buffer that is reused once
+    the next batch is requested, they should be copied if they have to
+    live longer.
+
+    Changes of the wrapped stream made after the start of an epoch, e.g.
+    switching off a length filter, take effect from the next epoch. The
+    random state of an epoch that is not finished is lost.
+
+    Parameters
+    ----------
+    data_stream : :class:`AbstractDataStream` instance
+        The data stream to prefetch.
+    num_batches : int
+        The maximum number of batches prepared ahead.
+    buffer_size : int
+        The size of every shared buffer in bytes.
+
+    """
+    def __init__(self, data_stream, num_batches=4, buffer_size=2 ** 25,
+                 **kwargs):
+        kwargs.setdefault('axis_labels', data_stream.axis_labels)
+        super(Prefetch, self).__init__(
+            data_stream, data_stream.produces_examples, **kwargs)
+        self.num_batches = num_batches
+        self.buffer_size = buffer_size
+        # The number of batches of the current epoch handed out, used to
+        # resume the epoch after unpickling
+        self.num_taken = 0
+        self.finished = False
+        self._clear()
+
+    def _clear(self):
+        self._buffers = None
+        self._views = None
+        self._worker = None
+        self._free = None
+        self._full = None
+        self._in_use = None
+
+    def _start(self, skip):
+        if self._buffers is None:
+            self._buffers = [RawArray('b', self.buffer_size)
+                             for _ in range(self.num_batches)]
+            self._views = [numpy.frombuffer(buffer_, dtype='int8')
+                           for buffer_ in self._buffers]
+        self._free = multiprocessing.Queue()
+        for slot in range(self.num_batches):
+            self._free.put(slot)
+        self._full = multiprocessing.Queue()
+        self._in_use = None
+        self._worker = multiprocessing.Process(
+            target=_prefetch,
+            args=(self.child_epoch_iterator,
+                  _stream_objects(self.data_stream), skip, self._buffers,
+                  self._free, self._full))
+        self._worker.daemon = True
+        self._worker.start()
+
+    def _stop(self):
+        if self._worker is not None:
+            if self._worker.is_alive():
+                self._worker.terminate()
+            self._worker.join()
+            self._worker = None
+
+    def get_epoch_iterator(self, **kwargs):
+        self._stop()
+        epoch_iterator = super(Prefetch, self).get_epoch_iterator(**kwargs)
+        self.num_taken = 0
+        self.finished = False
+        self._start(0)
+        return epoch_iterator
+
+    def get_data(self, request=None):
+        if request is not None:
+            raise ValueError
+        if self.finished:
+            raise StopIteration
+        if self._worker is None:
+            logger.info("Resume prefetching after {} batches".format(
+                self.num_taken))
+            self._start(self.num_taken)
+        if self._in_use is not None:
+            self._free.put(self._in_use)
+            self._in_use = None
+
+        kind, slot, pieces = self._full.get()
+        if kind == 'stop':
+            _set_epoch_state(_stream_objects(self.data_stream), pieces)
+            self.finished = True
+            self._stop()
+            raise StopIteration
+        if kind == 'error':
+            self._stop()
+            raise RuntimeError(
+                "Prefetching process failed:\n{}".format(pieces))
+        self._in_use = slot
+        self.num_taken += 1
+        return _unshare(pieces, self._views[slot])
+
+    def close(self):
+        self._stop()
+        super(Prefetch, self).close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for attribute in ['_buffers', '_views', '_worker', '_free',
+                          '_full', '_in_use']:
+            state[attribute] = None
+        return state
@@ -0,0 +1,184 @@
+"""Iteration schemes aware of the lengths of the examples."""
+from itertools import chain
+
+import numpy
+from fuel import config
+from fuel.schemes import IndexScheme
+from picklable_itertools import iter_
+
+
+class _LengthScheme(IndexScheme):
+    """Base class for schemes using precomputed lengths of examples."""
+    def __init__(self, lengths, examples=None, length_filter=None, rng=None):
+        self.lengths = numpy.asarray(lengths)
+        self.length_filter = length_filter
+        self.rng = rng
+        if self.rng is None:
+            self.rng = numpy.random.RandomState(config.default_seed)
+        if examples is None:
+            examples = len(self.lengths)
+        super(_LengthScheme, self).__init__(examples)
+
+    def _examples(self):
+        return numpy.array(self.indices, dtype='int64')
+
+    def _filter(self, indices):
+        """Drops the examples rejected by the length filter."""
+        max_length = (self.length_filter.max_length
+                      if self.length_filter else None)
+        if max_length:
+            return indices[self.lengths[indices] <= max_length]
+        return indices
+
+
+class LengthIndexScheme(_LengthScheme):
+    """Examples filtered and sorted by their precomputed lengths.
+
+    Since the lengths are known in advance, examples rejected by the
+    length filter are never requested from the dataset.
+
+    Parameters
+    ----------
+    lengths : array of int
+        The lengths of all examples of the dataset.
+    examples : int or list, optional
+        The examples to iterate over, as for :class:`IndexScheme`. All
+        by default.
+    length_filter : :class:`_LengthFilter`, optional
+        Examples longer than its `max_length` are skipped. It is queried
+        at the start of every epoch, so that it can be switched off
+        during training.
+    shuffle : bool
+        Shuffle the examples every epoch.
+    sort_window : int, optional
+        If given, consecutive groups of this many examples are sorted by
+        length.
+    rng : :class:`numpy.random.RandomState`, optional
+        The random number generator.
+
+    """
+    def __init__(self, lengths, examples=None, length_filter=None,
+                 shuffle=False, sort_window=None, rng=None):
+        super(LengthIndexScheme, self).__init__(
+            lengths, examples, length_filter, rng)
+        self.shuffle = shuffle
+        self.sort_window = sort_window
+
+    def get_request_iterator(self):
+        indices = self._filter(self._examples())
+        if self.shuffle:
+            self.rng.shuffle(indices)
+        if self.sort_window:
+            windows = [indices[i:i + self.sort_window]
+                       for i in range(0, len(indices), self.sort_window)]
+            # A stable sort, like the one of `SortMapping`
+            indices = numpy.concatenate(
+                [window[numpy.argsort(self.lengths[window], kind='mergesort')]
+                 for window in windows] + [indices[:0]])
+        return iter_(indices.tolist())
+
+
+class LengthBucketScheme(_LengthScheme):
+    """Shuffled examples grouped into batches of similar length.
+
+    The examples are split into `num_buckets` buckets of (almost) equal
+    size by their lengths. Every epoch the examples of each bucket are
+    shuffled and cut into batches of `batch_size`, the examples left over
+    in a bucket are batched with the ones from the next longer bucket.
+    The order of the batches is then shuffled, the only incomplete batch
+    is put last. Because of that, grouping the returned examples into
+    consecutive batches of `batch_size` reproduces the batches exactly.
+
+    Parameters
+    ----------
+    lengths : array of int
+        The lengths of all examples of the dataset.
+    batch_size : int
+        The batch size.
+    num_buckets : int
+        The number of buckets.
+    examples : int or list, optional
+        The examples to iterate over, all by default.
+    length_filter : :class:`_LengthFilter`, optional
+        Examples longer than its `max_length` are skipped. It is queried
+        at the start of every epoch, so that it can be switched off
+        during training.
+    rng : :class:`numpy.random.RandomState`, optional
+        The random number generator.
+
+    """
+    def __init__(self, lengths, batch_size, num_buckets, examples=None,
+                 length_filter=None, rng=None):
+        super(LengthBucketScheme, self).__init__(
+            lengths, examples, length_filter, rng)
+        self.batch_size = batch_size
+        self.num_buckets = num_buckets
+        # A stable sort keeps buckets the same between runs
+        examples = self._examples()
+        self.buckets = numpy.array_split(
+            examples[numpy.argsort(self.lengths[examples], kind='mergesort')],
+            num_buckets)
+
+    def get_request_iterator(self):
+        indices = []
+        for bucket in self.buckets:
+            bucket = self._filter(bucket).copy()
+            self.rng.shuffle(bucket)
+            indices.extend(bucket.tolist())
+        batches = [indices[i:i + self.batch_size]
+                   for i in range(0, len(indices), self.batch_size)]
+        last = []
+        if batches and len(batches[-1]) < self.batch_size:
+            last = batches.pop()
+        self.rng.shuffle(batches)
+        return iter_(list(chain(*batches)) + last)
+
+
+class BlockShuffledScheme(_LengthScheme):
+    """Shuffled blocks of contiguous examples, for cheap reading from disk.
+
+    Every epoch the examples are cut into blocks of `block_size`
+    consecutive examples and the order of the blocks is shuffled. Every
+    block is requested as one slice, so that an out-of-memory dataset
+    reads it in one call instead of `block_size` random ones. Examples
+    rejected by the length filter split a block into several slices.
+    The examples of a block stay together, :class:`WindowShuffle` mixes
+    them with the ones of the neighbouring blocks.
+
+    Parameters
+    ----------
+    lengths : array of int
+        The lengths of all examples of the dataset.
+    block_size : int
+        The number of consecutive examples in a block.
+    examples : int or list, optional
+        The examples to iterate over, all by default.
+    length_filter : :class:`_LengthFilter`, optional
+        Examples longer than its `max_length` are skipped. It is queried
+        at the start of every epoch, so that it can be switched off
+        during training.
+    rng : :class:`numpy.random.RandomState`, optional
+        The random number generator.
+
+    """
+    requests_examples = False
+
+    def __init__(self, lengths, block_size, examples=None,
+                 length_filter=None, rng=None):
+        super(BlockShuffledScheme, self).__init__(
+            lengths, examples, length_filter, rng)
+        self.block_size = block_size
+
+    def get_request_iterator(self):
+        indices = self._examples()
+        blocks = [indices[i:i + self.block_size]
+                  for i in range(0, len(indices), self.block_size)]
+        requests = []
+        for number in self.rng.permutation(len(blocks)):
+            block = self._filter(blocks[number])
+            # Split the block where examples are missing
+            starts = numpy.flatnonzero(numpy.diff(block) != 1) + 1
+            for run in numpy.split(block, starts):
+                if len(run):
+                    requests.append(slice(int(run[0]), int(run[-1]) + 1))
+        return iter_(requests)
@@ -6,6 +6,124 @@ DELETION = 2
 SUBSTITUTION = 3
 
 INFINITY = 10 ** 9
+# The largest number of cells of the padded matrices computed together
+MAX_CELLS = 2 ** 22
+
+
+def _encode(sequences, codes, padding):
+    """Encode sequences of hashable symbols as a padded integer matrix."""
+    max_length = max([len(sequence) for sequence in sequences] + [0])
+    encoded = numpy.zeros((len(sequences), max_length), dtype='int64')
+    encoded[:] = padding
+    for row, sequence in zip(encoded, sequences):
+        row[:len(sequence)] = [codes.setdefault(symbol, len(codes))
+                               for symbol in sequence]
+    return encoded
+
+
+def _length_groups(ys, y_hats, max_cells=MAX_CELLS):
+    """Splits pairs of sequences into groups of similar lengths.
+
+    The pairs are sorted by length and cut into groups, such that the
+    padded matrices of a group have at most `max_cells` cells, unless
+    a group consists of a single pair.
+
+    Returns
+    -------
+    list of lists
+        The indices of the pairs of every group.
+
+    """
+    groups = []
+    group = []
+    rows = columns = 0
+    for index in sorted(range(len(ys)),
+                        key=lambda index: (len(ys[index]),
+                                           len(y_hats[index]))):
+        new_rows = max(rows, len(ys[index]) + 1)
+        new_columns = max(columns, len(y_hats[index]) + 1)
+        if group and (len(group) + 1) * new_rows * new_columns > max_cells:
+            groups.append(group)
+            group = []
+            new_rows = len(ys[index]) + 1
+            new_columns = len(y_hats[index]) + 1
+        group.append(index)
+        rows, columns = new_rows, new_columns
+    if group:
+        groups.append(group)
+    return groups
+
+
+def _edit_distance_matrices(ys, y_hats, with_actions=True):
+    """Returns the matrices of edit distances for many pairs.
+
+    The dynamic programming is vectorized over the anti-diagonals of the
+    matrices and over the pairs. The matrices are padded to the longest
+    sequences, see :func:`_length_groups` to bound their size.
+
+    Parameters
+    ----------
+    ys : list of sequences
+        The groundtruths.
+    y_hats : list of sequences
+        The recognition candidates.
+    with_actions : bool
+        If ``False``, the action matrices are not computed.
+
+    Returns
+    -------
+    dist : numpy.ndarray
+        A (number of pairs, longest y + 1, longest y_hat + 1) array,
+        `dist[k, :len(ys[k]) + 1, :len(y_hats[k]) + 1]` is the matrix
+        returned by :func:`_edit_distance_matrix` for the k-th pair.
+        The rest is padding.
+    action : numpy.ndarray
+        The action matrices padded the same way, ``None`` if
+        `with_actions` is ``False``.
+
+    """
+    if len(ys) != len(y_hats):
+        raise ValueError("numbers of groundtruths and candidates differ")
+    codes = {}
+    # The paddings are distinct and never equal to a symbol
+    y_codes = _encode(ys, codes, -1)
+    y_hat_codes = _encode(y_hats, codes, -2)
+    batch_size, max_y_length = y_codes.shape
+    max_y_hat_length = y_hat_codes.shape[1]
+
+    dist = numpy.zeros((batch_size, max_y_length + 1, max_y_hat_length + 1),
+                       dtype='int64')
+    action = dist.copy() if with_actions else None
+    dist[:, :, 0] = numpy.arange(max_y_length + 1)
+    dist[:, 0, :] = numpy.arange(max_y_hat_length + 1)
+
+    # All cells of an anti-diagonal depend only on the previous two
+    # anti-diagonals. The padding cells depend only on cells with
+    # larger indices, so they never affect the valid ones.
+    for diagonal in xrange(2, max_y_length + max_y_hat_length + 1):
+        i = numpy.arange(max(1, diagonal - max_y_hat_length),
+                         min(max_y_length, diagonal - 1) + 1)
+        j = diagonal - i
+        cost = (y_codes[:, i - 1] != y_hat_codes[:, j - 1]).astype('int64')
+        insertion_dist = dist[:, i - 1, j] + 1
+        deletion_dist = dist[:, i, j - 1] + 1
+        # Substitution if the characters differ, copy otherwise
+        diagonal_dist = dist[:, i - 1, j - 1] + cost
+        best = numpy.minimum(numpy.minimum(insertion_dist, deletion_dist),
+                             diagonal_dist)
+
+        dist[:, i, j] = best
+        if not with_actions:
+            continue
+        # When several actions are optimal copy or substitution is
+        # preferred to deletion, which is preferred to insertion.
+        action[:, i, j] = numpy.where(
+            best == diagonal_dist,
+            numpy.where(cost, SUBSTITUTION, COPY),
+            numpy.where(best == deletion_dist,
+                        DELETION, action[:, i - 1, j]))
+
+    return dist, action
 
 
 def _edit_distance_matrix(y, y_hat):
@@ -21,37 +139,8 @@ def _edit_distance_matrix(y, y_hat):
         i characters of y and the first j characters of y_hat.
 
     """
-    dist = numpy.zeros((len(y) + 1, len(y_hat) + 1), dtype='int64')
-    action = dist.copy()
-    for i in xrange(len(y) + 1):
-        dist[i][0] = i
-    for j in xrange(len(y_hat) + 1):
-        dist[0][j] = j
-
-    for i in xrange(1, len(y) + 1):
-        for j in xrange(1, len(y_hat) + 1):
-            if y[i - 1] != y_hat[j - 1]:
-                cost = 1
-            else:
-                cost = 0
-            insertion_dist = dist[i - 1][j] + 1
-            deletion_dist = dist[i][j - 1] + 1
-            substitution_dist = dist[i - 1][j - 1] + 1 if cost else INFINITY
-            copy_dist = dist[i - 1][j - 1] if not cost else INFINITY
-            best = min(insertion_dist, deletion_dist,
-                       substitution_dist, copy_dist)
-
-            dist[i][j] = best
-            if best == insertion_dist:
-                action[i][j] = action[i - 1][j]
-            if best == deletion_dist:
-                action[i][j] = DELETION
-            if best == substitution_dist:
-                action[i][j] = SUBSTITUTION
-            if best == copy_dist:
-                action[i][j] = COPY
-
-    return dist, action
+    dist, action = _edit_distance_matrices([y], [y_hat])
+    return dist[0], action[0]
 
 
 def edit_distance(y, y_hat):
@@ -72,41 +161,129 @@ def edit_distance(y, y_hat):
     return _edit_distance_matrix(y, y_hat)[0][-1, -1]
 
 
+def edit_distances(ys, y_hats):
+    """Edit distances between many pairs of sequences.
+
+    The pairs are processed together, see :func:`edit_distance`.
+
+    Returns
+    -------
+    numpy.ndarray
+        The edit distance for every pair.
+
+    """
+    distances = numpy.zeros(len(ys), dtype='int64')
+    for group in _length_groups(ys, y_hats):
+        group_ys = [ys[index] for index in group]
+        group_y_hats = [y_hats[index] for index in group]
+        dist, _ = _edit_distance_matrices(group_ys, group_y_hats,
+                                          with_actions=False)
+        distances[group] = dist[numpy.arange(len(group)),
+                                [len(y) for y in group_ys],
+                                [len(y_hat) for y_hat in group_y_hats]]
+    return distances
+
+
+def _alignment(dist, y, y_hat):
+    """Backtraces an optimal alignment from a matrix of edit distances.
+
+    Copies and substitutions are preferred to insertions of symbols of
+    `y`, which are preferred to deletions of symbols of `y_hat`.
+
+    """
+    pairs = []
+    i, j = len(y), len(y_hat)
+    while i > 0 or j > 0:
+        if (i > 0 and j > 0 and
+                dist[i, j] == dist[i - 1, j - 1] + (y[i - 1] != y_hat[j - 1])):
+            pairs.append((y[i - 1], y_hat[j - 1]))
+            i, j = i - 1, j - 1
+        elif i > 0 and dist[i, j] == dist[i - 1, j] + 1:
+            pairs.append((y[i - 1], None))
+            i -= 1
+        else:
+            pairs.append((None, y_hat[j - 1]))
+            j -= 1
+    return pairs[::-1]
+
+
+def alignments(ys, y_hats):
+    """Optimal alignments of many pairs of sequences.
+
+    Returns
+    -------
+    list of lists
+        For every pair a list of `(y symbol, y_hat symbol)` tuples. A
+        symbol of `y` missing in `y_hat` is paired with None and vice
+        versa.
+
+    """
+    result = [None] * len(ys)
+    for group in _length_groups(ys, y_hats):
+        dist, _ = _edit_distance_matrices([ys[index] for index in group],
+                                          [y_hats[index] for index in group],
+                                          with_actions=False)
+        for index, pair_dist in zip(group, dist):
+            result[index] = _alignment(pair_dist, ys[index], y_hats[index])
+    return result
+
+
 def wer(y, y_hat):
     return edit_distance(y, y_hat) / float(len(y))
 
 
+def _alphabet_indices(sequence, alphabet):
+    """Positions of the characters of a sequence in the alphabet."""
+    positions = {}
+    for position, character in enumerate(alphabet):
+        positions.setdefault(character, position)
+    return numpy.array([positions[character] for character in sequence],
+                       dtype='int64')
+
+
+def _reward_matrix(dist, y_indices, alphabet_size, eos_label):
+    """Computes the reward matrix from the edit distance matrix.
+
+    Parameters
+    ----------
+    dist : numpy.ndarray
+        The edit distance matrix of the groundtruth and the candidate.
+    y_indices : numpy.ndarray
+        The alphabet indices of the groundtruth characters. The last one
+        must be `eos_label`.
+
+    """
+    y_length = len(y_indices)
+    # Optimistic edit distance for every y_hat prefix
+    optim_dist = dist.min(axis=0)
+    # Optimistic edit distance for every y_hat prefix plus a character:
+    # appending y[i] to a prefix can give the distance dist[i]
+    optim_dist_char = numpy.tile(optim_dist + 1, (alphabet_size, 1))
+    numpy.minimum.at(optim_dist_char, y_indices, dist[:y_length])
+    pess_char_reward = -optim_dist_char.T
+    # Here we rely on y[-1] being eos_label
+    pess_char_reward[:, eos_label] = -dist[y_length - 1]
+    return pess_char_reward
+
+
+def _gain_matrix(reward, y_hat_indices):
+    gain = reward.copy()
+    gain[1:] -= reward[:-1][numpy.arange(len(y_hat_indices)),
+                            y_hat_indices][:, None]
+    return gain
+
+
 def reward_matrix(y, y_hat, alphabet, eos_label):
     dist, _,  = _edit_distance_matrix(y, y_hat)
-    y_alphabet_indices = [alphabet.index(c) for c in y]
+    y_alphabet_indices = _alphabet_indices(y, alphabet)
     if y_alphabet_indices[-1] != eos_label:
         raise ValueError("Last character of the groundtruth must be EOS")
+    return _reward_matrix(dist, y_alphabet_indices, len(alphabet), eos_label)
 
-    # Optimistic edit distance for every y_hat prefix
-    optim_dist = dist.min(axis=0)
-    pess_reward = -optim_dist
-
-    # Optimistic edit distance for every y_hat prefix plus a character
-    optim_dist_char = numpy.tile(
-        optim_dist[:, None], [1, len(alphabet)]) + 1
-    pess_char_reward = numpy.tile(
-        pess_reward[:, None], [1, len(alphabet)]) - 1
-    for i in range(len(y)):
-        for j in range(len(y_hat) + 1):
-            c = y_alphabet_indices[i]
-            cand_dist = dist[i, j]
-            if cand_dist < optim_dist_char[j, c]:
-                optim_dist_char[j, c] = cand_dist
-                pess_char_reward[j, c] = -cand_dist
-    for j in range(len(y_hat) + 1):
-        # Here we rely on y[-1] being eos_label
-        pess_char_reward[j, eos_label] = -dist[len(y) - 1, j]
-    return pess_char_reward
 
 def gain_matrix(y, y_hat, alphabet=None, given_reward_matrix=None,
                 eos_label=None):
-    y_hat_indices = [alphabet.index(c) for c in y_hat]
-    reward = (given_reward_matrix.copy() if given_reward_matrix is not None
+    y_hat_indices = _alphabet_indices(y_hat, alphabet)
+    reward = (given_reward_matrix if given_reward_matrix is not None
               else reward_matrix(y, y_hat, alphabet, eos_label))
-    reward[1:] -= reward[:-1][numpy.arange(len(y_hat)), y_hat_indices][:, None]
-    return reward
+    return _gain_matrix(reward, y_hat_indices)
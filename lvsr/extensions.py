@@ -4,6 +4,9 @@ import subprocess
 import pkgutil
 import math
 import logging
+import multiprocessing
+import traceback
+from Queue import Empty
 import numpy
 from picklable_itertools.extras import equizip
 
@@ -11,6 +14,8 @@ from theano.scan_module.scan_op import Scan
 
 from blocks.extensions import TrainingExtension, SimpleExtension,\
     FinishAfter
+from blocks.extensions.monitoring import DataStreamMonitoring
+from blocks.extensions.saveload import Checkpoint
 from blocks.filter import VariableFilter
 from blocks.roles import INPUT
 from blocks.utils import shared_floatx_zeros
@@ -184,6 +189,10 @@ class Patience(FinishAfter):
     By default, runs after each epoch. This can be manipulated via
     keyword arguments (see :class:`blocks.extensions.SimpleExtension`).
 
+    When called with the ``'update_best'`` argument, e.g. as a delayed
+    extension of :class:`AsyncDataStreamMonitoring`, only the iteration
+    and the epoch of the best performer are updated.
+
     """
     def __init__(self, notification_names, min_iterations=None,
                  min_epochs=None, patience_factor=1.5,
@@ -215,11 +224,19 @@ class Patience(FinishAfter):
                 break
 
         if matched:
-            self.last_best_iter = self.main_loop.log.status['iterations_done']
-            self.last_best_epoch = self.main_loop.log.status['epochs_done']
+            # Delayed records can be older than the best one so far
+            self.last_best_iter = max(
+                self.last_best_iter,
+                self.main_loop.log.status['iterations_done'])
+            self.last_best_epoch = max(
+                self.last_best_epoch,
+                self.main_loop.log.status['epochs_done'])
 
     def do(self, which_callback, *args):
         self.update_best()
+        _, from_user = self.parse_args(which_callback, args)
+        if from_user == ('update_best',):
+            return
         if self.min_epochs is not None:
             to_do = max(self.min_epochs,
                         int(self.patience_factor * self.last_best_epoch+0.5))
@@ -232,3 +249,129 @@ class Patience(FinishAfter):
             self.main_loop.log.status[self.patience_log_record] = to_do
             if to_do <= self.main_loop.log.status['iterations_done']:
                 super(Patience, self).do(which_callback, *args)
+
+
+class AsyncDataStreamMonitoring(DataStreamMonitoring):
+    """Monitors a data stream in a background process.
+
+    Whenever the monitoring is triggered, the current parameters are kept
+    and a process is forked that evaluates the variables with them,
+    while the training continues. Forking shares the compiled functions
+    and the parameters with the process, hence like `run.py search
+    --workers` this requires the model to be on the CPU. Monitoring is not
+    triggered again while a process is running.
+
+    The results are checked for after every batch and written to the log
+    row of the iteration at which the monitoring was triggered. Then the
+    extensions added with :meth:`add_delayed_extension` are run as if
+    that row was the current one and the kept parameters were the
+    current ones, so that e.g. :class:`TrackTheBest` compares the delayed
+    records and a :class:`Checkpoint` saves the parameters that were
+    evaluated. As the rest of the status is not rewound, such a
+    checkpoint must not pickle the main loop, and :class:`Patience` must
+    be called with the ``'update_best'`` argument.
+
+    """
+    def __init__(self, variables, data_stream, **kwargs):
+        super(AsyncDataStreamMonitoring, self).__init__(
+            variables, data_stream, **kwargs)
+        self.delayed_extensions = []
+        self._clear()
+
+    def set_conditions(self, **kwargs):
+        super(AsyncDataStreamMonitoring, self).set_conditions(**kwargs)
+        # The results are received independently of the conditions
+        self.add_condition(['after_batch'], arguments=('receive',))
+        self.add_condition(['after_training'], arguments=('wait',))
+        return self
+
+    def _clear(self):
+        self._process = None
+        self._queue = None
+        self._iteration = None
+        self._parameters = None
+
+    def add_delayed_extension(self, extension, predicate=None,
+                              arguments=()):
+        """Runs an extension when delayed records are written.
+
+        The predicate and the arguments are as for
+        :meth:`SimpleExtension.add_condition`.
+
+        """
+        if isinstance(extension, Checkpoint) and extension.save_main_loop:
+            raise ValueError("a delayed checkpoint can only save "
+                             "the parameters")
+        self.delayed_extensions.append((extension, predicate, arguments))
+        return self
+
+    def _start(self):
+        if self._process is not None:
+            logger.warning("Monitoring on auxiliary data is still running, "
+                           "skip it at iteration {}".format(
+                               self.main_loop.status['iterations_done']))
+            return
+        self._iteration = self.main_loop.status['iterations_done']
+        self._parameters = self.main_loop.model.get_parameter_values()
+        self._queue = multiprocessing.Queue()
+        queue = self._queue
+
+        def work():
+            try:
+                value_dict = self._evaluator.evaluate(self.data_stream)
+                queue.put(dict(value_dict))
+            except Exception:
+                logger.error(traceback.format_exc())
+                queue.put(None)
+
+        logger.info("Monitoring on auxiliary data started in background")
+        self._process = multiprocessing.Process(target=work)
+        self._process.daemon = True
+        self._process.start()
+
+    def _receive(self, block):
+        if self._process is None:
+            return
+        try:
+            value_dict = self._queue.get(block=block)
+        except Empty:
+            return
+        self._process.join()
+        iteration, parameters = self._iteration, self._parameters
+        self._clear()
+        if value_dict is None:
+            logger.error("Monitoring on auxiliary data failed")
+            return
+        logger.info("Monitoring on auxiliary data of iteration {} "
+                    "finished".format(iteration))
+        log = self.main_loop.log
+        model = self.main_loop.model
+        iterations_done = log.status['iterations_done']
+        current_parameters = model.get_parameter_values()
+        log.status['iterations_done'] = iteration
+        model.set_parameter_values(parameters)
+        try:
+            self.add_records(log, value_dict.items())
+            for extension, predicate, arguments in self.delayed_extensions:
+                # The delayed extensions need not be added to the main loop
+                extension.main_loop = self.main_loop
+                if predicate is None or predicate(log):
+                    extension.do('after_epoch', *arguments)
+        finally:
+            log.status['iterations_done'] = iterations_done
+            model.set_parameter_values(current_parameters)
+
+    def do(self, callback_name, *args):
+        _, from_user = self.parse_args(callback_name, args)
+        if from_user == ('receive',):
+            self._receive(block=False)
+        elif from_user == ('wait',):
+            self._receive(block=True)
+        else:
+            self._start()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for attribute in ['_process', '_queue', '_iteration', '_parameters']:
+            state[attribute] = None
+        return state
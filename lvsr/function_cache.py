@@ -0,0 +1,193 @@
+"""An on-disk cache of compiled Theano functions.
+
+Compiling the training function and the beam search functions of a large
+model spends minutes in Theano's graph optimizer. A compiled function can
+be pickled together with its optimized graph, and with
+``reoptimize_unpickled_function`` switched off it is unpickled without
+optimizing it again. This module saves the compiled functions to a
+directory and loads them in later runs.
+
+The shared variables, e.g. the parameters, of a cached function are not
+pickled. They are saved as references to the shared variables of the
+graph given to :func:`function`, so that the loaded function uses the
+shared variables of the current run.
+
+A cache entry is keyed by a hash of the `net` configuration, the Theano
+flags, the source code of Theano, Blocks and this package, and the graph
+of the function itself.
+
+"""
+import cPickle
+import hashlib
+import logging
+import os
+import pprint
+import re
+import time
+
+import theano
+from theano.compile import SharedVariable
+from theano.configparser import change_flags
+
+from blocks.graph import ComputationGraph
+
+logger = logging.getLogger(__name__)
+
+# The cache used by :func:`function`, set by :func:`configure`
+_cache = None
+
+
+def code_version(packages):
+    """Returns a hash of the source files of the given packages."""
+    md5 = hashlib.md5()
+    for package in packages:
+        root = os.path.dirname(package.__file__)
+        for directory, subdirectories, files in os.walk(root):
+            subdirectories.sort()
+            for name in sorted(files):
+                if name.endswith('.py'):
+                    md5.update(os.path.relpath(
+                        os.path.join(directory, name), root))
+                    with open(os.path.join(directory, name), 'rb') as src:
+                        md5.update(src.read())
+    return md5.hexdigest()
+
+
+def _variables(outputs, updates):
+    if outputs is None:
+        outputs = []
+    elif isinstance(outputs, dict):
+        outputs = [outputs[key] for key in sorted(outputs)]
+    elif not isinstance(outputs, (list, tuple)):
+        outputs = [outputs]
+    updates = updates.items() if isinstance(updates, dict) else updates
+    return list(outputs) + [variable for update in (updates or [])
+                            for variable in update]
+
+
+class FunctionCache(object):
+    """Compiles Theano functions or loads them from a directory.
+
+    Parameters
+    ----------
+    directory : str
+        The directory of the cache.
+    net_config : dict
+        The configuration of the network.
+
+    """
+    def __init__(self, directory, net_config):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        import blocks
+        import lvsr
+        # The addresses of objects differ between runs
+        net_config = re.sub(' at 0x[0-9a-f]+', '',
+                            pprint.pformat(net_config))
+        md5 = hashlib.md5()
+        md5.update(net_config)
+        md5.update(code_version([theano, blocks, lvsr]))
+        self.key = md5.hexdigest()
+
+    def _path(self, inputs, outputs, updates, kwargs):
+        graph = theano.printing.debugprint(
+            _variables(outputs, updates), file='str', print_type=True)
+        md5 = hashlib.md5(self.key)
+        # The flags can change after the cache is created
+        md5.update(str(theano.config))
+        md5.update(repr([(variable.name, str(variable.type))
+                         for variable in inputs]))
+        md5.update(graph)
+        md5.update(pprint.pformat(kwargs))
+        return os.path.join(self.directory, md5.hexdigest() + '.pkl')
+
+    def function(self, inputs, outputs=None, updates=None, name=None,
+                 **kwargs):
+        """Works like :func:`theano.function`."""
+        start_time = time.time()
+        shared_variables = ComputationGraph(
+            _variables(outputs, updates)).shared_variables
+        signature = [(variable.name, str(variable.type))
+                     for variable in shared_variables]
+        path = self._path(inputs, outputs, updates, kwargs)
+        if os.path.exists(path):
+            try:
+                function = self._load(path, shared_variables, signature)
+                logger.info(
+                    "Function cache hit for {}: loaded {} in {:.1f} "
+                    "seconds".format(name, path, time.time() - start_time))
+                return function
+            except Exception:
+                logger.warning("Could not load {} from the function cache"
+                               .format(path), exc_info=True)
+        function = theano.function(inputs, outputs, updates=updates,
+                                   name=name, **kwargs)
+        logger.info("Function cache miss for {}: compiled in {:.1f} seconds"
+                    .format(name, time.time() - start_time))
+        self._save(path, function, shared_variables, signature)
+        return function
+
+    def _save(self, path, function, shared_variables, signature):
+        references = {}
+        for number, variable in enumerate(shared_variables):
+            references[id(variable)] = ('shared', number)
+            references[id(variable.container)] = ('container', number)
+            # The compiled function refers to the storage list itself,
+            # which `set_value` puts new values into
+            references[id(variable.container.storage)] = ('storage', number)
+            references[id(variable.container.storage[0])] = ('value', number)
+        used = [input_.variable for input_ in function.maker.inputs
+                if isinstance(input_.variable, SharedVariable)]
+        if any(id(variable) not in references for variable in used):
+            logger.warning("Not caching a function with shared variables "
+                           "outside of its graph")
+            return
+
+        def persistent_id(obj):
+            return references.get(id(obj))
+
+        # Written to a temporary file first, so that other processes never
+        # read an incomplete one
+        temporary_path = '{}.{}'.format(path, os.getpid())
+        with open(temporary_path, 'wb') as destination:
+            pickler = cPickle.Pickler(destination, cPickle.HIGHEST_PROTOCOL)
+            pickler.dump(signature)
+            pickler.persistent_id = persistent_id
+            pickler.dump(function)
+        os.rename(temporary_path, path)
+
+    def _load(self, path, shared_variables, signature):
+        def persistent_load(reference):
+            kind, number = reference
+            variable = shared_variables[number]
+            if kind == 'shared':
+                return variable
+            elif kind == 'container':
+                return variable.container
+            elif kind == 'storage':
+                return variable.container.storage
+            return variable.container.storage[0]
+
+        with open(path, 'rb') as source:
+            unpickler = cPickle.Unpickler(source)
+            if unpickler.load() != signature:
+                raise ValueError("the shared variables do not match")
+            unpickler.persistent_load = persistent_load
+            return change_flags(unpickle_function=True,
+                                reoptimize_unpickled_function=False)(
+                                    unpickler.load)()
+
+
+def configure(directory, net_config):
+    """Makes :func:`function` use a cache in the given directory."""
+    global _cache
+    _cache = FunctionCache(directory, net_config)
+    logger.info("Using the function cache {}".format(directory))
+
+
+def function(inputs, outputs=None, updates=None, **kwargs):
+    """Compiles a function, using the cache if it is configured."""
+    if _cache is None:
+        return theano.function(inputs, outputs, updates=updates, **kwargs)
+    return _cache.function(inputs, outputs, updates=updates, **kwargs)
@@ -7,13 +7,14 @@ Created on Jan 11, 2016
 import numpy
 import pandas
 
-from collections import Mapping, OrderedDict
+from collections import MutableMapping, OrderedDict
 from blocks.log.log import TrainingLogBase
 
 
-class _TimeSlice(Mapping):
+class _TimeSlice(MutableMapping):
     def __init__(self, time, log):
         self._time = time
+        self._log = log
         self._columns = log._columns
         assert isinstance(self._columns, OrderedDict)
 
@@ -27,6 +28,13 @@ class _TimeSlice(Mapping):
                 return row['val']
         raise KeyError
 
+    def __setitem__(self, item, value):
+        # Records delayed by asynchronous monitoring
+        self._log._write(item, self._time, value)
+
+    def __delitem__(self, item):
+        raise KeyError("Can't delete log entries")
+
     def __iter__(self):
         time = self._time
         for k, ndarr in self._columns.iteritems():
@@ -78,39 +86,49 @@ class NDarrayLog(TrainingLogBase):
         elif time > self._current_time:
             # Append the last value to column arrays
             for k, v in self._current_dict.iteritems():
-                if k in self._columns:
-                    col = self._columns[k]
-                    if col.dtype[1] != self.get_dtype(v):
-                        new_dtype = [
-                            ('idx', col.dtype[0]),
-                            ('val', numpy.promote_types(col.dtype[1],
-                                                        self.get_dtype(v)))
-                            ]
-                        self._columns[k] = col.astype(new_dtype, copy=False)
-                        col = self._columns[k]
-                    idx = self._col_tops[k]
-                    self._col_tops[k] = idx + 1
-                    if idx >= col.shape[0]:
-                        col2 = numpy.empty((1.3 * idx), col.dtype)
-                        col2[:idx] = col
-                        col2[idx:]['idx'] = 2147483647
-                        col = col2
-                        self._columns[k] = col2
-                    col[idx] = (self._current_time, v)
-                else:
-                    self._columns[k] = numpy.empty(
-                        (10,),
-                        dtype=[('idx', numpy.int32),
-                               ('val', self.get_dtype(v))])
-                    self._columns[k]['idx'][:] = 2147483647
-                    self._columns[k][0] = (self._current_time, v)
-                    self._col_tops[k] = 1
+                self._write(k, self._current_time, v)
             self._current_time = time
             self._current_dict = {}
             return self._current_dict
         else:
             return _TimeSlice(time, self)
 
+    def _write(self, k, time, v):
+        """Writes a value to a column, keeping the times sorted."""
+        if k in self._columns:
+            col = self._columns[k]
+            if col.dtype[1] != self.get_dtype(v):
+                new_dtype = [
+                    ('idx', col.dtype[0]),
+                    ('val', numpy.promote_types(col.dtype[1],
+                                                self.get_dtype(v)))
+                    ]
+                self._columns[k] = col.astype(new_dtype, copy=False)
+                col = self._columns[k]
+            top = self._col_tops[k]
+            # Usually the time is the latest one and the value is appended
+            idx = col['idx'][:top].searchsorted(time)
+            if idx < top and col['idx'][idx] == time:
+                col['val'][idx] = v
+                return
+            self._col_tops[k] = top + 1
+            if top >= col.shape[0]:
+                col2 = numpy.empty((int(1.3 * top) + 1,), col.dtype)
+                col2[:top] = col
+                col2[top:]['idx'] = 2147483647
+                col = col2
+                self._columns[k] = col2
+            col[idx + 1:top + 1] = col[idx:top].copy()
+            col[idx] = (time, v)
+        else:
+            self._columns[k] = numpy.empty(
+                (10,),
+                dtype=[('idx', numpy.int32),
+                       ('val', self.get_dtype(v))])
+            self._columns[k]['idx'][:] = 2147483647
+            self._columns[k][0] = (time, v)
+            self._col_tops[k] = 1
+
     def __setitem__(self, time, value):
         self._check_time(time)
         if time == self._current_time:
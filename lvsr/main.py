@@ -7,6 +7,8 @@ import os
 import cPickle
 import cPickle as pickle
 import sys
+import heapq
+import multiprocessing
 
 import numpy
 import matplotlib
@@ -40,19 +42,22 @@ from blocks.main_loop import MainLoop
 from blocks.filter import VariableFilter, get_brick
 from blocks.roles import WEIGHT
 from blocks.utils import reraise_as, dict_subset
-from blocks.search import CandidateNotFoundError
+from picklable_itertools.extras import equizip
 from blocks.select import Selector
 
+from lvsr import function_cache
 from lvsr.bricks import RewardRegressionEmitter
 from lvsr.bricks.recognizer import SpeechRecognizer
 from lvsr.datasets import Data
 from lvsr.expressions import (
     monotonicity_penalty, entropy, weights_std)
 from lvsr.extensions import (
-    CGStatistics, AdaptiveClipping, LogInputsGains, Patience)
+    CGStatistics, AdaptiveClipping, LogInputsGains, Patience,
+    AsyncDataStreamMonitoring)
 from lvsr.error_rate import wer
 from lvsr.graph import apply_adaptive_noise
-from lvsr.preprocessing import Normalization
+from lvsr.preprocessing import (
+    Normalization, NO_STATISTICS, feature_statistics, merge_statistics)
 from lvsr.utils import rename
 from blocks.serialization import load_parameters
 from lvsr.log_backends import NDarrayLog
@@ -60,6 +65,10 @@ from lvsr.log_backends import NDarrayLog
 floatX = theano.config.floatX
 logger = logging.getLogger(__name__)
 
+# Sentinels sent by decoding workers
+_WORKER_DONE = 'done'
+_WORKER_FAILED = 'failed'
+
 
 def _gradient_norm_is_none(log):
     return math.isnan(log.current_row.get('total_gradient_norm', 0))
@@ -69,12 +78,14 @@ class PhonemeErrorRate(MonitoredQuantity):
 
     def __init__(self, recognizer, data, beam_size,
                  char_discount=None, round_to_inf=None, stop_on=None,
-                 **kwargs):
+                 batch_size=None, **kwargs):
         self.recognizer = recognizer
         self.beam_size = beam_size
         self.char_discount = char_discount
         self.round_to_inf = round_to_inf
         self.stop_on = stop_on
+        # The number of utterances decoded together by batched beam search
+        self.batch_size = batch_size
         # Will only be used to decode generated outputs,
         # which is necessary for correct scoring.
         self.data = data
@@ -84,44 +95,59 @@ class PhonemeErrorRate(MonitoredQuantity):
         super(PhonemeErrorRate, self).__init__(**kwargs)
 
         self.recognizer.init_beam_search(self.beam_size)
+        # Compiled here to be shared with forked monitoring processes
+        if (self.batch_size or 1) > 1:
+            self.recognizer.init_batch_beam_search()
 
     def initialize(self):
         self.total_errors = 0.
         self.total_length = 0.
         self.num_examples = 0
+        self.pending = []
 
     def accumulate(self, *args):
         input_vars = self.requires[:-1]
         beam_inputs = {var.name: val for var, val in zip(input_vars,
                                                          args[:-1])}
         transcription = args[-1]
+        self.pending.append((beam_inputs, transcription))
+        if len(self.pending) >= (self.batch_size or 1):
+            self.decode_pending()
+
+    def decode_pending(self):
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
         # Hack to avoid hopeless decoding of an untrained model
         if self.num_examples > 10 and self.mean_error > 0.8:
             self.mean_error = 1
             return
         data = self.data
-        groundtruth = data.decode(transcription)
-        try:
-            search_kwargs = dict(
-                char_discount=self.char_discount,
-                round_to_inf=self.round_to_inf,
-                stop_on=self.stop_on,
-                validate_solution_function=getattr(
-                    data.info_dataset, 'validate_solution', None))
-            # We rely on the defaults hard-coded in BeamSearch
-            search_kwargs = {k: v for k, v in search_kwargs.items() if v}
-            outputs, search_costs = self.recognizer.beam_search(
-                beam_inputs, **search_kwargs)
-            recognized = data.decode(outputs[0])
-            error = min(1, wer(groundtruth, recognized))
-        except CandidateNotFoundError:
-            error = 1.0
-        self.total_errors += error * len(groundtruth)
-        self.total_length += len(groundtruth)
-        self.num_examples += 1
-        self.mean_error = self.total_errors / self.total_length
+        search_kwargs = dict(
+            char_discount=self.char_discount,
+            round_to_inf=self.round_to_inf,
+            stop_on=self.stop_on,
+            validate_solution_function=getattr(
+                data.info_dataset, 'validate_solution', None))
+        # We rely on the defaults hard-coded in BeamSearch
+        search_kwargs = {k: v for k, v in search_kwargs.items() if v}
+        results = self.recognizer.beam_search_batch(
+            [beam_inputs for beam_inputs, _ in pending], **search_kwargs)
+        for (_, transcription), result in zip(pending, results):
+            groundtruth = data.decode(transcription)
+            if result is not None:
+                outputs, search_costs = result
+                recognized = data.decode(outputs[0])
+                error = min(1, wer(groundtruth, recognized))
+            else:
+                error = 1.0
+            self.total_errors += error * len(groundtruth)
+            self.total_length += len(groundtruth)
+            self.num_examples += 1
+            self.mean_error = self.total_errors / self.total_length
 
     def readout(self):
+        self.decode_pending()
         return self.mean_error
 
 
@@ -200,6 +226,8 @@ def create_model(config, data,
         if true, will add tag the input variables with test values
 
     """
+    if config.get('function_cache'):
+        function_cache.configure(config['function_cache'], config['net'])
     # First tell the recognizer about required data sources
     net_config = dict(config["net"])
     bottom_class = net_config['bottom']['bottom_class']
@@ -339,8 +367,10 @@ def initialize_all(config, save_path, bokeh_name,
 
     batch_cost = cg.outputs[0].sum()
     batch_size = rename(recognizer.labels.shape[1], "batch_size")
-    # Assumes constant batch size. `aggregation.mean` is not used because
-    # of Blocks #514.
+    # The batch size can vary, e.g. with `data.frame_budget`. Each update
+    # uses the mean cost of its batch, the averages over many batches are
+    # weighted by the batch sizes in `attach_aggregation_schemes`.
+    # `aggregation.mean` is not used here because of Blocks #514.
     cost = batch_cost / batch_size
     cost.name = "sequence_total_cost"
     logger.info("Cost graph is built")
@@ -516,7 +546,8 @@ def initialize_all(config, save_path, bokeh_name,
             # Parameters are not changed at all
             # when nans are encountered.
             [RemoveNotFinite(0.0)] + burn_in),
-        on_unused_sources='warn')
+        on_unused_sources='warn',
+        compile_function=function_cache.function)
 
     logger.debug("Scan Ops in the gradients")
     gradient_cg = ComputationGraph(algorithm.gradients.values())
@@ -561,6 +592,10 @@ def initialize_all(config, save_path, bokeh_name,
             if var.name == 'weights_penalty':
                 result.append(rename(aggregation.mean(var, batch_size),
                                      'weights_penalty_per_recording'))
+            elif var.name == cost.name:
+                result.append(rename(aggregation.mean(var * batch_size,
+                                                      batch_size),
+                                     var.name))
             elif var.name == 'weights_entropy':
                 result.append(rename(aggregation.mean(var, labels_mask.sum()),
                                      'weights_entropy_per_label'))
@@ -588,9 +623,20 @@ def initialize_all(config, save_path, bokeh_name,
         attach_aggregation_schemes(secondary_observables),
         prefix="average", every_n_batches=10)
     extensions.append(average_monitoring)
+    # The share of real frames among the padded ones over the whole epoch
+    padding_efficiency = rename(
+        aggregation.mean(recognizer.inputs_mask.sum(),
+                         recognizer.inputs_mask.size),
+        'padding_efficiency')
+    extensions.append(TrainingDataMonitoring(
+        [padding_efficiency], after_epoch=True))
+    if data.cache_validation:
+        validation_stream = data.get_cached_stream("valid")
+    else:
+        validation_stream = data.get_stream("valid", shuffle=False)
     validation = DataStreamMonitoring(
         attach_aggregation_schemes(validation_observables),
-        data.get_stream("valid", shuffle=False), prefix="valid").set_conditions(
+        validation_stream, prefix="valid").set_conditions(
             before_first_epoch=not fast_start,
             every_n_epochs=mon_conf['validate_every_epochs'],
             every_n_batches=mon_conf['validate_every_batches'],
@@ -598,7 +644,13 @@ def initialize_all(config, save_path, bokeh_name,
     extensions.append(validation)
     per = PhonemeErrorRate(recognizer, data,
                            **config['monitoring']['search'])
-    per_monitoring = DataStreamMonitoring(
+    # Beam search takes long, it can be run in a forked process while
+    # the training continues
+    search_asynchronously = mon_conf.get('search_asynchronously')
+    per_monitoring_class = (AsyncDataStreamMonitoring
+                            if search_asynchronously
+                            else DataStreamMonitoring)
+    per_monitoring = per_monitoring_class(
         [per], data.get_stream("valid", batches=False, shuffle=False),
         prefix="valid").set_conditions(
             before_first_epoch=not fast_start,
@@ -606,8 +658,13 @@ def initialize_all(config, save_path, bokeh_name,
             every_n_batches=mon_conf['search_every_batches'],
             after_training=False)
     extensions.append(per_monitoring)
-    track_the_best_per = TrackTheBest(
-        per_monitoring.record_name(per)).set_conditions(
+    track_the_best_per = TrackTheBest(per_monitoring.record_name(per))
+    if search_asynchronously:
+        # The best PER is tracked when the delayed records arrive
+        track_the_best_per.set_conditions()
+        per_monitoring.add_delayed_extension(track_the_best_per)
+    else:
+        track_the_best_per.set_conditions(
             before_first_epoch=True, after_epoch=True)
     track_the_best_cost = TrackTheBest(
         validation.record_name(cost)).set_conditions(
@@ -647,21 +704,31 @@ def initialize_all(config, save_path, bokeh_name,
                  channels,
                  every_n_batches=10,
                  server_url=bokeh_server),]
-    extensions += [
+    checkpoint = (
         Checkpoint(save_path,
                    before_first_epoch=not fast_start, after_epoch=True,
                    every_n_batches=train_conf.get('save_every_n_batches'),
                    save_separately=["model", "log"],
                    use_cpickle=True)
         .add_condition(
+            ['after_epoch'],
+            OnLogRecord(track_the_best_cost.notification_name),
+            (root_path + "_best_ll" + extension,)))
+    if search_asynchronously:
+        # The best PER is recorded in past log rows, for which the status
+        # is rewound only partially, so only the evaluated parameters
+        # are saved
+        per_monitoring.add_delayed_extension(
+            Checkpoint(root_path + "_best" + extension,
+                       save_main_loop=False,
+                       use_cpickle=True).set_conditions(),
+            OnLogRecord(track_the_best_per.notification_name))
+    else:
+        checkpoint.add_condition(
             ['after_epoch'],
             OnLogRecord(track_the_best_per.notification_name),
             (root_path + "_best" + extension,))
-        .add_condition(
-            ['after_epoch'],
-            OnLogRecord(track_the_best_cost.notification_name),
-            (root_path + "_best_ll" + extension,)),
-        ProgressBar()]
+    extensions += [checkpoint, ProgressBar()]
     extensions.append(EmbedIPython(use_main_loop_run_caller_env=True))
     if config['net']['criterion']['name'].startswith('mse'):
         extensions.append(
@@ -675,7 +742,12 @@ def initialize_all(config, save_path, bokeh_name,
             patience_conf['notification_names'] = [
                 track_the_best_per.notification_name,
                 track_the_best_cost.notification_name]
-        extensions.append(Patience(**patience_conf))
+        patience = Patience(**patience_conf)
+        if search_asynchronously:
+            # The PER improvements are written to past log rows
+            per_monitoring.add_delayed_extension(
+                patience, arguments=('update_best',))
+        extensions.append(patience)
 
     extensions.append(Printing(every_n_batches=1,
                                attribute_filter=PrintingFilterList()))
@@ -703,7 +775,7 @@ def train(config, save_path, bokeh_name,
 
 
 def search(config, params, load_path, part, decode_only, report,
-           decoded_save, nll_only, seed):
+           decoded_save, nll_only, seed, workers):
     import matplotlib
     matplotlib.use("Agg")
     from matplotlib import pyplot
@@ -711,21 +783,21 @@ def search(config, params, load_path, part, decode_only, report,
 
     data = Data(**config['data'])
     search_conf = config['monitoring']['search']
+    # The number of utterances decoded together by batched beam search
+    batch_size = search_conf.get('batch_size') or 1
 
     logger.info("Recognizer initialization started")
     recognizer = create_model(config, data, load_path)
+    # Everything is compiled before the workers are forked,
+    # such that they share the compiled functions and the parameters.
     recognizer.init_beam_search(search_conf['beam_size'])
+    if batch_size > 1:
+        recognizer.init_batch_beam_search()
+    recognizer.init_analyze(with_prediction=True)
     logger.info("Recognizer is initialized")
 
     has_uttids = 'uttids' in data.info_dataset.provides_sources
     add_sources = ('uttids',) if has_uttids else ()
-    dataset = data.get_dataset(part, add_sources)
-    stream = data.get_stream(part, batches=False,
-                             shuffle=part == 'train',
-                             add_sources=add_sources,
-                             num_examples=500 if part == 'train' else None,
-                             seed=seed)
-    it = stream.get_epoch_iterator(as_dict=True)
     if decode_only is not None:
         decode_only = eval(decode_only)
 
@@ -736,6 +808,7 @@ def search(config, params, load_path, part, decode_only, report,
             monotonicity_penalty(weights.dimshuffle(0, 'x', 1))])
 
     print_to = sys.stdout
+    alignments_path = None
     if report:
         alignments_path = os.path.join(report, "alignments")
         if not os.path.exists(report):
@@ -764,63 +837,171 @@ def search(config, params, load_path, part, decode_only, report,
                      else vocabulary['<UNK>'] for word in words]
             return words
 
-    for number, example in enumerate(it):
-        if decode_only and number not in decode_only:
-            continue
-        uttids = example.pop('uttids', None)
-        raw_groundtruth = example.pop('labels')
-        required_inputs = dict_subset(example, recognizer.inputs.keys())
-
-        print("Utterance {} ({})".format(number, uttids), file=print_to)
-
-        groundtruth = dataset.decode(raw_groundtruth)
-        groundtruth_text = dataset.pretty_print(raw_groundtruth, example)
-        costs_groundtruth, weights_groundtruth = recognizer.analyze(
-            inputs=required_inputs,
-            groundtruth=raw_groundtruth,
-            prediction=raw_groundtruth)[:2]
-        weight_std_groundtruth, mono_penalty_groundtruth = weight_statistics(
-            weights_groundtruth)
-        total_nll += costs_groundtruth.sum()
+    search_kwargs = dict(
+        char_discount=search_conf.get('char_discount'),
+        round_to_inf=search_conf.get('round_to_inf'),
+        stop_on=search_conf.get('stop_on'),
+        validate_solution_function=getattr(
+            data.info_dataset, 'validate_solution', None))
+    search_kwargs = {k: v for k, v in search_kwargs.items() if v}
+
+    lm_fst = None
+    if recognizer.generator.language_model:
+        lm_fst = recognizer.generator.language_model.transition.fst
+
+    def read_shard(shard_data, worker, num_workers):
+        """Read the utterances with numbers equal to `worker` modulo
+        `num_workers`."""
+        # The utterances are numbered after the length filter and the
+        # shuffling, only the indices are computed to do that. Every
+        # worker then reads just its own utterances.
+        indices = shard_data.get_example_indices(
+            part, shuffle=part == 'train', add_sources=add_sources,
+            num_examples=500 if part == 'train' else None,
+            rng=numpy.random.RandomState(seed))
+        numbers = [number for number
+                   in range(worker, len(indices), num_workers)
+                   if not decode_only or number in decode_only]
+        stream = shard_data.get_stream(
+            part, batches=False, shuffle=False, add_sources=add_sources,
+            num_examples=[indices[number] for number in numbers])
+        return equizip(numbers, stream.get_epoch_iterator(as_dict=True))
+
+    def read_chunks(shard):
+        chunk = []
+        for number, example in shard:
+            chunk.append((number, example))
+            if len(chunk) == batch_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def decode_shard(shard_data, worker, num_workers):
+        """Decode a shard of the utterances.
+
+        Yields a dictionary of results for every utterance.
+
+        """
+        dataset = shard_data.get_dataset(part, add_sources)
+        shard = read_shard(shard_data, worker, num_workers)
+        for chunk in read_chunks(shard):
+            all_uttids = [example.pop('uttids', None)
+                          for _, example in chunk]
+            all_raw_groundtruth = [example.pop('labels')
+                                   for _, example in chunk]
+            all_required_inputs = [
+                dict_subset(example, recognizer.inputs.keys())
+                for _, example in chunk]
+            if not nll_only:
+                if lm_fst:
+                    lm_cache_before = dict(lm_fst.cache_statistics)
+                before = time.time()
+                results = recognizer.beam_search_batch(
+                    all_required_inputs, **search_kwargs)
+                took = (time.time() - before) / len(chunk)
+                context_bytes_copied = (
+                    recognizer.search_statistics['context_bytes_copied'] /
+                    len(chunk))
+                if lm_fst:
+                    lm_cache = {
+                        key: (lm_fst.cache_statistics[key] -
+                              lm_cache_before[key]) / float(len(chunk))
+                        for key in lm_cache_before}
+
+            for position, (number, example) in enumerate(chunk):
+                raw_groundtruth = all_raw_groundtruth[position]
+                required_inputs = all_required_inputs[position]
+                result = dict(number=number, uttids=all_uttids[position])
+
+                groundtruth = dataset.decode(raw_groundtruth)
+                result['groundtruth'] = groundtruth
+                result['groundtruth_text'] = dataset.pretty_print(
+                    raw_groundtruth, example)
+                costs_groundtruth, weights_groundtruth = recognizer.analyze(
+                    inputs=required_inputs,
+                    groundtruth=raw_groundtruth,
+                    prediction=raw_groundtruth)[:2]
+                result['groundtruth_cost'] = costs_groundtruth.sum()
+                (result['groundtruth_weight_std'],
+                 result['groundtruth_mono_penalty']) = weight_statistics(
+                    weights_groundtruth)
+                if nll_only:
+                    yield result
+                    continue
+
+                if results[position] is not None:
+                    outputs, search_costs = results[position]
+                else:
+                    logger.error('Candidate not found!')
+                    outputs = [[]]
+                    search_costs = [[numpy.NaN]]
+
+                recognized = dataset.decode(outputs[0])
+                result['recognized'] = recognized
+                result['recognized_text'] = dataset.pretty_print(
+                    outputs[0], example)
+                result['took'] = took
+                result['context_bytes_copied'] = context_bytes_copied
+                if lm_fst:
+                    result['lm_cache_hits'] = lm_cache['hits']
+                    result['lm_cache_misses'] = lm_cache['misses']
+                result['search_cost'] = search_costs[0]
+                if recognized:
+                    # Theano scan doesn't work with 0 length sequences
+                    costs_recognized, weights_recognized = recognizer.analyze(
+                        inputs=required_inputs,
+                        groundtruth=raw_groundtruth,
+                        prediction=outputs[0])[:2]
+                    result['recognized_cost'] = costs_recognized.sum()
+                    (result['recognized_weight_std'],
+                     result['recognized_mono_penalty']) = weight_statistics(
+                        weights_recognized)
+
+                if report and recognized:
+                    show_alignment(weights_groundtruth, groundtruth,
+                                   bos_symbol=True)
+                    pyplot.savefig(os.path.join(
+                        alignments_path,
+                        "{}.groundtruth.png".format(number)))
+                    show_alignment(weights_recognized, recognized,
+                                   bos_symbol=True)
+                    pyplot.savefig(os.path.join(
+                        alignments_path,
+                        "{}.recognized.png".format(number)))
+                yield result
+
+    if workers > 1:
+        results = _decode_in_workers(
+            lambda worker: decode_shard(Data(**config['data']),
+                                        worker, workers),
+            workers)
+    else:
+        results = decode_shard(data, 0, 1)
+
+    for result in results:
+        print("Utterance {} ({})".format(result['number'], result['uttids']),
+              file=print_to)
+
+        groundtruth = result['groundtruth']
+        groundtruth_text = result['groundtruth_text']
+        total_nll += result['groundtruth_cost']
         num_examples += 1
         print("Groundtruth:", groundtruth_text, file=print_to)
-        print("Groundtruth cost:", costs_groundtruth.sum(), file=print_to)
-        print("Groundtruth weight std:", weight_std_groundtruth, file=print_to)
-        print("Groundtruth monotonicity penalty:", mono_penalty_groundtruth,
+        print("Groundtruth cost:", result['groundtruth_cost'], file=print_to)
+        print("Groundtruth weight std:", result['groundtruth_weight_std'],
               file=print_to)
+        print("Groundtruth monotonicity penalty:",
+              result['groundtruth_mono_penalty'], file=print_to)
         print("Average groundtruth cost: {}".format(total_nll / num_examples),
               file=print_to)
         if nll_only:
             print_to.flush()
             continue
 
-        before = time.time()
-        try:
-            search_kwargs = dict(
-                char_discount=search_conf.get('char_discount'),
-                round_to_inf=search_conf.get('round_to_inf'),
-                stop_on=search_conf.get('stop_on'),
-                validate_solution_function=getattr(
-                    data.info_dataset, 'validate_solution', None))
-            search_kwargs = {k: v for k, v in search_kwargs.items() if v}
-            outputs, search_costs = recognizer.beam_search(
-                required_inputs, **search_kwargs)
-        except CandidateNotFoundError:
-            logger.error('Candidate not found!')
-            outputs = [[]]
-            search_costs = [[numpy.NaN]]
-
-        took = time.time() - before
-        recognized = dataset.decode(outputs[0])
-        recognized_text = dataset.pretty_print(outputs[0], example)
+        recognized = result['recognized']
+        recognized_text = result['recognized_text']
         if recognized:
-            # Theano scan doesn't work with 0 length sequences
-            costs_recognized, weights_recognized = recognizer.analyze(
-                inputs=required_inputs,
-                groundtruth=raw_groundtruth,
-                prediction=outputs[0])[:2]
-            weight_std_recognized, mono_penalty_recognized = weight_statistics(
-                weights_recognized)
             error = min(1, wer(groundtruth, recognized))
         else:
             error = 1
@@ -833,27 +1014,25 @@ def search(config, params, load_path, part, decode_only, report,
             total_wer_errors += len(groundtruth) * wer_error
             total_word_length += len(groundtruth)
 
-        if report and recognized:
-            show_alignment(weights_groundtruth, groundtruth, bos_symbol=True)
-            pyplot.savefig(os.path.join(
-                alignments_path, "{}.groundtruth.png".format(number)))
-            show_alignment(weights_recognized, recognized, bos_symbol=True)
-            pyplot.savefig(os.path.join(
-                alignments_path, "{}.recognized.png".format(number)))
-
         if decoded_file is not None:
-            print("{} {}".format(uttids, ' '.join(recognized)),
+            print("{} {}".format(result['uttids'], ' '.join(recognized)),
                   file=decoded_file)
 
-        print("Decoding took:", took, file=print_to)
-        print("Beam search cost:", search_costs[0], file=print_to)
+        print("Decoding took:", result['took'], file=print_to)
+        print("Context bytes copied:", result['context_bytes_copied'],
+              file=print_to)
+        if 'lm_cache_hits' in result:
+            print("LM cache hits:", result['lm_cache_hits'],
+                  "misses:", result['lm_cache_misses'], file=print_to)
+        print("Beam search cost:", result['search_cost'], file=print_to)
         print("Recognized:", recognized_text, file=print_to)
         if recognized:
-            print("Recognized cost:", costs_recognized.sum(), file=print_to)
-            print("Recognized weight std:", weight_std_recognized,
+            print("Recognized cost:", result['recognized_cost'],
                   file=print_to)
-            print("Recognized monotonicity penalty:", mono_penalty_recognized,
+            print("Recognized weight std:", result['recognized_weight_std'],
                   file=print_to)
+            print("Recognized monotonicity penalty:",
+                  result['recognized_mono_penalty'], file=print_to)
         print("CER:", error, file=print_to)
         print("Average CER:", total_errors / total_length, file=print_to)
         if config.get('vocabulary'):
@@ -864,6 +1043,135 @@ def search(config, params, load_path, part, decode_only, report,
         #assert_allclose(search_costs[0], costs_recognized.sum(), rtol=1e-5)
 
 
+def _decode_in_workers(decode_shard, workers):
+    """Run decoding of the shards in forked worker processes.
+
+    Parameters
+    ----------
+    decode_shard : callable
+        Takes the number of a worker and returns an iterator over
+        the results for its shard. Every result is a dictionary with
+        the number of the utterance under the key 'number', the
+        numbers have to increase.
+    workers : int
+        The number of worker processes.
+
+    Returns
+    -------
+    An iterator over the results of all workers, merged in the order
+    of the utterance numbers.
+
+    """
+    queues = [multiprocessing.Queue(maxsize=100) for _ in range(workers)]
+
+    def work(worker):
+        try:
+            for result in decode_shard(worker):
+                queues[worker].put((result['number'], result))
+        except Exception:
+            logger.exception("Decoding worker {} failed".format(worker))
+            queues[worker].put(_WORKER_FAILED)
+            return
+        queues[worker].put(_WORKER_DONE)
+
+    def read_queue(queue):
+        while True:
+            item = queue.get()
+            if item == _WORKER_DONE:
+                return
+            if item == _WORKER_FAILED:
+                raise Exception("A decoding worker failed")
+            yield item
+
+    processes = [multiprocessing.Process(target=work, args=(worker,))
+                 for worker in range(workers)]
+    for process in processes:
+        process.daemon = True
+        process.start()
+    try:
+        for _, result in heapq.merge(*[read_queue(queue) for queue in queues]):
+            yield result
+    finally:
+        for process in processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+
+
+def init_norm(config, save_path, workers, subsample, seed):
+    """Computes the normalization of the recordings of the training set.
+
+    Shards of the utterances are processed in forked worker processes
+    and their statistics are merged in a numerically stable way.
+
+    Parameters
+    ----------
+    save_path : str
+        Where to save the pickled :class:`Normalization`, that can be
+        used as `data.normalization`.
+    workers : int
+        The number of worker processes.
+    subsample : float
+        The share of randomly chosen utterances to use.
+    seed : int
+        The random seed for subsampling.
+
+    """
+    # The normalization to compute must not be applied
+    data_config = dict(config['data'], normalization=None)
+    data = Data(**data_config)
+    num_examples = data.get_dataset('train').num_examples
+    numbers = numpy.arange(num_examples)
+    if subsample < 1:
+        rng = numpy.random.RandomState(seed)
+        numbers = numpy.sort(rng.choice(
+            num_examples, int(math.ceil(subsample * num_examples)),
+            replace=False))
+    # The normalization is applied before the sources are rearranged
+    index = data.default_sources.index('recordings')
+
+    def shard_statistics(shard_data, worker, num_workers):
+        dataset = shard_data.get_dataset('train')
+        statistics = NO_STATISTICS
+        for number in numbers[worker::num_workers]:
+            features = dataset.get_data(request=int(number))[index]
+            statistics = merge_statistics(
+                statistics, feature_statistics(features))
+        return statistics
+
+    if workers > 1:
+        queue = multiprocessing.Queue()
+
+        def work(worker):
+            try:
+                queue.put(shard_statistics(Data(**data_config),
+                                           worker, workers))
+            except Exception:
+                logger.exception(
+                    "Normalization worker {} failed".format(worker))
+                queue.put(_WORKER_FAILED)
+
+        processes = [multiprocessing.Process(target=work, args=(worker,))
+                     for worker in range(workers)]
+        for process in processes:
+            process.daemon = True
+            process.start()
+        all_statistics = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+        if _WORKER_FAILED in all_statistics:
+            raise Exception("A normalization worker failed")
+    else:
+        all_statistics = [shard_statistics(data, 0, 1)]
+
+    statistics = reduce(merge_statistics, all_statistics)
+    logger.info("Used {} utterances with {} frames to compute "
+                "normalization".format(len(numbers), statistics[0]))
+    normalization = Normalization.from_statistics(statistics, index)
+    with open(save_path, 'wb') as dst:
+        cPickle.dump(normalization, dst, cPickle.HIGHEST_PROTOCOL)
+
+
 def sample(config, params, load_path, part):
     data = Data(**config['data'])
     recognizer = create_model(config, data, load_path)
@@ -893,6 +1201,30 @@ def show_data(config):
     import IPython; IPython.embed()
 
 
+def benchmark_data(config, part, num_examples, block_sizes, shuffle_window,
+                   seed):
+    """Compares the speed of reading shuffled examples with and without
+    block shuffling."""
+    data = Data(**config['data'])
+    data.shuffle_window = shuffle_window
+    speeds = []
+    for block_size in [None] + block_sizes:
+        data.block_size = block_size
+        stream = data.get_stream(part, batches=False, shuffle=True,
+                                 rng=numpy.random.RandomState(seed))
+        read = 0
+        start_time = time.time()
+        for _ in stream.get_epoch_iterator():
+            read += 1
+            if read == num_examples:
+                break
+        speeds.append(read / (time.time() - start_time))
+        stream.close()
+        print("block size {}: {:.1f} examples/sec, {:.2f}x".format(
+            block_size or 1, speeds[-1], speeds[-1] / speeds[0]))
+    return speeds
+
+
 def train_multistage(config, save_path, bokeh_name, params, start_stage, **kwargs):
     """Run multiple stages of the training procedure."""
     if config.multi_stage:
@@ -1,5 +1,10 @@
 from __future__ import print_function
+import hashlib
+import heapq
+import itertools
 import math
+import multiprocessing
+import os
 try:
     import fst
 except ImportError:
@@ -7,16 +12,17 @@ except ImportError:
           "language model, please install openfst and PyFST")
 import numpy
 import theano
-import itertools
 from theano import tensor, Op
 from theano.gradient import disconnected_type
 from fuel.utils import do_not_pickle_attributes
 from picklable_itertools.extras import equizip
-from collections import defaultdict, deque
+from collections import OrderedDict, defaultdict, deque
+from multiprocessing.pool import ThreadPool
 
 from toposort import toposort_flatten
 
-from lvsr.error_rate import reward_matrix, gain_matrix
+from lvsr.error_rate import (
+    _edit_distance_matrices, _reward_matrix, _gain_matrix)
 
 
 EPSILON = 0
@@ -33,16 +39,207 @@ def read_symbols(fname):
     return syms
 
 
-@do_not_pickle_attributes('fst')
+def fst_to_arrays(fst_):
+    """Converts a PyFST FST into arrays.
+
+    The arcs are stored in the compressed sparse row format: the arcs of
+    the state `i` are those from `offsets[i]` to `offsets[i + 1]` in
+    the `ilabels`, `next_states` and `weights` arrays, sorted by input
+    label.
+
+    Returns
+    -------
+    A dictionary with the `offsets`, `ilabels`, `next_states`, `weights`
+    and `finals` (final weights of the states) arrays, and the `start`
+    state.
+
+    """
+    offsets = [0]
+    ilabels = []
+    next_states = []
+    weights = []
+    finals = []
+    for state in fst_.states:
+        if state.stateid != len(finals):
+            raise ValueError("states are not numbered consecutively")
+        # The sort is stable, the order of the arcs with the same
+        # label is preserved
+        for ilabel, next_state, weight in sorted(
+                [(arc.ilabel, arc.nextstate, float(arc.weight))
+                 for arc in state.arcs], key=lambda arc: arc[0]):
+            ilabels.append(ilabel)
+            next_states.append(next_state)
+            weights.append(weight)
+        offsets.append(len(ilabels))
+        finals.append(float(state.final))
+    return dict(offsets=numpy.array(offsets, dtype='int64'),
+                ilabels=numpy.array(ilabels, dtype='int64'),
+                next_states=numpy.array(next_states, dtype='int64'),
+                weights=numpy.array(weights, dtype='float64'),
+                finals=numpy.array(finals, dtype='float64'),
+                start=numpy.array(fst_.start, dtype='int64'))
+
+
+def compile_fst(fst_path, save_path):
+    """Converts an FST into a directory of arrays.
+
+    The arrays returned by :func:`fst_to_arrays` are saved in the NumPy
+    format, the input symbols are saved to `isyms.txt`. The result can
+    be used as the `path` of :class:`FST`, in which case PyFST is not
+    required.
+
+    """
+    fst_ = fst.read(fst_path)
+    if not os.path.exists(save_path):
+        os.mkdir(save_path)
+    for name, array in fst_to_arrays(fst_).items():
+        numpy.save(os.path.join(save_path, name + '.npy'), array)
+    with open(os.path.join(save_path, 'isyms.txt'), 'w') as isyms:
+        for symbol, code in sorted(fst_.isyms.items(),
+                                   key=lambda item: item[1]):
+            isyms.write('{} {}\n'.format(symbol, code))
+
+
+def load_compiled_fst(path):
+    """Memory maps the arrays of an FST saved by :func:`compile_fst`.
+
+    Returns
+    -------
+    A tuple of a dictionary of the arrays and a dictionary of the input
+    symbols.
+
+    """
+    arrays = {name: numpy.load(os.path.join(path, name + '.npy'),
+                               mmap_mode='r')
+              for name in ['offsets', 'ilabels', 'next_states', 'weights',
+                           'finals', 'start']}
+    isyms = {}
+    with open(os.path.join(path, 'isyms.txt')) as isyms_file:
+        for line in isyms_file:
+            symbol, code = line.split()
+            isyms[symbol] = int(code)
+    return arrays, isyms
+
+
+@do_not_pickle_attributes('fst', 'isyms', 'arrays', 'outgoing', 'arcs',
+                          'epsilon_arcs', 'cache')
 class FST(object):
 
-    """Picklable wrapper around FST."""
-    def __init__(self, path):
+    """Picklable wrapper around FST.
+
+    The FST is stored in the arrays returned by :func:`fst_to_arrays`.
+    If `path` is a directory saved by :func:`compile_fst` these are
+    memory mapped, such that the processes decoding with the same FST
+    share a single copy of it. Otherwise the FST is read with PyFST.
+
+    FSTs read with PyFST are also indexed at loading time: `outgoing`
+    maps a state to the arrays of the input labels, the next states and
+    the weights of all its arcs, `arcs` maps a (state, input label) pair
+    to the next states and the weights of the matching arcs,
+    `epsilon_arcs` maps a state to the list of (next state, weight)
+    pairs of its epsilon arcs. For memory mapped FSTs the arcs are
+    found with a binary search in the arrays instead.
+
+    Parameters
+    ----------
+    path : str
+        The path to the FST file or to a directory of FST arrays.
+    cache_size : int, optional
+        The number of results of :meth:`consume` and :meth:`costs` kept
+        in a least recently used cache. Zero disables the cache.
+
+    Attributes
+    ----------
+    cache_statistics : dict
+        The numbers of cache hits and misses.
+
+    """
+    def __init__(self, path, cache_size=10000):
         self.path = path
+        self.cache_size = cache_size
+        self.cache_statistics = {'hits': 0, 'misses': 0}
 
     def load(self):
-        self.fst = fst.read(self.path)
-        self.isyms = dict(self.fst.isyms.items())
+        if os.path.isdir(self.path):
+            self.fst = None
+            self.arrays, self.isyms = load_compiled_fst(self.path)
+            self.outgoing = self.arcs = self.epsilon_arcs = None
+        else:
+            self.fst = fst.read(self.path)
+            self.isyms = dict(self.fst.isyms.items())
+            self.arrays = fst_to_arrays(self.fst)
+            self.index_arcs()
+        self.cache = OrderedDict()
+
+    def index_arcs(self):
+        self.outgoing = {}
+        self.arcs = {}
+        self.epsilon_arcs = {}
+        offsets = self.arrays['offsets'].tolist()
+        for state in range(len(offsets) - 1):
+            begin, end = offsets[state], offsets[state + 1]
+            if begin == end:
+                continue
+            ilabels, next_states, weights = [
+                self.arrays[name][begin:end]
+                for name in ['ilabels', 'next_states', 'weights']]
+            self.outgoing[state] = (ilabels, next_states, weights)
+            bounds = (numpy.flatnonzero(ilabels[1:] != ilabels[:-1]) +
+                      1).tolist()
+            for start, end in equizip([0] + bounds, bounds + [len(ilabels)]):
+                self.arcs[state, int(ilabels[start])] = (
+                    next_states[start:end], weights[start:end])
+            if (state, EPSILON) in self.arcs:
+                self.epsilon_arcs[state] = list(equizip(
+                    *[array.tolist() for array
+                      in self.arcs[state, EPSILON]]))
+
+    @property
+    def start(self):
+        return int(self.arrays['start'])
+
+    def final_weight(self, state):
+        return float(self.arrays['finals'][state])
+
+    def state_arcs(self, state):
+        """Returns the input labels, next states and weights of all arcs.
+
+        Returns ``None`` if the state has no arcs.
+
+        """
+        if self.outgoing is not None:
+            return self.outgoing.get(state)
+        begin, end = self.arrays['offsets'][state:state + 2]
+        if begin == end:
+            return None
+        return tuple(self.arrays[name][begin:end]
+                     for name in ['ilabels', 'next_states', 'weights'])
+
+    def label_arcs(self, state, character):
+        """Returns the next states and weights of the matching arcs.
+
+        Returns ``None`` if the state has no arcs with this input label.
+
+        """
+        if self.arcs is not None:
+            return self.arcs.get((state, character))
+        state_arcs = self.state_arcs(state)
+        if state_arcs is None:
+            return None
+        ilabels, next_states, weights = state_arcs
+        begin, end = numpy.searchsorted(ilabels, [character, character + 1])
+        if begin == end:
+            return None
+        return next_states[begin:end], weights[begin:end]
+
+    def state_epsilon_arcs(self, state):
+        """Returns the (next state, weight) pairs of the epsilon arcs."""
+        if self.epsilon_arcs is not None:
+            return self.epsilon_arcs.get(state, ())
+        label_arcs = self.label_arcs(state, EPSILON)
+        if label_arcs is None:
+            return ()
+        return list(equizip(*[array.tolist() for array in label_arcs]))
 
     def __getitem__(self, state):
         """Returns all arcs of the state i"""
@@ -54,18 +251,82 @@ class FST(object):
         return m - math.log(sum(math.exp(m - x) for x in args if x is not None))
 
     def get_arcs(self, state, character):
-        return [(state, arc.nextstate, arc.ilabel, float(arc.weight))
-                for arc in self[state] if arc.ilabel == character]
+        label_arcs = self.label_arcs(state, character)
+        if label_arcs is None:
+            return []
+        next_states, weights = label_arcs
+        return [(state, next_state, character, weight)
+                for next_state, weight
+                in equizip(next_states.tolist(), weights.tolist())]
 
     def transition(self, states, character):
-        arcs = list(itertools.chain(
-            *[self.get_arcs(state, character) for state in states]))
-        next_states = {}
-        for next_state in {arc[1] for arc in arcs}:
-            next_states[next_state] = self.combine_weights(
-                *[states[arc[0]] + arc[3] for arc in arcs
-                  if arc[1] == next_state])
-        return next_states
+        incoming = defaultdict(list)
+        for state, weight in states.items():
+            label_arcs = self.label_arcs(state, character)
+            if label_arcs is None:
+                continue
+            next_states, weights = label_arcs
+            for next_state, arc_weight in equizip(next_states.tolist(),
+                                                  weights.tolist()):
+                incoming[next_state].append(weight + arc_weight)
+        return {next_state: self.combine_weights(*path_weights)
+                for next_state, path_weights in incoming.items()}
+
+    def transitions(self, states, characters):
+        """Performs transitions for several characters at once.
+
+        The outgoing arcs of the states are visited only once.
+
+        Parameters
+        ----------
+        states : dict
+            A {state: weight} dictionary.
+        characters : collection of ints
+            The input symbols of interest.
+
+        Returns
+        -------
+        A {character: {next state: weight}} dictionary, that contains only
+        the characters for which at least one arc exists.
+
+        """
+        arrays = [(state_arcs, weight) for state_arcs, weight
+                  in ((self.state_arcs(state), weight)
+                      for state, weight in states.items())
+                  if state_arcs is not None]
+        if not arrays:
+            return {}
+        ilabels, next_states, weights = [
+            numpy.concatenate(column) for column in equizip(*[
+                (ilabels, next_states, weights + weight)
+                for (ilabels, next_states, weights), weight in arrays])]
+        selected = numpy.in1d(ilabels, list(characters))
+        ilabels = ilabels[selected]
+        next_states = next_states[selected]
+        weights = weights[selected]
+        if not len(ilabels):
+            return {}
+
+        # Weights of the arcs leading to the same next state with the
+        # same label are combined
+        order = numpy.lexsort((next_states, ilabels))
+        ilabels = ilabels[order]
+        next_states = next_states[order]
+        weights = weights[order]
+        starts = numpy.flatnonzero(numpy.concatenate([
+            [True], (ilabels[1:] != ilabels[:-1]) |
+                    (next_states[1:] != next_states[:-1])]))
+        minimums = numpy.minimum.reduceat(weights, starts)
+        sizes = numpy.diff(numpy.append(starts, len(weights)))
+        combined = minimums - numpy.log(numpy.add.reduceat(
+            numpy.exp(numpy.repeat(minimums, sizes) - weights), starts))
+
+        result = defaultdict(dict)
+        for character, next_state, weight in equizip(
+                ilabels[starts].tolist(), next_states[starts].tolist(),
+                combined.tolist()):
+            result[character][next_state] = weight
+        return result
 
     def expand(self, states):
         seen = set()
@@ -76,12 +337,12 @@ class FST(object):
             seen.add(state)
         while len(queue):
             state = queue.popleft()
-            for arc in self.get_arcs(state, EPSILON):
-                depends[arc[1]].append((arc[0], arc[3]))
-                if arc[1] in seen:
+            for next_state, weight in self.state_epsilon_arcs(state):
+                depends[next_state].append((state, weight))
+                if next_state in seen:
                     continue
-                queue.append(arc[1])
-                seen.add(arc[1])
+                queue.append(next_state)
+                seen.add(next_state)
 
         depends_for_toposort = {key: {state for state, weight in value}
                                 for key, value in depends.items()}
@@ -96,9 +357,91 @@ class FST(object):
 
         return next_states
 
+    @staticmethod
+    def _signature(states):
+        """Normalize a state set.
+
+        Transitions and epsilon closures commute with adding a constant
+        to all weights, which is why the state sets are compared after
+        subtracting the smallest weight.
+
+        Returns
+        -------
+        A tuple of the sorted (state, weight) pairs and the subtracted
+        weight.
+
+        """
+        offset = min(states.values())
+        return (tuple(sorted((state, weight - offset)
+                             for state, weight in states.items())),
+                offset)
+
+    def _cached(self, key, compute):
+        if key in self.cache:
+            self.cache_statistics['hits'] += 1
+            # Mark the key as the most recently used one
+            value = self.cache.pop(key)
+            self.cache[key] = value
+            return value
+        self.cache_statistics['misses'] += 1
+        value = compute()
+        if self.cache_size:
+            self.cache[key] = value
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return value
+
+    def consume(self, states, character):
+        """Performs a transition followed by the epsilon closure.
+
+        The results are cached.
+
+        """
+        if not states:
+            return {}
+        signature, offset = self._signature(states)
+        next_states = self._cached(
+            (signature, character),
+            lambda: self.expand(self.transition(dict(signature), character)))
+        return {state: weight + offset
+                for state, weight in next_states.items()}
+
+    def costs(self, states, characters):
+        """Computes the costs of consuming each of the characters.
+
+        The cost of a character is the total weight of the states after
+        the transition and the epsilon closure minus the total weight of
+        `states`. The results are cached.
+
+        Parameters
+        ----------
+        states : dict
+            A non-empty {state: weight} dictionary.
+        characters : frozenset
+            The input symbols of interest.
+
+        Returns
+        -------
+        A {character: cost} dictionary, that contains only the characters
+        for which at least one arc exists. It should not be modified.
+
+        """
+        signature, _ = self._signature(states)
+
+        def compute():
+            states = dict(signature)
+            total_weight = self.combine_weights(*states.values())
+            # All characters are consumed in a single pass over the
+            # arcs, only the epsilon closure is done per character.
+            return {character: self.combine_weights(
+                        *self.expand(next_states).values()) - total_weight
+                    for character, next_states
+                    in self.transitions(states, characters).items()}
+        return self._cached((signature, characters), compute)
+
     def explain(self, input_):
         input_ = list(input_)
-        states = {self.fst.start: 0}
+        states = {self.start: 0}
         print("Initial states: {}".format(states))
         states = self.expand(states)
         print("Expanded states: {}".format(states))
@@ -111,11 +454,11 @@ class FST(object):
 
         result = None
         for state, weight in states.items():
-            if numpy.isfinite(weight + float(self.fst[state].final)):
+            if numpy.isfinite(weight + self.final_weight(state)):
                 print("Finite state {} with path weight {} and its own weight {}".format(
-                    state, weight, self.fst[state].final))
+                    state, weight, self.final_weight(state)))
                 result = self.combine_weights(
-                    result, weight + float(self.fst[state].final))
+                    result, weight + self.final_weight(state))
 
         print("Total weight: {}".format(result))
         return result
@@ -131,17 +474,37 @@ class FSTTransitionOp(Op):
     fst : FST instance
     remap_table : dict
         Maps neutral network characters to FST characters.
+    max_states : int, optional
+        The width of the state sets. When more states are reachable,
+        only `max_states` of them with the smallest weights are kept.
+    prune_threshold : float, optional
+        If given, the states with weights larger than the smallest
+        weight in the set plus `prune_threshold` are pruned.
 
     """
-    __props__ = ()
+    __props__ = ('max_states', 'prune_threshold')
 
-
-    def __init__(self, fst, remap_table):
+    def __init__(self, fst, remap_table, max_states=MAX_STATES,
+                 prune_threshold=None):
         self.fst = fst
         self.remap_table = remap_table
+        self.max_states = max_states
+        self.prune_threshold = prune_threshold
+
+    def prune(self, states):
+        if not states:
+            return states
+        if self.prune_threshold is not None:
+            threshold = min(states.values()) + self.prune_threshold
+            states = {state: weight for state, weight in states.items()
+                      if weight <= threshold}
+        if len(states) > self.max_states:
+            states = dict(heapq.nsmallest(
+                self.max_states, states.items(), key=lambda item: item[1]))
+        return states
 
     def pad(self, arr, value):
-        return numpy.pad(arr, (0, MAX_STATES - len(arr)),
+        return numpy.pad(arr, (0, self.max_states - len(arr)),
                          mode='constant', constant_values=value)
 
     def perform(self, node, inputs, output_storage):
@@ -153,10 +516,9 @@ class FSTTransitionOp(Op):
         all_next_weights = []
         for states, weights, input_ in equizip(all_states, all_weights, all_inputs):
             states_dict = dict(zip(states, weights))
-            del states_dict[NOT_STATE]
-            next_states_dict = self.fst.transition(
-                states_dict, self.remap_table[input_])
-            next_states_dict = self.fst.expand(next_states_dict)
+            states_dict.pop(NOT_STATE, None)
+            next_states_dict = self.prune(self.fst.consume(
+                states_dict, self.remap_table[input_]))
             if next_states_dict:
                 next_states, next_weights = zip(*next_states_dict.items())
             else:
@@ -205,21 +567,21 @@ class FSTCostsOp(Op):
 
     def perform(self, node, inputs, output_storage):
         all_states, all_weights = inputs
+        nn_characters = defaultdict(list)
+        for nn_character, fst_character in self.remap_table.items():
+            nn_characters[fst_character].append(nn_character)
+        fst_characters = frozenset(nn_characters)
 
         all_costs = []
         for states, weights in zip(all_states, all_weights):
             states_dict = dict(zip(states, weights))
-            del states_dict[NOT_STATE]
+            states_dict.pop(NOT_STATE, None)
             costs = (numpy.ones(len(self.remap_table), dtype=theano.config.floatX)
                      * self.no_transition_cost)
             if states_dict:
-                total_weight = self.fst.combine_weights(*states_dict.values())
-                for nn_character, fst_character in self.remap_table.items():
-                    next_states_dict = self.fst.transition(states_dict, fst_character)
-                    next_states_dict = self.fst.expand(next_states_dict)
-                    if next_states_dict:
-                        next_total_weight = self.fst.combine_weights(*next_states_dict.values())
-                        costs[nn_character] = next_total_weight - total_weight
+                for fst_character, cost in self.fst.costs(
+                        states_dict, fst_characters).items():
+                    costs[nn_characters[fst_character]] = cost
             all_costs.append(costs)
 
         output_storage[0][0] = numpy.array(all_costs)
@@ -233,13 +595,176 @@ class FSTCostsOp(Op):
             [states, weights], [theano.tensor.matrix()])
 
 
+def _truncated_matrices(ys, y_hats, eos_label, alphabet_size):
+    """Computes the rewards and the gains for truncated sequences.
+
+    A module level function, such that it can be sent to the workers
+    of a process pool.
+
+    Returns
+    -------
+    A list of (rewards, gains) pairs of matrices with one row more than
+    the length of the respective `y_hat`.
+
+    """
+    dist, _ = _edit_distance_matrices(ys, y_hats, with_actions=False)
+    result = []
+    for index, (y, y_hat) in enumerate(equizip(ys, y_hats)):
+        rewards = _reward_matrix(
+            dist[index, :len(y) + 1, :len(y_hat) + 1], y,
+            alphabet_size, eos_label)
+        result.append((rewards, _gain_matrix(rewards, y_hat)))
+    return result
+
+
+def _truncated_matrices_star(args):
+    return _truncated_matrices(*args)
+
+
+class RewardCache(object):
+    """Least recently used cache of reward and gain matrices.
+
+    The matrices are stored as a single `int16` array, or as an `int32`
+    one if their values do not fit into `int16`.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The maximum total size of the matrices kept in memory.
+    spill_path : str, optional
+        If given, the matrices evicted from memory are saved to this
+        directory and loaded back when requested again.
+
+    Attributes
+    ----------
+    statistics : dict
+        The numbers of hits in memory, hits on disk and misses.
+
+    """
+    def __init__(self, max_bytes, spill_path=None):
+        self.max_bytes = max_bytes
+        self.spill_path = spill_path
+        self.statistics = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+        self._matrices = OrderedDict()
+        self._num_bytes = 0
+        if spill_path and not os.path.exists(spill_path):
+            os.makedirs(spill_path)
+
+    def _spill_file(self, key):
+        return os.path.join(self.spill_path, key + '.npy')
+
+    def get(self, key):
+        """Returns the (rewards, gains) pair or ``None``."""
+        if key in self._matrices:
+            self.statistics['hits'] += 1
+            # Mark the key as the most recently used one
+            matrices = self._matrices.pop(key)
+            self._matrices[key] = matrices
+            return matrices[0], matrices[1]
+        if self.spill_path and os.path.exists(self._spill_file(key)):
+            self.statistics['disk_hits'] += 1
+            matrices = numpy.load(self._spill_file(key))
+            self._add(key, matrices)
+            return matrices[0], matrices[1]
+        self.statistics['misses'] += 1
+        return None
+
+    def put(self, key, rewards, gains):
+        matrices = numpy.array([rewards, gains])
+        limits = numpy.iinfo('int16')
+        if matrices.min() < limits.min or matrices.max() > limits.max:
+            self._add(key, matrices.astype('int32'))
+        else:
+            self._add(key, matrices.astype('int16'))
+
+    def _add(self, key, matrices):
+        if matrices.nbytes > self.max_bytes:
+            return
+        if key in self._matrices:
+            self._num_bytes -= self._matrices.pop(key).nbytes
+        self._matrices[key] = matrices
+        self._num_bytes += matrices.nbytes
+        while self._num_bytes > self.max_bytes and self._matrices:
+            evicted_key, evicted = self._matrices.popitem(last=False)
+            self._num_bytes -= evicted.nbytes
+            if (self.spill_path and
+                    not os.path.exists(self._spill_file(evicted_key))):
+                numpy.save(self._spill_file(evicted_key), evicted)
+
+
 class RewardOp(Op):
     __props__ = ()
 
-    def __init__(self, eos_label, alphabet_size):
-        """Computes matrices of rewards and gains."""
+    def __init__(self, eos_label, alphabet_size, num_workers=0,
+                 use_processes=False, cache_size=0, cache_spill_path=None):
+        """Computes matrices of rewards and gains.
+
+        Parameters
+        ----------
+        eos_label : int
+            The end of sequence label.
+        alphabet_size : int
+            The number of labels.
+        num_workers : int, optional
+            If positive, the batch columns are split between this many
+            workers of a pool.
+        use_processes : bool, optional
+            If ``True``, a pool of processes is used instead of a pool of
+            threads.
+        cache_size : int, optional
+            If positive, the matrices computed for the columns where the
+            recognized sequence is the groundtruth, which is always the
+            case for imitative exploration, are cached. The cache keeps
+            at most this many megabytes in memory.
+        cache_spill_path : str, optional
+            The directory where the matrices evicted from the cache are
+            saved, see :class:`RewardCache`.
+
+        """
         self.eos_label = eos_label
         self.alphabet_size = alphabet_size
+        self.num_workers = num_workers
+        self.use_processes = use_processes
+        self.cache_size = cache_size
+        self.cache_spill_path = cache_spill_path
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Pools can not be pickled, it is recreated when needed.
+        # The cache is not worth saving.
+        state.pop('_pool', None)
+        state.pop('_cache', None)
+        return state
+
+    def get_pool(self):
+        if not hasattr(self, '_pool'):
+            self._pool = (multiprocessing.Pool(self.num_workers)
+                          if self.use_processes
+                          else ThreadPool(self.num_workers))
+        return self._pool
+
+    def get_cache(self):
+        if not getattr(self, 'cache_size', 0):
+            return None
+        if not hasattr(self, '_cache'):
+            self._cache = RewardCache(self.cache_size * 2 ** 20,
+                                      self.cache_spill_path)
+        return self._cache
+
+    def compute_matrices(self, ys, y_hats):
+        num_workers = getattr(self, 'num_workers', 0)
+        if num_workers > 0 and len(ys) > 1:
+            columns = numpy.array_split(numpy.arange(len(ys)),
+                                        min(num_workers, len(ys)))
+            results = self.get_pool().map(
+                _truncated_matrices_star,
+                [([ys[index] for index in indices],
+                  [y_hats[index] for index in indices],
+                  self.eos_label, self.alphabet_size)
+                 for indices in columns])
+            return list(itertools.chain(*results))
+        return _truncated_matrices(ys, y_hats, self.eos_label,
+                                   self.alphabet_size)
 
     def perform(self, node, inputs, output_storage):
         groundtruth, recognized = inputs
@@ -247,39 +772,65 @@ class RewardOp(Op):
                 or groundtruth.shape[1] != recognized.shape[1]):
             raise ValueError
         batch_size = groundtruth.shape[1]
+        cache = self.get_cache()
+
+        ys = []
+        y_hats = []
+        for index in range(batch_size):
+            y = groundtruth[:, index]
+            y_hat = recognized[:, index]
+            eos_positions = numpy.flatnonzero(y == self.eos_label)
+            # Sometimes groundtruth is in fact also a prediction
+            # and in this case it might not have EOS label
+            if len(eos_positions):
+                y = y[:eos_positions[0] + 1]
+            eos_positions = numpy.flatnonzero(y_hat == self.eos_label)
+            if len(eos_positions):
+                y_hat = y_hat[:eos_positions[0] + 1]
+            if y[-1] != self.eos_label:
+                raise ValueError(
+                    "Last character of the groundtruth must be EOS")
+            ys.append(y)
+            y_hats.append(y_hat)
+
+        matrices = [None] * batch_size
+        keys = [None] * batch_size
+        # The first column of every key, the matrices of identical
+        # groundtruths in a batch are computed and cached once
+        first_indices = {}
+        if cache:
+            for index, (y, y_hat) in enumerate(equizip(ys, y_hats)):
+                if numpy.array_equal(y, y_hat):
+                    keys[index] = hashlib.sha1(
+                        y.astype('int64').tobytes()).hexdigest()
+                    if keys[index] in first_indices:
+                        continue
+                    first_indices[keys[index]] = index
+                    matrices[index] = cache.get(keys[index])
+        missing = [index for index in range(batch_size)
+                   if matrices[index] is None and
+                   first_indices.get(keys[index], index) == index]
+        computed = self.compute_matrices([ys[index] for index in missing],
+                                         [y_hats[index] for index in missing])
+        for index, (rewards, gains) in equizip(missing, computed):
+            matrices[index] = (rewards, gains)
+            if keys[index] is not None:
+                cache.put(keys[index], rewards, gains)
+        for index in range(batch_size):
+            if matrices[index] is None:
+                matrices[index] = matrices[first_indices[keys[index]]]
+
         all_rewards = numpy.zeros(
             recognized.shape + (self.alphabet_size,), dtype='int64')
         all_gains = numpy.zeros(
             recognized.shape + (self.alphabet_size,), dtype='int64')
-        alphabet = list(range(self.alphabet_size))
-        for index in range(batch_size):
-            y = list(groundtruth[:, index])
-            y_hat = list(recognized[:, index])
-            try:
-                eos_pos = y.index(self.eos_label)
-                y = y[:eos_pos + 1]
-            except:
-                # Sometimes groundtruth is in fact also a prediction
-                # and in this case it might not have EOS label
-                pass
-            if self.eos_label in y_hat:
-                y_hat_eos_pos = y_hat.index(self.eos_label)
-                y_hat_trunc = y_hat[:y_hat_eos_pos + 1]
-            else:
-                y_hat_trunc = y_hat
-            rewards_trunc = reward_matrix(
-                y, y_hat_trunc, alphabet, self.eos_label)
-            # pass freshly computed rewards to gain_matrix to speed things up
-            # a bit
-            gains_trunc = gain_matrix(y, y_hat_trunc, alphabet,
-                                      given_reward_matrix=rewards_trunc)
-            gains = numpy.ones((len(y_hat), len(alphabet))) * -1000
-            gains[:(gains_trunc.shape[0] - 1), :] = gains_trunc[:-1, :]
-
-            rewards = numpy.ones((len(y_hat), len(alphabet))) * -1
+        for index, (rewards_trunc, gains_trunc) in enumerate(matrices):
+            rewards = all_rewards[:, index, :]
+            rewards[:] = -1
             rewards[:(rewards_trunc.shape[0] - 1), :] = rewards_trunc[:-1, :]
-            all_rewards[:, index, :] = rewards
-            all_gains[:, index, :] = gains
+            gains = all_gains[:, index, :]
+            gains[:] = -1000
+            gains[:(gains_trunc.shape[0] - 1), :] = gains_trunc[:-1, :]
 
         output_storage[0][0] = all_rewards
         output_storage[1][0] = all_gains
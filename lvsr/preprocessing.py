@@ -10,30 +10,74 @@ def log_spectrogram(signal):
 logger = logging.getLogger(__name__)
 
 
+def feature_statistics(features):
+    """Returns the statistics of a matrix of feature vectors.
+
+    The statistics are the number of vectors, their mean and the sum of
+    squared deviations from the mean, see :func:`merge_statistics`.
+
+    """
+    features = numpy.asarray(features, dtype='float64')
+    mean = features.mean(axis=0)
+    return len(features), mean, ((features - mean) ** 2).sum(axis=0)
+
+
+def merge_statistics(first, second):
+    """Merges the statistics of two sets of feature vectors.
+
+    Uses the pairwise update of Chan et al., which unlike accumulating
+    sums of squares does not lose precision when the variance is small
+    compared to the mean.
+
+    """
+    first_count, first_mean, first_m2 = first
+    second_count, second_mean, second_m2 = second
+    if not second_count:
+        return first
+    if not first_count:
+        return second
+    count = first_count + second_count
+    delta = second_mean - first_mean
+    mean = first_mean + delta * second_count / float(count)
+    m2 = (first_m2 + second_m2 +
+          delta ** 2 * first_count * second_count / float(count))
+    return count, mean, m2
+
+
+# The statistics of an empty set
+NO_STATISTICS = (0, 0., 0.)
+
+
 class Normalization(object):
 
     def __init__(self, data_stream, source):
         index = data_stream.sources.index(source)
 
-        sum_features = 0
-        sum_features2 = 0
-        num_examples = 0
-
+        statistics = NO_STATISTICS
         iterator = data_stream.get_epoch_iterator()
         for number, data in enumerate(iterator):
-            features = data[index]
-            sum_features += features.sum(axis=0)
-            sum_features2 += (features ** 2).sum(axis=0)
-            num_examples += len(features)
+            statistics = merge_statistics(
+                statistics, feature_statistics(data[index]))
         logger.info("Used {} examples to compute normalization".format(number + 1))
 
-        mean_features = sum_features / num_examples
-        std_features = (sum_features2 / num_examples - mean_features ** 2) ** 0.5
-
-        self.mean_features = mean_features
-        self.std_features = std_features
+        self.set_statistics(statistics)
         self.index = index
 
+    @classmethod
+    def from_statistics(cls, statistics, index):
+        """Creates the normalization from precomputed statistics."""
+        normalization = cls.__new__(cls)
+        normalization.set_statistics(statistics)
+        normalization.index = index
+        return normalization
+
+    def set_statistics(self, statistics):
+        count, mean, m2 = statistics
+        # The statistics are accumulated in double precision, but the
+        # features are stored in single precision
+        self.mean_features = mean.astype('float32')
+        self.std_features = ((m2 / count) ** 0.5).astype('float32')
+
     def apply(self, data):
         data = list(data)
         data[self.index] = ((data[self.index] - self.mean_features)
@@ -0,0 +1,224 @@
+"""Scoring of decoded transcripts without Kaldi.
+
+The hypotheses are read in the format written by ``run.py search
+--decoded-save``: an utterance id followed by the recognized characters.
+The references are Kaldi text files, i.e. an utterance id followed by
+the words. Like ``compute-wer --mode=all`` an utterance without a
+hypothesis is scored as if nothing was recognized.
+
+"""
+from __future__ import print_function
+import logging
+import multiprocessing
+import os
+from itertools import imap, islice
+
+from lvsr.error_rate import alignments, edit_distances
+
+logger = logging.getLogger(__name__)
+
+# The columns of the statistics gathered for every utterance
+WORDS, INSERTIONS, DELETIONS, SUBSTITUTIONS, CHARACTERS, CHARACTER_ERRORS = \
+    range(6)
+
+
+def read_lexicon(path, spc='<spc>'):
+    """Reads a map from the spellings to the words of a lexicon."""
+    lexicon = {}
+    with open(path) as lexicon_file:
+        for line in lexicon_file:
+            line = line.strip().split()
+            if not line:
+                continue
+            word = line[0]
+            chars = line[1:]
+            if chars and chars[-1] == spc:
+                chars = chars[:-1]
+            lexicon[''.join(chars)] = word
+    return lexicon
+
+
+def chars_to_words(chars, lexicon=None, spc='<spc>'):
+    spellings = [spelling for spelling in ''.join(chars).split(spc)
+                 if spelling]
+    if lexicon is None:
+        return spellings
+    return [lexicon.get(spelling, spelling) for spelling in spellings]
+
+
+def read_transcripts(path):
+    """Lazily reads (utterance id, tokens) pairs from a text file."""
+    with open(path) as transcripts_file:
+        for line in transcripts_file:
+            line = line.strip().split()
+            if not line:
+                continue
+            yield line[0], line[1:]
+
+
+def score_utterances(utterances, ignore=()):
+    """Aligns the words and counts the errors of a few utterances.
+
+    Parameters
+    ----------
+    utterances : list of tuples
+        (utterance id, reference words, hypothesis words) for every
+        utterance.
+    ignore : collection
+        Words dropped from both sides before scoring.
+
+    Returns
+    -------
+    list of tuples
+        (utterance id, statistics, alignment) for every utterance, the
+        statistics are indexed by the module constants.
+
+    """
+    ignore = set(ignore)
+    uttids = [uttid for uttid, _, _ in utterances]
+    references = [[word for word in reference if word not in ignore]
+                  for _, reference, _ in utterances]
+    hypotheses = [[word for word in hypothesis if word not in ignore]
+                  for _, _, hypothesis in utterances]
+    character_errors = edit_distances(
+        [' '.join(reference) for reference in references],
+        [' '.join(hypothesis) for hypothesis in hypotheses])
+    results = []
+    for uttid, reference, alignment, errors in zip(
+            uttids, references,
+            alignments(references, hypotheses), character_errors):
+        statistics = [0] * 6
+        statistics[WORDS] = len(reference)
+        for word, recognized in alignment:
+            if word is None:
+                statistics[INSERTIONS] += 1
+            elif recognized is None:
+                statistics[DELETIONS] += 1
+            elif word != recognized:
+                statistics[SUBSTITUTIONS] += 1
+        statistics[CHARACTERS] = len(' '.join(reference))
+        statistics[CHARACTER_ERRORS] = int(errors)
+        results.append((uttid, statistics, alignment))
+    return results
+
+
+def _score_utterances_star(args):
+    return score_utterances(*args)
+
+
+def format_alignment(uttid, alignment):
+    """Formats an alignment like Kaldi's align-text."""
+    rows = [[], [], []]
+    for word, recognized in alignment:
+        if word is None:
+            operation = 'I'
+        elif recognized is None:
+            operation = 'D'
+        elif word != recognized:
+            operation = 'S'
+        else:
+            operation = 'C'
+        word = word if word is not None else '***'
+        recognized = recognized if recognized is not None else '***'
+        width = max(len(word), len(recognized))
+        rows[0].append(word.ljust(width))
+        rows[1].append(recognized.ljust(width))
+        rows[2].append(operation.ljust(width))
+    return ''.join("{} {} {}\n".format(uttid, name, ' '.join(row).rstrip())
+                   for name, row in zip(['ref', 'hyp', 'op'], rows))
+
+
+def _error_rate(errors, total):
+    return 100. * errors / max(total, 1)
+
+
+def score(hypotheses, references, lexicon, report, spc, ignore,
+          workers, chunk_size):
+    """Scores decoded utterances against references.
+
+    The hypotheses are streamed through a pool of `workers` processes in
+    chunks of `chunk_size` utterances. The per-utterance alignments and a
+    summary of WER and CER are saved to the `report` directory.
+
+    """
+    if lexicon:
+        lexicon = read_lexicon(lexicon, spc)
+    else:
+        lexicon = None
+    pending = dict(read_transcripts(references))
+
+    def read_utterances():
+        for uttid, chars in read_transcripts(hypotheses):
+            if uttid not in pending:
+                logger.warning("No reference for utterance {}".format(uttid))
+                continue
+            yield (uttid, pending.pop(uttid),
+                   chars_to_words(chars, lexicon, spc))
+        # Utterances without hypotheses are scored as empty ones
+        for uttid in sorted(pending):
+            logger.warning("No hypothesis for utterance {}".format(uttid))
+            yield uttid, pending[uttid], []
+
+    def read_chunks():
+        utterances = read_utterances()
+        while True:
+            chunk = list(islice(utterances, chunk_size))
+            if not chunk:
+                break
+            yield chunk, ignore
+
+    if report and not os.path.exists(report):
+        os.makedirs(report)
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(_score_utterances_star, read_chunks())
+    else:
+        results = imap(_score_utterances_star, read_chunks())
+
+    totals = [0] * 6
+    num_utterances = 0
+    num_wrong_utterances = 0
+    alignments_file = per_utterance_file = None
+    try:
+        if report:
+            alignments_file = open(
+                os.path.join(report, 'alignments.txt'), 'w')
+            per_utterance_file = open(
+                os.path.join(report, 'per_utt.txt'), 'w')
+            print("# uttid words ins del sub chars char_errors",
+                  file=per_utterance_file)
+        for chunk_results in results:
+            for uttid, statistics, alignment in chunk_results:
+                num_utterances += 1
+                num_wrong_utterances += bool(
+                    sum(statistics[INSERTIONS:SUBSTITUTIONS + 1]))
+                totals = [total + value
+                          for total, value in zip(totals, statistics)]
+                if report:
+                    alignments_file.write(format_alignment(uttid, alignment))
+                    print(uttid, *statistics, file=per_utterance_file)
+    finally:
+        if pool:
+            pool.terminate()
+        for report_file in [alignments_file, per_utterance_file]:
+            if report_file:
+                report_file.close()
+
+    word_errors = sum(totals[INSERTIONS:SUBSTITUTIONS + 1])
+    summary = (
+        "%WER {:.2f} [ {} / {}, {} ins, {} del, {} sub ]\n"
+        "%CER {:.2f} [ {} / {} ]\n"
+        "%SER {:.2f} [ {} / {} ]\n".format(
+            _error_rate(word_errors, totals[WORDS]),
+            word_errors, totals[WORDS], totals[INSERTIONS],
+            totals[DELETIONS], totals[SUBSTITUTIONS],
+            _error_rate(totals[CHARACTER_ERRORS], totals[CHARACTERS]),
+            totals[CHARACTER_ERRORS], totals[CHARACTERS],
+            _error_rate(num_wrong_utterances, num_utterances),
+            num_wrong_utterances, num_utterances))
+    print(summary, end='')
+    if report:
+        with open(os.path.join(report, 'summary.txt'), 'w') as summary_file:
+            summary_file.write(summary)
+    return totals
@@ -0,0 +1,45 @@
+import os
+import tempfile
+
+import numpy
+from numpy.testing import assert_equal
+from fuel.datasets import IndexableDataset
+from fuel.schemes import SequentialScheme
+from fuel.streams import DataStream
+
+from lvsr.datasets import _LengthFilter
+from lvsr.datasets.cache import CachedStream
+
+
+class _CountingStream(DataStream):
+    epochs = 0
+
+    def get_epoch_iterator(self, **kwargs):
+        self.epochs += 1
+        return super(_CountingStream, self).get_epoch_iterator(**kwargs)
+
+
+def _epoch(stream):
+    return [[piece.copy() for piece in data]
+            for data in stream.get_epoch_iterator()]
+
+
+def test_cached_stream():
+    dataset = IndexableDataset(
+        {'features': numpy.arange(30, dtype='float32').reshape(10, 3),
+         'targets': numpy.arange(10)})
+    length_filter = _LengthFilter(index=0, max_length=None)
+    for path in [None, os.path.join(tempfile.mkdtemp(), 'cache')]:
+        wrapped = _CountingStream(
+            dataset, iteration_scheme=SequentialScheme(10, 4))
+        expected = _epoch(wrapped)
+        stream = CachedStream(wrapped, path=path, length_filter=length_filter)
+        assert_equal(_epoch(stream), expected)
+        assert_equal(_epoch(stream), expected)
+        assert wrapped.epochs == 2
+
+        length_filter.max_length = 5
+        assert_equal(_epoch(stream), expected)
+        assert wrapped.epochs == 3
+        length_filter.max_length = None
+        stream.close()
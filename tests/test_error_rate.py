@@ -1,9 +1,15 @@
+import tempfile
+
 import numpy
+import theano
 from numpy.testing import assert_equal, assert_allclose
+from theano import tensor
+
 from lvsr.error_rate import (
-    _edit_distance_matrix, wer,
-    reward_matrix, gain_matrix)
-from lvsr.ops import RewardOp
+    _edit_distance_matrix, _edit_distance_matrices, _length_groups,
+    edit_distance, edit_distances, alignments, wer, reward_matrix,
+    gain_matrix, COPY, DELETION, SUBSTITUTION)
+from lvsr.ops import RewardCache, RewardOp
 
 
 def test_edit_distance_matrix():
@@ -26,6 +32,115 @@ def test_edit_distance_matrix():
     assert_equal(action, action_should_be)
 
 
+def _python_edit_distance_matrix(y, y_hat):
+    """The straightforward implementation, used as the reference."""
+    dist = numpy.zeros((len(y) + 1, len(y_hat) + 1), dtype='int64')
+    action = dist.copy()
+    dist[:, 0] = numpy.arange(len(y) + 1)
+    dist[0, :] = numpy.arange(len(y_hat) + 1)
+    for i in range(1, len(y) + 1):
+        for j in range(1, len(y_hat) + 1):
+            cost = int(y[i - 1] != y_hat[j - 1])
+            insertion_dist = dist[i - 1][j] + 1
+            deletion_dist = dist[i][j - 1] + 1
+            diagonal_dist = dist[i - 1][j - 1] + cost
+            best = min(insertion_dist, deletion_dist, diagonal_dist)
+            dist[i][j] = best
+            if best == insertion_dist:
+                action[i][j] = action[i - 1][j]
+            if best == deletion_dist:
+                action[i][j] = DELETION
+            if best == diagonal_dist:
+                action[i][j] = SUBSTITUTION if cost else COPY
+    return dist, action
+
+
+def _random_pairs(rng, num_pairs, max_length, alphabet_size):
+    return [(list(rng.randint(alphabet_size,
+                              size=rng.randint(max_length + 1))),
+             list(rng.randint(alphabet_size,
+                              size=rng.randint(max_length + 1))))
+            for _ in range(num_pairs)]
+
+
+def test_edit_distance_matrix_random():
+    rng = numpy.random.RandomState(1)
+    for y, y_hat in _random_pairs(rng, 200, 10, 4):
+        dist, action = _edit_distance_matrix(y, y_hat)
+        dist_should_be, action_should_be = _python_edit_distance_matrix(
+            y, y_hat)
+        assert_equal(dist, dist_should_be)
+        assert_equal(action, action_should_be)
+
+
+def test_edit_distance_matrices():
+    rng = numpy.random.RandomState(1)
+    pairs = _random_pairs(rng, 50, 10, 4) + [([], [1]), ([1, 2], [])]
+    ys, y_hats = zip(*pairs)
+    dist, action = _edit_distance_matrices(ys, y_hats)
+    for k, (y, y_hat) in enumerate(pairs):
+        dist_should_be, action_should_be = _python_edit_distance_matrix(
+            y, y_hat)
+        assert_equal(dist[k, :len(y) + 1, :len(y_hat) + 1], dist_should_be)
+        assert_equal(action[k, :len(y) + 1, :len(y_hat) + 1],
+                     action_should_be)
+    assert_equal(edit_distances(ys, y_hats),
+                 [edit_distance(y, y_hat) for y, y_hat in pairs])
+
+
+def test_alignments():
+    rng = numpy.random.RandomState(1)
+    pairs = _random_pairs(rng, 20, 10, 4) + [([], [1]), ([1, 2], [])]
+    ys, y_hats = zip(*pairs)
+    for (y, y_hat), alignment in zip(pairs, alignments(ys, y_hats)):
+        assert [s for s, _ in alignment if s is not None] == list(y)
+        assert [s for _, s in alignment if s is not None] == list(y_hat)
+        assert sum(s != s_hat for s, s_hat in alignment) == \
+            edit_distance(y, y_hat)
+    assert alignments(['abdce'], ['abcd']) == [
+        [('a', 'a'), ('b', 'b'), ('d', None), ('c', 'c'), ('e', 'd')]]
+
+
+def test_edit_distance_long():
+    rng = numpy.random.RandomState(1)
+    pairs = [(list(rng.randint(30, size=120)), list(rng.randint(30, size=100)))
+             for _ in range(2)]
+    ys, y_hats = zip(*pairs)
+    dist, action = _edit_distance_matrices(ys, y_hats)
+    for k, (y, y_hat) in enumerate(pairs):
+        dist_should_be, action_should_be = _python_edit_distance_matrix(
+            y, y_hat)
+        assert_equal(_edit_distance_matrix(y, y_hat),
+                     (dist_should_be, action_should_be))
+        assert_equal(dist[k], dist_should_be)
+        assert_equal(action[k], action_should_be)
+
+
+def test_length_groups():
+    rng = numpy.random.RandomState(1)
+    pairs = _random_pairs(rng, 50, 30, 4) + [(range(100), range(90))]
+    ys, y_hats = zip(*pairs)
+    groups = _length_groups(ys, y_hats, max_cells=2000)
+    assert sorted(sum(groups, [])) == range(len(pairs))
+    for group in groups:
+        cells = (len(group) * max(len(ys[index]) + 1 for index in group) *
+                 max(len(y_hats[index]) + 1 for index in group))
+        assert cells <= 2000 or len(group) == 1
+
+    # Pairs of very different lengths are computed in different groups
+    pairs.append((range(1500), range(1, 1501)))
+    ys, y_hats = zip(*pairs)
+    assert_equal(edit_distances(ys, y_hats),
+                 [edit_distance(y, y_hat) for y, y_hat in pairs])
+    assert [sum(s != s_hat for s, s_hat in alignment)
+            for alignment in alignments(ys, y_hats)] == \
+        [edit_distance(y, y_hat) for y, y_hat in pairs]
+    dist, action = _edit_distance_matrices(ys[:2], y_hats[:2],
+                                           with_actions=False)
+    assert action is None
+    assert_equal(dist, _edit_distance_matrices(ys[:2], y_hats[:2])[0])
+
+
 def test_reward_matrix():
     matrix = reward_matrix('abc$', 'abc$', 'abc$', eos_label=3)
     should_be = numpy.array([[ 0, -1, -1, -3],
@@ -126,3 +241,77 @@ def test_reward_op():
     result = op([[4]], [[1], [2]])
     for r in result:
         r.eval()
+
+    # The results must not depend on the use of a pool
+    pool_op = RewardOp(4, 7, num_workers=2)
+    pool_rewards_var, pool_gains_var = pool_op(groundtruth, recognized)
+    assert_equal(pool_rewards_var.eval(), rewards_should_be)
+    assert_equal(pool_gains_var.eval(), gains_should_be)
+
+
+def test_reward_op_cache():
+    groundtruth = [
+        [0, 1, 2],
+        [1, 2, 4],
+        [4, 4, 4]]
+    recognized = [
+        [0, 1, 2],
+        [2, 2, 4],
+        [4, 4, 4]]
+    op = RewardOp(4, 7)
+    cached_op = RewardOp(4, 7, cache_size=1)
+    for _ in range(2):
+        for y_hat in [groundtruth, recognized]:
+            for result, cached_result in zip(op(groundtruth, y_hat),
+                                             cached_op(groundtruth, y_hat)):
+                assert_equal(cached_result.eval(), result.eval())
+    # Every groundtruth is computed once, the other columns are not cached
+    assert cached_op.get_cache().statistics['misses'] == 3
+
+
+def test_reward_op_cache_repeated():
+    rng = numpy.random.RandomState(1)
+    sequences = [numpy.append(rng.randint(0, 4, size=length), 4)
+                 for length in [2, 5, 3]]
+    # A cache for about two of the sequences
+    cached_op = RewardOp(4, 7, cache_size=700. / 2 ** 20)
+    cache = cached_op.get_cache()
+    groundtruth_var = tensor.lmatrix('groundtruth')
+    cached_outputs = theano.function(
+        [groundtruth_var], cached_op(groundtruth_var, groundtruth_var))
+    outputs = theano.function(
+        [groundtruth_var], RewardOp(4, 7)(groundtruth_var, groundtruth_var))
+    for step in range(20):
+        # Repeated groundtruths within a batch and across batches
+        numbers = rng.randint(0, len(sequences), size=4)
+        groundtruth = numpy.zeros((6, 4), dtype='int64') + 4
+        for index, number in enumerate(numbers):
+            groundtruth[:len(sequences[number]), index] = sequences[number]
+        for result, cached_result in zip(outputs(groundtruth),
+                                         cached_outputs(groundtruth)):
+            assert_equal(cached_result, result)
+        assert cache._num_bytes == sum(
+            matrices.nbytes for matrices in cache._matrices.values())
+        assert cache._num_bytes <= cache.max_bytes
+        assert cache._matrices
+
+
+def test_reward_cache():
+    rng = numpy.random.RandomState(1)
+    matrices = [(rng.randint(-50, 50, size=(5, 7)),
+                 rng.randint(-50, 50, size=(5, 7))) for _ in range(3)]
+    # Values that do not fit into int16
+    matrices.append((matrices[0][0] * 1000, matrices[0][1] - 40000))
+    cache = RewardCache(max_bytes=300, spill_path=tempfile.mkdtemp())
+    for key, (rewards, gains) in enumerate(matrices):
+        cache.put(str(key), rewards, gains)
+    for key, (rewards, gains) in enumerate(matrices):
+        assert_equal(cache.get(str(key)), (rewards, gains))
+    assert cache.statistics['disk_hits'] > 0
+    assert cache.get('missing') is None
+
+    # Putting a key again replaces its matrices
+    cache = RewardCache(max_bytes=300)
+    for _ in range(3):
+        cache.put('0', *matrices[0])
+    assert cache._num_bytes == cache._matrices['0'].nbytes
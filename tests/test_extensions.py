@@ -0,0 +1,133 @@
+import os
+import tempfile
+from collections import namedtuple
+
+import numpy
+import theano
+from fuel.datasets import IterableDataset
+from numpy.testing import assert_allclose
+from theano import tensor
+
+from blocks.algorithms import GradientDescent, Scale
+from blocks.extensions import FinishAfter, SimpleExtension
+from blocks.extensions.predicates import OnLogRecord
+from blocks.extensions.saveload import SAVED_TO, Checkpoint
+from blocks.extensions.training import TrackTheBest
+from blocks.log import TrainingLog
+from blocks.main_loop import MainLoop
+from blocks.model import Model
+from blocks.roles import PARAMETER, add_role
+from blocks.serialization import load_parameters
+from blocks.utils import shared_floatx
+
+from lvsr.extensions import AsyncDataStreamMonitoring, Patience
+
+
+class _Record(SimpleExtension):
+    """Records the status and the parameter when it is called."""
+    def __init__(self, parameter, **kwargs):
+        super(_Record, self).__init__(**kwargs)
+        self.parameter = parameter
+        self.calls = []
+
+    def do(self, which_callback, *args):
+        self.calls.append((self.main_loop.status['iterations_done'],
+                           self.parameter.get_value().copy()))
+
+
+def test_async_data_stream_monitoring():
+    features = [numpy.array([f, f + 1], dtype=theano.config.floatX)
+                for f in range(10)]
+    x = tensor.vector('features')
+    W = shared_floatx([0, 0], name='W')
+    add_role(W, PARAMETER)
+    cost = ((x * W).sum() - 1) ** 2
+    cost.name = 'cost'
+
+    history = _Record(W, after_batch=True)
+    delayed = _Record(W)
+    path = os.path.join(tempfile.mkdtemp(), 'best.tar')
+    # Like the best PER in lvsr.main
+    track_the_best = TrackTheBest('valid_cost').set_conditions()
+    monitoring = (
+        AsyncDataStreamMonitoring(
+            [cost], IterableDataset(dict(features=features[:3]))
+            .get_example_stream(), prefix='valid')
+        .set_conditions(every_n_batches=2)
+        .add_delayed_extension(delayed)
+        .add_delayed_extension(track_the_best)
+        .add_delayed_extension(
+            Checkpoint(path, save_main_loop=False).set_conditions(),
+            OnLogRecord(track_the_best.notification_name)))
+    try:
+        monitoring.add_delayed_extension(Checkpoint(path))
+    except ValueError:
+        pass
+    else:
+        assert False
+    main_loop = MainLoop(
+        model=Model(cost),
+        data_stream=IterableDataset(dict(features=features))
+        .get_example_stream(),
+        algorithm=GradientDescent(cost=cost, parameters=[W],
+                                  step_rule=Scale(0.01)),
+        extensions=[history, monitoring, FinishAfter(after_n_epochs=1)])
+    main_loop.run()
+
+    # Monitoring is skipped while a process is running, but the results
+    # of the last process are waited for after training
+    values = dict(history.calls)
+    assert delayed.calls
+    for iteration, value in delayed.calls:
+        assert iteration % 2 == 0
+        assert_allclose(value, values[iteration])
+        expected_cost = numpy.mean([((value * f).sum() - 1) ** 2
+                                    for f in features[:3]])
+        assert_allclose(main_loop.log[iteration]['valid_cost'],
+                        expected_cost, rtol=1e-5)
+    # The best parameters are saved for the rows of the delayed records
+    best_iterations = [
+        iteration for iteration, _ in delayed.calls
+        if track_the_best.notification_name in main_loop.log[iteration]]
+    assert best_iterations
+    for iteration, row in main_loop.log.items():
+        assert ((path in row.get(SAVED_TO, ())) ==
+                (iteration in best_iterations))
+    assert_allclose(load_parameters(open(path, 'rb'))['W'],
+                    values[best_iterations[-1]])
+    # The status and the parameters are restored
+    assert main_loop.status['iterations_done'] == 10
+    assert_allclose(W.get_value(), values[10])
+
+
+def test_patience_delayed():
+    _MainLoop = namedtuple('_MainLoop', ['log'])
+
+    def make_patience():
+        patience = Patience(['valid_per_best_so_far'], min_iterations=4,
+                            patience_factor=3)
+        patience.main_loop = _MainLoop(TrainingLog())
+        return patience
+
+    for delayed in [False, True]:
+        patience = make_patience()
+        log = patience.main_loop.log
+        if delayed:
+            # A delayed improvement is written to a past row
+            log.status['iterations_done'] = 5
+            log.current_row['valid_per_best_so_far'] = True
+            patience.do('after_epoch', 'update_best')
+            assert 'training_finish_requested' not in log.current_row
+        log.status['iterations_done'] = 10
+        patience.do('after_epoch')
+        assert log.current_row.get('training_finish_requested') != delayed
+        assert log.status['patience_iterations'] == (15 if delayed else 4)
+
+    # An older delayed improvement does not reset the patience
+    patience = make_patience()
+    log = patience.main_loop.log
+    for iteration in [8, 5]:
+        log.status['iterations_done'] = iteration
+        log.current_row['valid_per_best_so_far'] = True
+        patience.do('after_epoch', 'update_best')
+    assert patience.last_best_iter == 8
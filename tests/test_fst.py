@@ -0,0 +1,223 @@
+import math
+import tempfile
+from collections import defaultdict, deque, namedtuple
+
+import numpy
+from numpy.testing import assert_allclose
+from toposort import toposort_flatten
+
+from lvsr import ops
+from lvsr.ops import (
+    EPSILON, FST, FSTCostsOp, FSTTransitionOp, NOT_STATE, fst_to_arrays)
+
+_Arc = namedtuple('_Arc', ['ilabel', 'nextstate', 'weight'])
+_State = namedtuple('_State', ['stateid', 'arcs', 'final'])
+
+# (state, input label, next state, weight), the arcs of a state are not
+# sorted by label and two of them lead to the same state with the same
+# label. The epsilon arcs form a DAG.
+ARCS = [(0, 1, 1, 0.5), (0, 2, 3, 0.3), (0, 1, 2, 1.0), (0, 0, 1, 2.0),
+        (1, 1, 1, 0.2), (1, 3, 4, 0.1), (1, 1, 1, 0.7), (1, 0, 3, 0.4),
+        (2, 2, 2, 0.6), (2, 0, 4, 0.25), (2, 3, 0, 1.5),
+        (3, 1, 0, 0.9), (3, 0, 4, 0.05)]
+FINALS = [float('inf'), float('inf'), 0.0, float('inf'), 0.5]
+ISYMS = {'<eps>': 0, 'a': 1, 'b': 2, 'c': 3}
+STATE_SETS = [{0: 0.0}, {1: 0.3, 2: 1.0}, {0: 1.0, 3: 0.5, 4: 0.0},
+              {4: 0.2}, {2: -3.0, 3: 7.0}]
+
+
+class _ToyFST(object):
+    """Mimics the part of a PyFST FST used by :func:`fst_to_arrays`."""
+    start = 0
+    isyms = ISYMS
+
+    @property
+    def states(self):
+        return [_State(state, [_Arc(ilabel, next_state, weight)
+                               for arc_state, ilabel, next_state, weight
+                               in ARCS if arc_state == state], final)
+                for state, final in enumerate(FINALS)]
+
+
+def _combine_weights(*args):
+    m = max(args)
+    return m - math.log(sum(math.exp(m - x) for x in args if x is not None))
+
+
+def _reference_transition(states, character):
+    """Walks all arcs, like FST did before the arcs were indexed."""
+    arcs = [arc for arc in ARCS if arc[0] in states and arc[1] == character]
+    return {next_state: _combine_weights(
+                *[states[arc[0]] + arc[3] for arc in arcs
+                  if arc[2] == next_state])
+            for next_state in {arc[2] for arc in arcs}}
+
+
+def _reference_expand(states):
+    states = dict(states)
+    depends = defaultdict(list)
+    queue = deque(states)
+    seen = set(states)
+    while queue:
+        state = queue.popleft()
+        for arc_state, ilabel, next_state, weight in ARCS:
+            if arc_state == state and ilabel == EPSILON:
+                depends[next_state].append((state, weight))
+                if next_state not in seen:
+                    queue.append(next_state)
+                    seen.add(next_state)
+    for next_state in toposort_flatten(
+            {key: {state for state, _ in value}
+             for key, value in depends.items()}):
+        states[next_state] = _combine_weights(
+            *([states.get(next_state)] +
+              [states[prev_state] + weight
+               for prev_state, weight in depends[next_state]]))
+    return states
+
+
+def _reference_cost(states, character):
+    next_states = _reference_expand(_reference_transition(states, character))
+    if not next_states:
+        return None
+    return (_combine_weights(*next_states.values()) -
+            _combine_weights(*states.values()))
+
+
+def _assert_states_close(states, expected):
+    assert sorted(states) == sorted(expected)
+    for state in expected:
+        assert_allclose(states[state], expected[state])
+
+
+def _load_fsts(cache_size=10000):
+    """Returns the toy FST read from a file and memory mapped."""
+    pyfst = getattr(ops, 'fst', None)
+    ops.fst = namedtuple('_PyFST', ['read'])(lambda path: _ToyFST())
+    try:
+        indexed = FST('toy.fst', cache_size=cache_size)
+        indexed.load()
+        compiled_path = tempfile.mkdtemp()
+        ops.compile_fst('toy.fst', compiled_path)
+        compiled = FST(compiled_path, cache_size=cache_size)
+        compiled.load()
+    finally:
+        if pyfst is None:
+            del ops.fst
+        else:
+            ops.fst = pyfst
+    return indexed, compiled
+
+
+def test_fst_to_arrays():
+    arrays = fst_to_arrays(_ToyFST())
+    assert arrays['offsets'].tolist() == [0, 4, 8, 11, 13, 13]
+    assert arrays['ilabels'].tolist() == [0, 1, 1, 2, 0, 1, 1, 3,
+                                          0, 2, 3, 0, 1]
+    # The order of the arcs with the same label is kept
+    assert arrays['next_states'][1:3].tolist() == [1, 2]
+    assert int(arrays['start']) == 0
+
+
+def test_fst_transitions():
+    characters = frozenset(ISYMS.values()) - {EPSILON}
+    for fst in _load_fsts():
+        assert fst.isyms == ISYMS
+        assert fst.start == 0
+        assert fst.final_weight(2) == 0.0
+        for states in STATE_SETS:
+            transitions = fst.transitions(states, characters)
+            costs = fst.costs(states, characters)
+            for character in characters:
+                expected = _reference_transition(states, character)
+                _assert_states_close(fst.transition(states, character),
+                                     expected)
+                _assert_states_close(transitions.get(character, {}),
+                                     expected)
+                _assert_states_close(fst.consume(states, character),
+                                     _reference_expand(expected))
+                expected_cost = _reference_cost(states, character)
+                if expected_cost is None:
+                    assert character not in costs
+                else:
+                    assert_allclose(costs[character], expected_cost)
+            _assert_states_close(fst.expand(dict(states)),
+                                 _reference_expand(states))
+
+
+def test_fst_cache():
+    characters = frozenset([1, 2, 3])
+    for fst in _load_fsts(cache_size=2):
+        costs = fst.costs({1: 0.3, 2: 1.0}, characters)
+        # Adding a constant to all weights does not change the costs
+        assert fst.costs({1: 1.3, 2: 2.0}, characters) == costs
+        assert fst.cache_statistics == {'hits': 1, 'misses': 1}
+        _assert_states_close(
+            fst.consume({1: 1.3, 2: 2.0}, 1),
+            {state: weight + 1.0 for state, weight
+             in fst.consume({1: 0.3, 2: 1.0}, 1).items()})
+        assert fst.cache_statistics == {'hits': 2, 'misses': 2}
+        # The least recently used result is evicted
+        fst.consume({0: 0.0}, 1)
+        fst.costs({1: 0.3, 2: 1.0}, characters)
+        assert fst.cache_statistics == {'hits': 2, 'misses': 4}
+
+        uncached = _load_fsts(cache_size=0)[0]
+        uncached.costs({0: 0.0}, characters)
+        uncached.costs({0: 0.0}, characters)
+        assert uncached.cache_statistics == {'hits': 0, 'misses': 2}
+        assert not uncached.cache
+
+
+def test_fst_ops():
+    remap_table = {0: 1, 1: 2, 2: 3, 3: 1}
+    all_states = numpy.array([[0, NOT_STATE, NOT_STATE],
+                              [1, 2, NOT_STATE],
+                              [NOT_STATE, NOT_STATE, NOT_STATE]])
+    all_weights = numpy.array([[0.0, 0.0, 0.0],
+                               [0.3, 1.0, 0.0],
+                               [0.0, 0.0, 0.0]])
+    for fst in _load_fsts():
+        costs_op = FSTCostsOp(fst, remap_table, no_transition_cost=1000)
+        output_storage = [[None]]
+        costs_op.perform(None, [all_states, all_weights], output_storage)
+        costs, = output_storage[0]
+        for states, weights, row in zip(all_states, all_weights, costs):
+            states = {state: weight for state, weight in zip(states, weights)
+                      if state != NOT_STATE}
+            for nn_character, fst_character in remap_table.items():
+                expected = (_reference_cost(states, fst_character)
+                            if states else None)
+                assert_allclose(row[nn_character],
+                                1000 if expected is None else expected)
+
+        transition_op = FSTTransitionOp(fst, remap_table, max_states=3)
+        output_storage = [[None], [None]]
+        transition_op.perform(
+            None, [all_states, all_weights, numpy.array([1, 0, 0])],
+            output_storage)
+        next_states, next_weights = output_storage[0][0], output_storage[1][0]
+        assert next_states.shape == next_weights.shape == (3, 3)
+        _assert_states_close(
+            {state: weight for state, weight
+             in zip(next_states[0], next_weights[0]) if state != NOT_STATE},
+            _reference_expand(_reference_transition({0: 0.0}, 2)))
+        assert (next_states[2] == NOT_STATE).all()
+
+
+def test_fst_transition_op_prune():
+    states = {0: 0.5, 1: 3.0, 2: 0.1, 3: 2.0, 4: 1.0}
+    assert FSTTransitionOp(None, {}, max_states=5).prune(states) == states
+    assert FSTTransitionOp(None, {}, max_states=2).prune(states) == {
+        2: 0.1, 0: 0.5}
+    assert FSTTransitionOp(
+        None, {}, max_states=5, prune_threshold=1.0).prune(states) == {
+            2: 0.1, 0: 0.5, 4: 1.0}
+    assert FSTTransitionOp(
+        None, {}, max_states=2, prune_threshold=1.5).prune(states) == {
+            2: 0.1, 0: 0.5}
+    assert FSTTransitionOp(None, {}, max_states=2).prune({}) == {}
+    assert (FSTTransitionOp(None, {}, max_states=2) ==
+            FSTTransitionOp(None, {}, max_states=2))
+    assert (FSTTransitionOp(None, {}, max_states=2) !=
+            FSTTransitionOp(None, {}, max_states=3))
@@ -0,0 +1,64 @@
+import os
+import tempfile
+
+import numpy
+import theano
+from numpy.testing import assert_allclose
+from theano import tensor
+from theano.compile import SharedVariable
+from theano.configparser import change_flags
+
+from lvsr import function_cache
+from lvsr.function_cache import FunctionCache
+
+NET_CONFIG = {'dim': 3, 'name': 'recognizer'}
+
+
+def _shared_inputs(function):
+    return [input_.variable for input_ in function.maker.inputs
+            if isinstance(input_.variable, SharedVariable)]
+
+
+def test_function_cache():
+    directory = tempfile.mkdtemp()
+    x = tensor.vector('x')
+    W = theano.shared(
+        numpy.arange(3, dtype=theano.config.floatX), name='W')
+    y = (x * W).sum()
+    updates = [(W, 2 * W)]
+    value = numpy.ones(3, dtype=theano.config.floatX)
+
+    def compile_(cache):
+        return cache.function([x], y, updates=updates, name='f')
+
+    compiled = compile_(FunctionCache(directory, NET_CONFIG))
+    assert len(os.listdir(directory)) == 1
+    loaded = compile_(FunctionCache(directory, dict(NET_CONFIG)))
+    # A hit loads the function instead of compiling a new one
+    assert len(os.listdir(directory)) == 1
+    assert loaded is not compiled
+    assert _shared_inputs(loaded) == [W]
+    assert_allclose(loaded(value), 3)
+    assert_allclose(W.get_value(), [0, 2, 4])
+    assert_allclose(compiled(value), 6)
+    assert_allclose(W.get_value(), [0, 4, 8])
+    W.set_value(numpy.ones(3, dtype=theano.config.floatX))
+    assert_allclose(loaded(value), compiled(value) / 2)
+
+    # Any change of the key is a miss
+    compile_(FunctionCache(directory, dict(NET_CONFIG, dim=4)))
+    assert len(os.listdir(directory)) == 2
+    change_flags(compute_test_value='ignore')(compile_)(
+        FunctionCache(directory, NET_CONFIG))
+    assert len(os.listdir(directory)) == 3
+    code_version = function_cache.code_version
+    function_cache.code_version = lambda packages: 'changed'
+    try:
+        changed = compile_(FunctionCache(directory, NET_CONFIG))
+    finally:
+        function_cache.code_version = code_version
+    assert len(os.listdir(directory)) == 4
+    assert _shared_inputs(changed) == [W]
+    # So is another graph
+    FunctionCache(directory, NET_CONFIG).function([x], 2 * y)
+    assert len(os.listdir(directory)) == 5
@@ -0,0 +1,24 @@
+from lvsr.log_backends import NDarrayLog
+
+
+def test_delayed_records():
+    log = NDarrayLog()
+    for iteration in range(30):
+        log.status['iterations_done'] = iteration
+        log.current_row['cost'] = float(iteration)
+        if iteration % 10 == 0:
+            log.current_row['per'] = 0.5
+    log[15]['per'] = 0.3
+    log[25]['per'] = 0.2
+    log[25]['per'] = 0.1
+    log[5]['delayed'] = True
+    log.status['iterations_done'] = 30
+    log.current_row['cost'] = 30.
+
+    assert log[15]['per'] == 0.3
+    assert log[25]['per'] == 0.1
+    assert log[20]['per'] == 0.5
+    assert log[5]['delayed']
+    assert dict(log[15]) == {'cost': 15., 'per': 0.3}
+    per = log.to_pandas()['per'].dropna()
+    assert list(per.index) == [0, 10, 15, 20, 25]
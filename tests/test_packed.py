@@ -0,0 +1,110 @@
+import os
+import tempfile
+
+import h5py
+import numpy
+from fuel.datasets.hdf5 import H5PYDataset
+from numpy.testing import assert_equal
+
+from lvsr.datasets.h5py import H5PYAudioDataset
+from lvsr.datasets.packed import PackedAudioDataset, pack_hdf5
+
+SOURCES = ('recordings', 'labels', 'uttids')
+
+
+def _add_vlen(h5file, name, examples, dtype):
+    dataset = h5file.create_dataset(
+        name, (len(examples),), dtype=h5py.special_dtype(vlen=dtype))
+    shapes = h5file.create_dataset(
+        name + '_shapes', (len(examples), examples[0].ndim), dtype='int32')
+    for number, example in enumerate(examples):
+        dataset[number] = example.ravel()
+        shapes[number] = example.shape
+    shape_labels = h5file.create_dataset(
+        name + '_shape_labels', (examples[0].ndim,), dtype='S7')
+    shape_labels[...] = ['frame', 'feature'][:examples[0].ndim]
+    dataset.dims[0].label = 'batch'
+    dataset.dims.create_scale(shapes, 'shapes')
+    dataset.dims[0].attach_scale(shapes)
+    dataset.dims.create_scale(shape_labels, 'shape_labels')
+    dataset.dims[0].attach_scale(shape_labels)
+    return dataset
+
+
+def _make_h5(path, num_examples, num_train, test_labels_start=None):
+    """Writes a dataset like the one of `bin/kaldi2fuel.py`."""
+    rng = numpy.random.RandomState(1)
+    with h5py.File(path, 'w') as h5file:
+        _add_vlen(h5file, 'recordings',
+                  [rng.uniform(size=(length, 3)).astype('float32')
+                   for length in rng.randint(1, 20, size=num_examples)],
+                  numpy.dtype('float32'))
+        labels = _add_vlen(h5file, 'labels',
+                           [rng.randint(1, 3, size=length).astype('int32')
+                            for length in rng.randint(1, 6,
+                                                      size=num_examples)],
+                           numpy.dtype('int32'))
+        labels.attrs['value_map'] = numpy.array(
+            [('<eol>', 0), ('a', 1), ('b', 2)],
+            dtype=[('key', 'S5'), ('val', 'int32')])
+        uttids = h5file.create_dataset(
+            'uttids', (num_examples,), dtype=h5py.special_dtype(vlen=unicode))
+        uttids[...] = [u'utt{}'.format(number)
+                       for number in range(num_examples)]
+        uttids.dims[0].label = 'batch'
+        split = {
+            'train': {source: (0, num_train) for source in SOURCES},
+            'test': {source: (num_train, num_examples)
+                     for source in SOURCES}}
+        if test_labels_start is not None:
+            split['test']['labels'] = (test_labels_start, num_examples)
+        h5file.attrs['split'] = H5PYDataset.create_split_array(split)
+
+
+def test_pack_hdf5():
+    directory = tempfile.mkdtemp()
+    h5_path = os.path.join(directory, 'data.h5')
+    packed_path = os.path.join(directory, 'packed')
+    _make_h5(h5_path, 11, 7)
+    pack_hdf5(h5_path, packed_path, chunk_size=3)
+
+    for which_sets in [('train',), ('test',), ('test', 'train')]:
+        h5_dataset = H5PYAudioDataset(
+            file_or_path=h5_path, which_sets=which_sets,
+            target_source='labels', sources=SOURCES)
+        packed_dataset = PackedAudioDataset(
+            packed_path, which_sets, target_source='labels',
+            sources=SOURCES)
+        assert packed_dataset.num_examples == h5_dataset.num_examples
+        assert packed_dataset.char2num == h5_dataset.char2num
+        assert packed_dataset.dim('recordings') == 3
+        assert_equal(packed_dataset.example_lengths('recordings'),
+                     h5_dataset.example_lengths('recordings'))
+        requests = ([range(h5_dataset.num_examples)] +
+                    range(h5_dataset.num_examples))
+        for request in requests:
+            h5_data = h5_dataset.get_data(request=request)
+            packed_data = packed_dataset.get_data(request=request)
+            for source, h5_examples, packed_examples in zip(
+                    SOURCES, h5_data, packed_data):
+                if isinstance(request, int):
+                    h5_examples = [h5_examples]
+                    packed_examples = [packed_examples]
+                assert len(packed_examples) == len(h5_examples)
+                for h5_example, packed_example in zip(h5_examples,
+                                                      packed_examples):
+                    assert_equal(packed_example, h5_example)
+                    if source == 'uttids':
+                        assert isinstance(packed_example, unicode)
+                    else:
+                        assert packed_example.dtype == h5_example.dtype
+        h5_dataset.close(None)
+
+    # The sources of a packed split must consist of the same examples
+    _make_h5(h5_path, 11, 7, test_labels_start=6)
+    try:
+        pack_hdf5(h5_path, os.path.join(directory, 'mismatched'))
+    except ValueError:
+        pass
+    else:
+        assert False
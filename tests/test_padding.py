@@ -0,0 +1,43 @@
+import numpy
+from numpy.testing import assert_equal
+from fuel.datasets import IndexableDataset
+from fuel.schemes import SequentialScheme
+from fuel.streams import DataStream
+from fuel.transformers import Padding
+
+from lvsr.datasets import TimeMajorPadding
+
+
+def test_time_major_padding():
+    rng = numpy.random.RandomState(1)
+    features = [rng.uniform(size=(length, 3)).astype('float32')
+                for length in [4, 2, 5, 1, 3, 7, 2]]
+    labels = [numpy.arange(length) for length in [2, 3, 1, 4, 2, 5, 3]]
+
+    def make_stream():
+        dataset = IndexableDataset({'features': features, 'labels': labels})
+        return DataStream(dataset, iteration_scheme=SequentialScheme(7, 3))
+
+    stream = TimeMajorPadding(make_stream())
+    assert stream.sources == Padding(make_stream()).sources
+    expected_iterator = Padding(make_stream()).get_epoch_iterator()
+    # A batch is only valid until the pool of buffers is reused, so
+    # batches are compared as soon as they are produced
+    for data in stream.get_epoch_iterator():
+        expected = next(expected_iterator)
+        for piece, expected_piece in zip(data, expected):
+            assert piece.flags.c_contiguous
+            assert piece.dtype == expected_piece.dtype
+            assert_equal(piece, expected_piece.swapaxes(0, 1))
+    assert stream.statistics['batches'] == 3
+    assert stream.statistics['bytes_copied'] == (
+        sum(example.nbytes for example in features + labels))
+
+    # The batches alternate between the buffers of the pool, after two
+    # epochs every buffer has held the largest batch
+    for _ in stream.get_epoch_iterator():
+        pass
+    allocations = stream.statistics['allocations']
+    for _ in stream.get_epoch_iterator():
+        assert stream.batch_statistics['allocations'] == 0
+    assert stream.statistics['allocations'] == allocations
@@ -0,0 +1,59 @@
+import numpy
+from numpy.testing import assert_equal
+from fuel.datasets import IndexableDataset
+from fuel.schemes import ConstantScheme, SequentialScheme, ShuffledScheme
+from fuel.streams import DataStream
+from fuel.transformers import Batch
+
+from lvsr.datasets import TimeMajorPadding, WindowShuffle
+from lvsr.datasets.prefetch import Prefetch
+
+
+def _epochs(stream, num_epochs):
+    return [[[piece.copy() for piece in data]
+             for data in stream.get_epoch_iterator()]
+            for _ in range(num_epochs)]
+
+
+def test_prefetch():
+    def make_stream():
+        dataset = IndexableDataset(
+            {'features': numpy.arange(60, dtype='float32').reshape(20, 3),
+             'targets': numpy.arange(20)})
+        return DataStream(dataset, iteration_scheme=ShuffledScheme(
+            20, 3, rng=numpy.random.RandomState(1)))
+
+    stream = Prefetch(make_stream(), num_batches=2, buffer_size=64)
+    assert stream.sources == make_stream().sources
+    # Every epoch is shuffled differently, as without prefetching
+    assert_equal(_epochs(stream, 3), _epochs(make_stream(), 3))
+
+
+def test_prefetch_epoch_state():
+    features = [numpy.zeros((length, 2), dtype='float32') + number
+                for number, length in enumerate([4, 2, 5, 1, 3, 7, 2, 6, 3])]
+
+    def make_stream():
+        dataset = IndexableDataset({'features': features})
+        # The examples are shuffled within windows while the epoch is
+        # iterated over, that is in the prefetching process
+        stream = WindowShuffle(
+            DataStream(dataset, iteration_scheme=SequentialScheme(9, 2)),
+            4, rng=numpy.random.RandomState(1))
+        return TimeMajorPadding(Batch(
+            stream, iteration_scheme=ConstantScheme(3)))
+
+    stream = Prefetch(make_stream(), num_batches=2)
+    expected_stream = make_stream()
+    epochs = _epochs(stream, 4)
+    assert_equal(epochs, _epochs(expected_stream, 4))
+    # The windows are shuffled differently in every epoch
+    orders = [[list(data[stream.sources.index('features')][0, :, 0])
+               for data in epoch] for epoch in epochs]
+    assert any(order != orders[0] for order in orders[1:])
+    # The statistics of the padding are passed back, the buffers are
+    # allocated again in every prefetching process though
+    for key in ['batches', 'bytes_copied']:
+        assert (stream.data_stream.statistics[key] ==
+                expected_stream.statistics[key])
+    assert stream.data_stream.statistics['batches'] == 12
@@ -0,0 +1,46 @@
+import numpy
+from fuel.datasets import IterableDataset
+from numpy.testing import assert_allclose
+
+from lvsr.preprocessing import (
+    NO_STATISTICS, Normalization, feature_statistics, merge_statistics)
+
+
+def test_merge_statistics():
+    rng = numpy.random.RandomState(1)
+    # A large mean and a small variance, where sums of squares would
+    # lose precision
+    shards = [1e6 + rng.normal(scale=1e-2, size=(size, 3))
+              for size in [1, 2, 300, 7, 50]]
+    features = numpy.concatenate(shards)
+
+    def merge_all(shard_statistics):
+        statistics = NO_STATISTICS
+        for shard in shard_statistics:
+            statistics = merge_statistics(statistics, shard)
+        return statistics
+
+    shard_statistics = [feature_statistics(shard) for shard in shards]
+    pairs = [merge_all(shard_statistics[:2]), merge_all(shard_statistics[2:])]
+    for statistics in [merge_all(shard_statistics),
+                       merge_all(shard_statistics[::-1]),
+                       merge_all(pairs + [NO_STATISTICS])]:
+        count, mean, m2 = statistics
+        assert count == len(features)
+        assert_allclose(mean, features.mean(axis=0), rtol=1e-12)
+        assert_allclose((m2 / count) ** 0.5, features.std(axis=0),
+                        rtol=1e-6)
+
+    normalization = Normalization(
+        IterableDataset({'features': shards}).get_example_stream(),
+        'features')
+    assert_allclose(normalization.mean_features, features.mean(axis=0),
+                    rtol=1e-7)
+    assert_allclose(normalization.std_features, features.std(axis=0),
+                    rtol=1e-6)
+    from_statistics = Normalization.from_statistics(
+        merge_all(shard_statistics), 0)
+    assert_allclose(from_statistics.mean_features,
+                    normalization.mean_features)
+    assert_allclose(from_statistics.std_features,
+                    normalization.std_features)
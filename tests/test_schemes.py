@@ -0,0 +1,127 @@
+import numpy
+
+from fuel.datasets import IndexableDataset
+from fuel.streams import DataStream
+
+from lvsr.datasets import FrameBudgetBatch, _LengthFilter, WindowShuffle
+from lvsr.datasets.prefetch import Prefetch
+from lvsr.datasets.schemes import (
+    BlockShuffledScheme, LengthBucketScheme, LengthIndexScheme)
+
+
+def test_length_bucket_scheme():
+    rng = numpy.random.RandomState(1)
+    lengths = rng.randint(10, 1000, size=1003)
+    length_filter = _LengthFilter(index=0, max_length=None)
+    scheme = LengthBucketScheme(lengths, 10, 20, length_filter=length_filter,
+                                rng=rng)
+
+    indices = list(scheme.get_request_iterator())
+    assert sorted(indices) == range(len(lengths))
+    # All batches but the last one are full and come from one or two
+    # neighbouring buckets
+    batches = [lengths[indices[i:i + 10]] for i in range(0, 1000, 10)]
+    padded = sum(batch.max() * len(batch) for batch in batches)
+    assert sum(batch.sum() for batch in batches) > 0.9 * padded
+
+    length_filter.max_length = 800
+    indices = list(scheme.get_request_iterator())
+    assert sorted(indices) == list(numpy.where(lengths <= 800)[0])
+
+
+def test_length_index_scheme():
+    lengths = numpy.array([5, 1, 7, 3, 9, 2, 8])
+    length_filter = _LengthFilter(index=0, max_length=8)
+    scheme = LengthIndexScheme(lengths, [0, 1, 2, 3, 4, 5],
+                               length_filter=length_filter, sort_window=3)
+    assert list(scheme.get_request_iterator()) == [1, 0, 2, 5, 3]
+
+    length_filter.max_length = None
+    scheme = LengthIndexScheme(lengths, length_filter=length_filter,
+                               shuffle=True, sort_window=2)
+    indices = list(scheme.get_request_iterator())
+    assert sorted(indices) == range(len(lengths))
+    for i in range(0, len(indices) - 1, 2):
+        assert lengths[indices[i]] <= lengths[indices[i + 1]]
+
+
+def test_block_shuffled_scheme():
+    lengths = numpy.array([5, 1, 7, 3, 2, 9, 8, 4, 6, 2])
+    length_filter = _LengthFilter(index=0, max_length=8)
+    scheme = BlockShuffledScheme(lengths, 4, length_filter=length_filter,
+                                 rng=numpy.random.RandomState(1))
+    requests = list(scheme.get_request_iterator())
+    assert all(isinstance(request, slice) for request in requests)
+    # The too long example 5 splits its block in two reads
+    assert len(requests) == 4
+    indices = sum([range(request.start, request.stop)
+                   for request in requests], [])
+    assert sorted(indices) == [0, 1, 2, 3, 4, 6, 7, 8, 9]
+
+    dataset = IndexableDataset({'lengths': lengths})
+    stream = WindowShuffle(
+        DataStream(dataset, iteration_scheme=scheme), 6,
+        rng=numpy.random.RandomState(1))
+    examples = [example for example, in stream.get_epoch_iterator()]
+    assert sorted(examples) == sorted(lengths[indices])
+
+    # Every epoch is shuffled differently, also when prefetched
+    def make_stream():
+        return WindowShuffle(
+            DataStream(dataset, iteration_scheme=BlockShuffledScheme(
+                lengths, 4, length_filter=length_filter,
+                rng=numpy.random.RandomState(1))),
+            6, rng=numpy.random.RandomState(1))
+
+    stream = make_stream()
+    epochs = [[example for example, in stream.get_epoch_iterator()]
+              for _ in range(4)]
+    assert all(sorted(epoch) == sorted(examples) for epoch in epochs)
+    assert len(set(tuple(epoch) for epoch in epochs)) > 1
+    stream = Prefetch(make_stream(), num_batches=2)
+    assert [[int(example) for example, in stream.get_epoch_iterator()]
+            for _ in range(4)] == epochs
+
+
+def test_frame_budget_batch():
+    rng = numpy.random.RandomState(1)
+    lengths = rng.randint(1, 30, size=50)
+    # An example longer than the budget
+    lengths[7] = 120
+    label_lengths = rng.randint(1, 5, size=50)
+    dataset = IndexableDataset(
+        {'frames': [numpy.zeros((length, 2)) + number
+                    for number, length in enumerate(lengths)],
+         'labels': [numpy.arange(length) for length in label_lengths]})
+
+    def padded_size(batch, labels_index):
+        size = len(batch) * max(len(frames) for frames, _ in batch)
+        if labels_index is not None:
+            size *= max(len(labels) for _, labels in batch)
+        return size
+
+    for max_batch_size, labels_index in [(None, None), (4, None), (None, 1)]:
+        budget = 100 if labels_index is None else 200
+        stream = FrameBudgetBatch(
+            dataset.get_example_stream(), budget,
+            max_batch_size=max_batch_size,
+            frames_index=dataset.sources.index('frames'),
+            labels_index=labels_index and dataset.sources.index('labels'))
+        for _ in range(2):
+            batches = [list(zip(*[data[dataset.sources.index(source)]
+                                  for source in ['frames', 'labels']]))
+                       for data in stream.get_epoch_iterator()]
+            # Every example is emitted once and in order, including
+            # the ones of the last, partial batch
+            assert [frames[0, 0] for batch in batches
+                    for frames, _ in batch] == range(50)
+            for batch, next_batch in zip(batches, batches[1:] + [None]):
+                assert (len(batch) == 1 or
+                        padded_size(batch, labels_index) <= budget)
+                assert not max_batch_size or len(batch) <= max_batch_size
+                # A batch is cut only when the next example does not fit
+                if next_batch and len(batch) != max_batch_size:
+                    assert padded_size(batch + next_batch[:1],
+                                       labels_index) > budget
+            assert [len(frames) for frames, _ in batches[-1]] == \
+                list(lengths[-len(batches[-1]):])
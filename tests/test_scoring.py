@@ -0,0 +1,95 @@
+import os
+import tempfile
+
+from lvsr.error_rate import edit_distance
+from lvsr.scoring import (
+    CHARACTER_ERRORS, CHARACTERS, DELETIONS, INSERTIONS, SUBSTITUTIONS,
+    WORDS, chars_to_words, format_alignment, read_lexicon, score)
+
+LEXICON = """HELLO h e l l o <spc>
+WORLD w o r l d <spc>
+THE t h e <spc>
+CAT c a t <spc>
+
+SAT s a t
+"""
+# The hypotheses are recognized characters, utt4 has no reference and
+# utt3 no hypothesis
+HYPOTHESES = """utt1 h e l l o <spc> w o r l d
+utt2 t h e <spc> c a t s <spc> s a t <spc> d o w n <spc>
+utt4 c a t
+utt5 g o
+"""
+REFERENCES = """utt1 HELLO WORLD
+utt2 THE CAT SAT
+utt3 A B
+utt5 <NOISE> GO
+"""
+# The words the hypotheses above should be mapped to
+WORDS_EXPECTED = {'utt1': ['HELLO', 'WORLD'],
+                  'utt2': ['THE', 'cats', 'SAT', 'down'],
+                  'utt3': [],
+                  'utt5': ['go']}
+
+
+def _write(directory, name, text):
+    path = os.path.join(directory, name)
+    with open(path, 'w') as destination:
+        destination.write(text)
+    return path
+
+
+def test_read_lexicon():
+    directory = tempfile.mkdtemp()
+    lexicon = read_lexicon(_write(directory, 'lexicon.txt', LEXICON))
+    assert lexicon == {'hello': 'HELLO', 'world': 'WORLD', 'the': 'THE',
+                       'cat': 'CAT', 'sat': 'SAT'}
+
+
+def test_chars_to_words():
+    chars = 'h e l l o <spc> <spc> w o r l d <spc>'.split()
+    assert chars_to_words(chars) == ['hello', 'world']
+    assert chars_to_words(chars, {'hello': 'HELLO'}) == ['HELLO', 'world']
+    assert chars_to_words([]) == []
+
+
+def test_format_alignment():
+    alignment = [('THE', 'THE'), ('CAT', 'cats'), (None, 'A'), ('SAT', None)]
+    assert format_alignment('utt2', alignment) == (
+        "utt2 ref THE CAT  *** SAT\n"
+        "utt2 hyp THE cats A   ***\n"
+        "utt2 op C   S    I   D\n")
+
+
+def test_score():
+    directory = tempfile.mkdtemp()
+    lexicon = _write(directory, 'lexicon.txt', LEXICON)
+    hypotheses = _write(directory, 'hypotheses.txt', HYPOTHESES)
+    references = _write(directory, 'references.txt', REFERENCES)
+    all_references = {}
+    for line in REFERENCES.splitlines():
+        line = line.split()
+        all_references[line[0]] = [word for word in line[1:]
+                                    if word != '<NOISE>']
+
+    word_errors = sum(edit_distance(all_references[uttid], words)
+                      for uttid, words in WORDS_EXPECTED.items())
+    character_errors = sum(
+        edit_distance(' '.join(all_references[uttid]), ' '.join(words))
+        for uttid, words in WORDS_EXPECTED.items())
+    for workers, chunk_size in [(1, 10), (2, 1)]:
+        report = os.path.join(directory, 'report{}'.format(workers))
+        totals = score(hypotheses, references, lexicon, report, '<spc>',
+                       ['<NOISE>'], workers, chunk_size)
+        assert totals[WORDS] == 8
+        assert (totals[INSERTIONS] + totals[DELETIONS] +
+                totals[SUBSTITUTIONS]) == word_errors == 5
+        assert totals[DELETIONS] == 2
+        assert totals[CHARACTERS] == sum(
+            len(' '.join(words)) for words in all_references.values())
+        assert totals[CHARACTER_ERRORS] == character_errors
+        with open(os.path.join(report, 'per_utt.txt')) as per_utterance:
+            assert len(per_utterance.readlines()) == 5
+        with open(os.path.join(report, 'summary.txt')) as summary:
+            assert summary.readline().startswith(
+                "%WER 62.50 [ 5 / 8, 1 ins, 2 del, 2 sub ]")